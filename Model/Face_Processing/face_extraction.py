@@ -1,29 +1,32 @@
-import cv2
 from .face_grouping import FaceGrouper
 import os
-import torch
 import uuid
-from facenet_pytorch import MTCNN
 from PIL import Image
-import matplotlib.pyplot as plt
 import numpy as np
 import shutil
 import json
 
+from model_registry import get_model
+
 class FaceProcessor:
     def __init__(self, directory="extracted_faces", output_folder="grouped_faces") -> None:
         self.directory = directory
         self.output_folder = output_folder
 
-        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        self.mtcnn = MTCNN(keep_all=True, device=self.device)
         self.face_grouper = None
 
+    @property
+    def mtcnn(self):
+        # loaded on the first detection and shared by every FaceProcessor
+        return get_model("mtcnn")
+
     def show_extracted_faces(self, faces, title="Extracted Faces"):
         num_faces = len(faces)
         cols = min(5, num_faces)
         rows = (num_faces + cols - 1) // cols  
 
+        import matplotlib.pyplot as plt
+
         plt.figure(figsize=(15, rows * 3))
         for i, face in enumerate(faces):
             path = os.path.join(self.directory, face)
@@ -1,14 +1,12 @@
 # from deepface import DeepFace
 import os
 import shutil
-from facenet_pytorch import InceptionResnetV1
-import torch
-import torchvision.transforms as transforms
 from PIL import Image
 import numpy as np
 import json
 import pickle
-import matplotlib.pyplot as plt
+
+from model_registry import get_model
 
 JSON_FILE = "grouped_faces.json"
 EMBEDDINGS_FILE = "embeddings.pkl"
@@ -35,14 +33,10 @@ class FaceGrouper:
         
         self.face_to_image_map = face_to_image_map if face_to_image_map else {}
 
-        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        self.model = InceptionResnetV1(pretrained='vggface2').eval().to(self.device)
         self.target_size = (160, 160)
-        self.transform = transforms.Compose([
-                        transforms.Resize(self.target_size),
-                        transforms.ToTensor(),
-                        transforms.Normalize([0.5], [0.5])
-                    ])
+        # built on the first embedding, with the model, so grouping faces that are
+        # already embedded never imports torch
+        self.transform = None
         
         self.faces_embeddings = {}
         self.grouped_faces = {}
@@ -110,10 +104,25 @@ class FaceGrouper:
 
         self.save_all()
 
+    @property
+    def model(self):
+        return get_model("inception_resnet")
+
     def get_face_embedding(self, face_path):
-        img = self.transform(Image.open(face_path)).unsqueeze(0).to(self.device)
+        import torch
+        import torchvision.transforms as transforms
+
+        if self.transform is None:
+            self.transform = transforms.Compose([
+                            transforms.Resize(self.target_size),
+                            transforms.ToTensor(),
+                            transforms.Normalize([0.5], [0.5])
+                        ])
+        model = self.model
+        device = next(model.parameters()).device
+        img = self.transform(Image.open(face_path)).unsqueeze(0).to(device)
         with torch.no_grad():
-            embedding = self.model(img).cpu().numpy()
+            embedding = model(img).cpu().numpy()
         return embedding
     
     def cosine_similarity(self, a, b):
@@ -181,6 +190,8 @@ class FaceGrouper:
             cols = min(3, num_faces)
             rows = (num_faces + cols - 1) // cols  
 
+            import matplotlib.pyplot as plt
+
             plt.figure(figsize=(12, rows * 3))
             for i, face in enumerate(faces):
                 path = os.path.join(self.face_folder, face)
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+
+AUGMENT_CACHE_PATH = os.getenv("AUGMENT_CACHE_PATH", os.path.join("data", "cache", "query_augmentation.sqlite3"))
+# how long augmentations for an explicitly given reference date (benchmarks) are kept
+AUGMENT_CACHE_PINNED_TTL_DAYS = int(os.getenv("AUGMENT_CACHE_PINNED_TTL_DAYS", "30"))
+
+
+def augment_key(query, today, detect_faces, llm, system_prompt):
+    # the prompt is part of the key so editing prompt_templates.py does not serve stale augmentations
+    return hashlib.sha256(
+        "\0".join([query, today, str(bool(detect_faces)), llm, system_prompt]).encode("utf-8")).hexdigest()
+
+
+def end_of_day(day: date):
+    return datetime.combine(day + timedelta(days=1), datetime.min.time()).timestamp()
+
+
+class AugmentCache():
+    """
+    Persistent cache of query augmentations keyed by (query, today, detect_faces, llm, prompt).
+
+    Augmenting resolves relative dates ("last week") against today, so an entry
+    for the current date expires at midnight. Entries for another reference date
+    (e.g. the Memex benchmark) cannot go stale and are kept for pinned_ttl_days.
+    """
+    def __init__(self, path: str = AUGMENT_CACHE_PATH,
+                 pinned_ttl_days: int = AUGMENT_CACHE_PINNED_TTL_DAYS) -> None:
+        self.path = path
+        self.pinned_ttl_days = pinned_ttl_days
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS augmentations ("
+            "key TEXT PRIMARY KEY, query TEXT, today TEXT, result TEXT, expires_at REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS augmentations_expires_at ON augmentations(expires_at)")
+        self.connection.commit()
+
+    def expires_at(self, today):
+        current = date.today()
+        if today == current.isoformat():
+            return end_of_day(current)
+        return time.time() + self.pinned_ttl_days * 24 * 3600
+
+    def get(self, query, today, detect_faces, llm, system_prompt):
+        """Return the cached augmentation or None."""
+        key = augment_key(query, today, detect_faces, llm, system_prompt)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT result FROM augmentations WHERE key = ? AND expires_at > ?", (key, time.time())).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, query, today, detect_faces, llm, system_prompt, result):
+        key = augment_key(query, today, detect_faces, llm, system_prompt)
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO augmentations (key, query, today, result, expires_at) VALUES (?, ?, ?, ?, ?)",
+                (key, query, today, json.dumps(result, ensure_ascii=False), self.expires_at(today)))
+            self.connection.execute("DELETE FROM augmentations WHERE expires_at <= ?", (time.time(),))
+            self.connection.commit()
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "items": self.connection.execute("SELECT COUNT(*) FROM augmentations").fetchone()[0],
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def get_augment_cache():
+    """The cache shared by every OpenAIWrapper of this process."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = AugmentCache()
+        return _shared_cache
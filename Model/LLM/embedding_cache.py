@@ -0,0 +1,210 @@
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join("data", "cache", "embeddings.sqlite3"))
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv("EMBEDDING_CACHE_MEMORY_ITEMS", "10000"))
+
+
+def embedding_key(model, text):
+    return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache():
+    """
+    Content addressed embedding cache keyed by (model, sha256(text)).
+
+    Two tiers: an in-memory LRU of recently used vectors in front of a sqlite file
+    shared by every user, process and run. Vectors are stored as float32. When the
+    file grows over max_bytes the least recently used rows are deleted.
+
+    The stored bytes are counted once when the cache opens and kept up to date by
+    puts and evictions. Lookups only note the access time in memory; it is written
+    with the next put (or by flush()), so reads never write to the file.
+    """
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH,
+                 max_bytes: int = EMBEDDING_CACHE_MAX_BYTES,
+                 memory_items: int = EMBEDDING_CACHE_MEMORY_ITEMS) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, model TEXT, vector BLOB, size INTEGER, last_access REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings(last_access)")
+        self.connection.commit()
+        self.disk_bytes = self._disk_bytes()
+        # key -> last access not written yet
+        self.pending_access = {}
+
+    def _remember(self, key, vector):
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def get_many(self, model, texts):
+        """Return a list aligned with texts with the cached float32 vector or None."""
+        keys = [embedding_key(model, text) for text in texts]
+        vectors = [None] * len(texts)
+        missing = {}
+
+        now = time.time()
+        with self.lock:
+            for i, key in enumerate(keys):
+                vector = self.memory.get(key)
+                if vector is not None:
+                    self.memory.move_to_end(key)
+                    self.pending_access[key] = now
+                    vectors[i] = vector
+                    self.memory_hits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+
+            if missing:
+                missing_keys = list(missing)
+                # stay below sqlite's limit of variables per statement
+                for start in range(0, len(missing_keys), 500):
+                    chunk = missing_keys[start:start + 500]
+                    rows = self.connection.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                        chunk).fetchall()
+                    for key, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32)
+                        self._remember(key, vector)
+                        self.pending_access[key] = now
+                        for i in missing.pop(key):
+                            vectors[i] = vector
+                            self.disk_hits += 1
+
+            self.misses += sum(len(indices) for indices in missing.values())
+        return vectors
+
+    def put_many(self, model, texts, embeddings):
+        rows = []
+        now = time.time()
+        with self.lock:
+            for text, embedding in zip(texts, embeddings):
+                if embedding is None:
+                    continue
+                key = embedding_key(model, text)
+                vector = np.asarray(embedding, dtype=np.float32)
+                self._remember(key, vector)
+                blob = vector.tobytes()
+                rows.append((key, model, blob, len(blob), now))
+
+            if not rows:
+                return
+            # replaced rows no longer count
+            replaced = self._stored_sizes([row[0] for row in rows])
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, size, last_access) VALUES (?, ?, ?, ?, ?)",
+                rows)
+            self.disk_bytes += sum(row[3] for row in rows) - sum(replaced.values())
+            for row in rows:
+                self.pending_access.pop(row[0], None)
+            self._write_access()
+            self.connection.commit()
+            if self.disk_bytes > self.max_bytes:
+                self._evict()
+
+    def _stored_sizes(self, keys):
+        sizes = {}
+        keys = list(dict.fromkeys(keys))
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            sizes.update(self.connection.execute(
+                f"SELECT key, size FROM embeddings WHERE key IN ({','.join('?' * len(chunk))})", chunk).fetchall())
+        return sizes
+
+    def _write_access(self):
+        """Write the noted access times, the caller commits."""
+        if not self.pending_access:
+            return
+        self.connection.executemany("UPDATE embeddings SET last_access = ? WHERE key = ?",
+                                    [(when, key) for key, when in self.pending_access.items()])
+        self.pending_access = {}
+
+    def flush(self):
+        """Write the access times noted by lookups."""
+        with self.lock:
+            if self.pending_access:
+                self._write_access()
+                self.connection.commit()
+
+    def get(self, model, text):
+        return self.get_many(model, [text])[0]
+
+    def put(self, model, text, embedding):
+        self.put_many(model, [text], [embedding])
+
+    def _disk_bytes(self):
+        return self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+
+    def _evict(self):
+        # other processes share the file: count it again before deleting anything
+        self.disk_bytes = self._disk_bytes()
+        if self.disk_bytes <= self.max_bytes:
+            return
+        # drop least recently used rows until 90% of the budget is left
+        to_free = self.disk_bytes - int(self.max_bytes * 0.9)
+        freed = 0
+        keys = []
+        for key, size in self.connection.execute("SELECT key, size FROM embeddings ORDER BY last_access"):
+            keys.append((key,))
+            freed += size
+            if freed >= to_free:
+                break
+        self.connection.executemany("DELETE FROM embeddings WHERE key = ?", keys)
+        self.connection.commit()
+        self.disk_bytes -= freed
+        for (key,) in keys:
+            self.memory.pop(key, None)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            hits = self.memory_hits + self.disk_hits
+            return {
+                "memory_items": len(self.memory),
+                "disk_items": self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0],
+                "disk_bytes": self.disk_bytes,
+                "max_bytes": self.max_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+def get_embedding_cache():
+    """The cache shared by every OpenAIWrapper of this process."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            _shared_cache = EmbeddingCache()
+            atexit.register(_shared_cache.flush)
+        return _shared_cache
@@ -5,6 +5,8 @@ import json
 from google import genai
 
 from .prompt_templates import merge_templates_to_dict
+from .embedding_cache import get_embedding_cache
+from .augment_cache import get_augment_cache
 from dotenv import load_dotenv
 import os
 from google import genai
@@ -17,6 +19,28 @@ gemini_api_key = os.getenv("GEMINI_API_KEY")
 
 import re
 
+# OpenAI embeddings endpoint limits: 2048 inputs and ~300k tokens per request
+EMBEDDING_MAX_BATCH_SIZE = 2048
+EMBEDDING_MAX_BATCH_TOKENS = 250000
+
+def estimate_tokens(text):
+    # conservative: ~4 characters per token for English, count 3 to stay under the request limit
+    return len(text) // 3 + 1
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+    TOKENIZER = "tiktoken"
+except Exception:
+    # tiktoken is optional, fall back to the conservative character estimate
+    _encoding = None
+    TOKENIZER = "estimate"
+
+def count_tokens(text):
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
 class LLMWrapper():
     def __init__(self,
                  templates: dict = None,
@@ -33,6 +57,8 @@ class OpenAIWrapper(LLMWrapper):
         self.llm = OpenAI()
         # self.llm = OpenAI(base_url="https://models.inference.ai.azure.com")
         self.model = model
+        self.embedding_cache = get_embedding_cache()
+        self.augment_cache = get_augment_cache()
 
 
     def _generate_messages(self):
@@ -159,7 +185,64 @@ class OpenAIWrapper(LLMWrapper):
     def calculate_embeddings(self, text, model="text-embedding-3-small"):
         if text == "":
             return None
-        return self.llm.embeddings.create(input = [text], model=model).data[0].embedding
+        cached = self.embedding_cache.get(model, text)
+        if cached is not None:
+            return cached.tolist()
+        embedding = self.llm.embeddings.create(input = [text], model=model).data[0].embedding
+        self.embedding_cache.put(model, text, embedding)
+        return embedding
+
+    def calculate_embeddings_batch(self, texts, model="text-embedding-3-small",
+                                   max_batch_size=EMBEDDING_MAX_BATCH_SIZE,
+                                   max_batch_tokens=EMBEDDING_MAX_BATCH_TOKENS):
+        """
+        Embed many texts with as few requests as possible.
+        Returns a list aligned with texts, None for empty texts and for texts that could not be embedded.
+        """
+        embeddings = [None] * len(texts)
+
+        to_embed = [i for i, text in enumerate(texts) if text is not None and text != ""]
+        cached = self.embedding_cache.get_many(model, [texts[i] for i in to_embed])
+        for i, vector in zip(to_embed, cached):
+            if vector is not None:
+                embeddings[i] = vector.tolist()
+
+        batch_indices = []
+        batch_tokens = 0
+        for i in to_embed:
+            if embeddings[i] is not None:
+                continue
+            text = texts[i]
+            tokens = estimate_tokens(text)
+            if batch_indices and (len(batch_indices) >= max_batch_size or batch_tokens + tokens > max_batch_tokens):
+                self._embed_batch(texts, batch_indices, embeddings, model)
+                batch_indices = []
+                batch_tokens = 0
+            batch_indices.append(i)
+            batch_tokens += tokens
+
+        if batch_indices:
+            self._embed_batch(texts, batch_indices, embeddings, model)
+        return embeddings
+
+    def _embed_batch(self, texts, batch_indices, embeddings, model):
+        batch = [texts[i] for i in batch_indices]
+        try:
+            response = self.llm.embeddings.create(input=batch, model=model)
+        except Exception as e:
+            # usually one input is over the token limit, embed one by one to isolate it
+            print(f"Batch embedding failed ({e}), embedding {len(batch)} texts one by one.")
+            for i in batch_indices:
+                try:
+                    embeddings[i] = self.calculate_embeddings(texts[i], model=model)
+                except Exception as e:
+                    print(f"Error: {e}")
+                    embeddings[i] = None
+            return
+
+        for item in response.data:
+            embeddings[batch_indices[item.index]] = item.embedding
+        self.embedding_cache.put_many(model, batch, [embeddings[i] for i in batch_indices])
     
     def generate_composite_context(self, memory_batch_text):
         system_prompt = self.templates['prompt_composite_context']
@@ -225,6 +308,17 @@ class OpenAIWrapper(LLMWrapper):
         else:
             system_prompt = self.templates['prompt_augment_query']
 
+        # the augmentation only depends on these inputs, repeated queries cost nothing
+        cached = self.augment_cache.get(query, today, detect_faces, llm, system_prompt)
+        if cached is not None:
+            return cached, 0
+
+        result, cost = self._augment_query(query, today, system_prompt, llm=llm)
+        if result is not None:
+            self.augment_cache.put(query, today, detect_faces, llm, system_prompt, result)
+        return result, cost
+
+    def _augment_query(self, query, today, system_prompt, llm='openai'):
         user_prompt = f"Query: {query}, Today: {today}"
 
         if llm == 'gemini':
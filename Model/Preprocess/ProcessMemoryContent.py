@@ -1,66 +1,27 @@
 from tqdm import tqdm
 import os, json
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 
-import torch
-from sklearn.metrics.pairwise import cosine_similarity
-from transformers import CLIPProcessor, CLIPModel, CLIPTokenizer, CLIPTextModel
-
-import matplotlib.pyplot as plt
-
-# For videos
-import cv2
+import numpy as np
 
 from .metadata_extractor import MetadataExtractor
+from .clip_embedder import CLIP_DECODE_WORKERS, ClipEmbedder, anchor_duplicates, load_image
+from .clip_store import ClipEmbeddingStore
+from .perceptual_hash import find_duplicates, memory_dhash
 from utils import read_json_file, get_data_of_photo
 from ocr import OCR
 from LLM.llm import OpenAIWrapper
 from Face_Processing.face_extraction import FaceProcessor
 
 
-def get_first_frame(video_path):
-    # Check if the file exists
-    if not os.path.exists(video_path):
-        print(f"Error: File '{video_path}' not found.")
-        return None
-
-    cap = cv2.VideoCapture(video_path)
-    
-    if not cap.isOpened():
-        print(f"Error: Cannot open video file {video_path}")
-        return None
-
-    ret, frame = cap.read()  # Read the first frame
-    cap.release()  # Release the video file
-
-    if not ret or frame is None:
-        print("Error: Could not read the first frame. File may be corrupted or unsupported format.")
-        return None
-
-    # Convert from BGR to RGB (if needed for display)
-    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-
-    return frame  # Returns the first frame as a NumPy array
-
-
-def get_model_info(model_ID, device):
-    model = CLIPModel.from_pretrained(model_ID).to(device)
- 	# Get the processor
-    processor = CLIPProcessor.from_pretrained(model_ID)
-    tokenizer = CLIPTokenizer.from_pretrained(model_ID)
-    text_model = CLIPTextModel.from_pretrained(model_ID).to(device)
-    return model, processor, tokenizer, text_model
-
-device = 'cuda' if torch.cuda.is_available() else 'cpu'
-print(f"Device : {device}")
-model_ID = "openai/clip-vit-base-patch32"
-model, processor, tokenizer, text_model = get_model_info(model_ID, device)
-
-
 class ProcessMemoryContent():
     img_ext_list = ["jpg", "jpeg", "png", "heic"]
     video_ext_list = ["mp4", "mov", "avi"]
 
+    # stages reported to the progress callback of process()
+    STAGES = ["load_metadata", "filter_identical_memory", "detect_faces", "process_memory_content"]
+
     def __init__(self, raw_data_folder: str, processed_folder: str,
                   is_training_data: bool = False, 
                   json_data_file_path: str = None) -> None:
@@ -74,8 +35,6 @@ class ProcessMemoryContent():
         self.raw_memory_with_metadata = None
         self.identical_memory_list = None
         self.memory_content_processed = None
-        # prev is dictionary of 1) memory -> filepath , metadata ,... 2) img embeddings
-        self.prev = None 
 
         self.is_training_data = is_training_data
         self.json_data_file_path = json_data_file_path
@@ -88,42 +47,51 @@ class ProcessMemoryContent():
         files = os.listdir(self.raw_data_folder)
         image_files = {file.split('.')[0] for file in files if file.lower().endswith(tuple(self.img_ext_list))}
 
-        raw_memory_list = []
-        print("Loading metadata and sorting ...")
-        for file in tqdm(files):
+        media_files = []
+        for file in files:
             if file == ".DS_Store":
                 continue
 
-            try:
-                filename_no_ext = file.split('.')[0]
-                ext = file.split('.')[-1].lower()
+            filename_no_ext = file.split('.')[0]
+            ext = file.split('.')[-1].lower()
 
-                # check if there is video has another image file with the same name
-                if ext in self.video_ext_list and filename_no_ext in image_files:
-                    continue
-                
-                # normpath to make correct slashes \\ or / -> correct path
-                filepath = os.path.normpath(os.path.join(self.raw_data_folder, file)) 
+            # check if there is video has another image file with the same name
+            if ext in self.video_ext_list and filename_no_ext in image_files:
+                continue
 
-                if ext in self.img_ext_list:
-                    media_type = 'image'
-                elif ext in self.video_ext_list:
-                    media_type = 'video'
-                else:
-                    media_type = None
-                    continue
+            # normpath to make correct slashes \\ or / -> correct path
+            filepath = os.path.normpath(os.path.join(self.raw_data_folder, file))
 
+            if ext in self.img_ext_list:
+                media_type = 'image'
+            elif ext in self.video_ext_list:
+                media_type = 'video'
+            else:
+                continue
+            media_files.append((file, filepath, media_type))
+
+        json_data = read_json_file(self.json_data_file_path) if self.is_training_data else None
+
+        print("Loading metadata and sorting ...")
+        # one exiftool call per batch of files instead of one exiftool process per file
+        exiftool_metadata = self.metadata_extractor.read_exiftool_metadata([filepath for _, filepath, _ in media_files])
+
+        raw_memory_list = []
+        for (file, filepath, media_type), file_metadata in zip(tqdm(media_files), exiftool_metadata):
+            # could not be read, the error is already printed
+            if file_metadata is None:
+                continue
+            try:
                 # get metadata first, then order using the timestamp
                 if media_type == 'image':
                     if self.is_training_data:
-                        json_data = read_json_file(self.json_data_file_path)
-                        data = get_data_of_photo(filename_no_ext, self.raw_data_folder,json_data)
+                        data = get_data_of_photo(file.split('.')[0], self.raw_data_folder, json_data)
                         gps = data['photo_gps']
-                        metadata = self.metadata_extractor.read_metadata_from_image_exiftool(filepath,gps[0],gps[1])
+                        metadata = self.metadata_extractor.metadata_from_image_exiftool([file_metadata], gps[0], gps[1])
                     else:
-                        metadata = self.metadata_extractor.read_metadata_from_image_exiftool(filepath)
+                        metadata = self.metadata_extractor.metadata_from_image_exiftool([file_metadata])
                 else:
-                    metadata = self.metadata_extractor.read_metadata_from_video(filepath)
+                    metadata = self.metadata_extractor.metadata_from_video_exiftool([file_metadata])
 
                 raw_memory = {
                     'filename': file,
@@ -143,146 +111,111 @@ class ProcessMemoryContent():
 
         return self.raw_memory_with_metadata
     
-    def is_similar_to_prev_image(self, raw_memory):
-        # raw memory : data of one image 
-        try:
-            image = Image.open(raw_memory['filepath'])
-        except Exception as e:
-            print(f"Error: {e}")
-            return False
-        
-        # Converts image to tensor
-        image_tensor = processor(
-            text=None,
-            images=image,
-            return_tensors="pt",
-            padding=True
-        )["pixel_values"].to(device)
-
-        ## image embeddings 
-        embedding = model.get_image_features(image_tensor)
-        embedding_as_np = embedding.cpu().detach().numpy()
-
-        # if 1st img return
-        if self.prev is None:
-            self.prev = {
-                'memory': raw_memory,
-                'embedding': embedding_as_np
-            }
-            # return
-            return False
-
-        prev_emb = self.prev['embedding']
-        similarity = cosine_similarity(prev_emb, embedding_as_np) # [[ similarity ]]
-        
-        if self.debug:
-            debug_dir = "debug"
-            os.makedirs(debug_dir, exist_ok=True)
-
-            # Load previous image
-            prev_image = Image.open(self.prev['memory']['filepath'])
-
-            # Plot the current and previous images with similarity score
-            fig, axs = plt.subplots(1, 2, figsize=(10, 5))
-            axs[0].imshow(image)
-            axs[0].set_title('Current Image')
-            axs[0].axis('off')
-
-            axs[1].imshow(prev_image)
-            axs[1].set_title('Previous Image')
-            axs[1].axis('off')
-
-            fig.suptitle(f"Similarity Score: {similarity[0][0]:.2f}", fontsize=14, y=0.95) 
+    def similarity_threshold(self, raw_memory):
+        """Similarity above which a memory is a near duplicate of the previous kept memory."""
+        if raw_memory['media_type'] == 'image' and raw_memory['metadata']['capture_method'] != 'photo':
+            return 0.95
+        return 0.85
+
+    def save_similarity_figure(self, raw_memory, prev_memory, similarity):
+        import matplotlib.pyplot as plt
+
+        debug_dir = "debug"
+        os.makedirs(debug_dir, exist_ok=True)
+
+        # Plot the current and previous images with similarity score
+        fig, axs = plt.subplots(1, 2, figsize=(10, 5))
+        axs[0].imshow(load_image(raw_memory))
+        axs[0].set_title('Current Image')
+        axs[0].axis('off')
+
+        axs[1].imshow(load_image(prev_memory))
+        axs[1].set_title('Previous Image')
+        axs[1].axis('off')
+
+        fig.suptitle(f"Similarity Score: {similarity:.2f}", fontsize=14, y=0.95)
+
+        # Save the figure
+        debug_path = os.path.join(debug_dir, f"similarity_{raw_memory['filename']}")
+        fig.savefig(debug_path, dpi=300, bbox_inches='tight')
+        plt.close(fig)
+
+    def uses_perceptual_hash(self, raw_memory):
+        """
+        Photos and videos can be near duplicates by dHash. Screenshots of the same app
+        differ only in small text, so they are only duplicates when the files are identical.
+        """
+        return raw_memory['media_type'] != 'image' or raw_memory['metadata']['capture_method'] == 'photo'
+
+    def perceptual_hashes(self, raw_memories, content_hashes, store):
+        """dHash of every memory (None where unused or unreadable), kept in store so each file is decoded once."""
+        dhashes = [None] * len(raw_memories)
+        missing = []
+        for i, raw_memory in enumerate(raw_memories):
+            if content_hashes[i] is None or not self.uses_perceptual_hash(raw_memory):
+                continue
+            dhashes[i] = store.dhashes.get(content_hashes[i])
+            if dhashes[i] is None:
+                missing.append(i)
 
-            # Save the figure
-            debug_path = os.path.join(debug_dir, f"similarity_{raw_memory['filename']}")
-            fig.savefig(debug_path, dpi=300, bbox_inches='tight')
-            plt.close(fig)
+        with ThreadPoolExecutor(max_workers=CLIP_DECODE_WORKERS) as pool:
+            for i, hash_value in zip(missing, pool.map(memory_dhash, [raw_memories[i] for i in missing])):
+                dhashes[i] = hash_value
+                if hash_value is not None:
+                    store.dhashes[content_hashes[i]] = hash_value
+        return dhashes
 
-        capture_method = raw_memory['metadata']['capture_method']
-        
-        if capture_method == 'photo':
-            threshold = 0.85
-        else:
-            threshold = 0.95
-
-        if similarity[0][0] > threshold:
-            this_child = {'filename': raw_memory['filename'], 'filepath': raw_memory['filepath']}
-            # add children key to prev dictionary and leave it to be the prev too
-            if 'children' not in self.prev['memory']:
-                self.prev['memory']['children'] = []
-            self.prev['memory']['children'].append(this_child)
-            return True
-        else:
-            self.prev = {
-                'memory': raw_memory,
-                'embedding': embedding_as_np
-            }
-            return False
-
-    def is_similar_to_prev_video(self, raw_memory):
-        video_path = raw_memory['filepath']
-        first_frame = get_first_frame(video_path)
-        # opencv to PIL
-        first_frame = Image.fromarray(first_frame)
-
-        frame_tensor = processor(
-            text=None,
-            images=first_frame,
-            return_tensors="pt",
-            padding=True
-        )["pixel_values"].to(device)
-
-        embedding = model.get_image_features(frame_tensor)
-        embedding_as_np = embedding.cpu().detach().numpy()
-
-        if self.prev is None:
-            self.prev = {
-                'memory': raw_memory,
-                'embedding': embedding_as_np
-            }
-            # return
-            return False
-        
-        prev_emb = self.prev['embedding']
-        similarity = cosine_similarity(prev_emb, embedding_as_np)
-
-        if similarity[0][0] > 0.85:
-            this_child = {'filename': raw_memory['filename'], 'filepath': raw_memory['filepath']}
-            if 'children' not in self.prev['memory']:
-                self.prev['memory']['children'] = []
-            self.prev['memory']['children'].append(this_child)
-            return True
-        else:
-            self.prev = {
-                'memory': raw_memory,
-                'embedding': embedding_as_np
-            }
-            return False
-    
     # stores the filtered unique media.
     def filter_identical_memory(self, debug=False):
         self.debug = debug
+        raw_memories = self.raw_memory_with_metadata
 
-        identical_memory_list = []
-        
         print("Filtering identical memory ...")
-        for raw_memory in tqdm(self.raw_memory_with_metadata):
-            # If not similar append
-            if raw_memory['media_type'] == 'image':
-                try:
-                    if self.is_similar_to_prev_image(raw_memory):
-                        continue
-                except Exception as e:
-                    print(f"Error: {e}")
-                    continue
-                identical_memory_list.append(raw_memory)
-                
-            else:
-                if self.is_similar_to_prev_video(raw_memory):
-                    continue
+        # hashes and embeddings of files seen by earlier runs are reused
+        store = ClipEmbeddingStore(self.processed_folder)
+        content_hashes = store.content_hashes([raw_memory['filepath'] for raw_memory in raw_memories], CLIP_DECODE_WORKERS)
+
+        # identical files and near identical photos across the library never reach CLIP
+        parent_of = find_duplicates(content_hashes, self.perceptual_hashes(raw_memories, content_hashes, store))
+        candidates = np.flatnonzero(parent_of < 0)
+        print(f"Found {len(raw_memories) - len(candidates)} duplicates by file and perceptual hash")
+
+        embeddings, found = ClipEmbedder().embed([raw_memories[i] for i in candidates], store=store,
+                                                 hashes=[content_hashes[i] for i in candidates])
+        store.save()
+        thresholds = [self.similarity_threshold(raw_memories[i]) for i in candidates]
+        candidate_anchor_of = anchor_duplicates(embeddings, thresholds, found)
+
+        # root_of: -1 for kept memories, else the kept memory they duplicate
+        root_of = np.full(len(raw_memories), -1, dtype=np.int64)
+        for row, i in enumerate(candidates):
+            if candidate_anchor_of[row] >= 0:
+                root_of[i] = candidates[candidate_anchor_of[row]]
+        for i in np.flatnonzero(parent_of >= 0):
+            parent = parent_of[i]
+            root_of[i] = root_of[parent] if root_of[parent] >= 0 else parent
+
+        row_of = {i: row for row, i in enumerate(candidates)}
+        identical_memory_list = []
+        anchor = None
+        for i, raw_memory in enumerate(raw_memories):
+            # memories CLIP could not read are kept on their own and are never an anchor
+            if i in row_of and not found[row_of[i]]:
                 identical_memory_list.append(raw_memory)
-        
+                continue
+            if self.debug and anchor is not None and i in row_of and raw_memory['media_type'] == 'image':
+                similarity = float(embeddings[row_of[i]] @ embeddings[row_of[anchor]])
+                self.save_similarity_figure(raw_memory, raw_memories[anchor], similarity)
+
+            if root_of[i] >= 0:
+                this_child = {'filename': raw_memory['filename'], 'filepath': raw_memory['filepath']}
+                raw_memories[root_of[i]].setdefault('children', []).append(this_child)
+                continue
+            anchor = i
+            identical_memory_list.append(raw_memory)
+
+        print(f"Kept {len(identical_memory_list)} of {len(raw_memories)} memories")
+
         # save the identical memory to a file
         self.identical_memory_list = identical_memory_list
 
@@ -290,14 +223,15 @@ class ProcessMemoryContent():
         if not os.path.exists(self.processed_folder):
             os.makedirs(self.processed_folder)
         file_path = os.path.join(self.processed_folder, 'identical_memory_list.json')
-        # with open(file_path, 'w') as f:
-        #     json.dump(identical_memory_list, f, indent=4)
         with open(file_path, 'w', encoding='utf-8') as f:
             json.dump(identical_memory_list, f, indent=4, ensure_ascii=False)
-        
-    def process_identical_memory_content(self):
+
+    def process_identical_memory_content(self, progress_callback=None):
         to_remove = []
-        for memory in tqdm(self.memory_content_processed[:]):
+        total = len(self.memory_content_processed)
+        for i, memory in enumerate(tqdm(self.memory_content_processed[:])):
+            if progress_callback:
+                progress_callback("process_memory_content", i, total)
             if 'content' in memory and 'caption' in memory['content']:
                 continue
 
@@ -369,15 +303,22 @@ class ProcessMemoryContent():
         with open(save_path, 'w', encoding='utf-8') as f:
             json.dump(save_data, f, indent=4, ensure_ascii=False)
 
-    def process(self, detect_faces=False):
+    def process(self, detect_faces=False, progress_callback=None):
+        '''
+        progress_callback(stage, done=None, total=None) is called when a stage of STAGES starts
+        and while long stages advance. It may raise to stop the processing.
+        '''
          # check if the identical memory has already been processed
         identical_memory_list_path = os.path.join(self.processed_folder, 'identical_memory_list.json')
 
         if not os.path.exists(identical_memory_list_path):
             ## STEP 1
+            if progress_callback:
+                progress_callback("load_metadata")
             self.load_metadata_and_sort()
-            self.prev = None
             # STEP 2
+            if progress_callback:
+                progress_callback("filter_identical_memory")
             self.filter_identical_memory()
         else:
             with open(identical_memory_list_path, 'r', encoding='utf-8') as f:
@@ -403,6 +344,8 @@ class ProcessMemoryContent():
 
         # FACE DETECTION PART
         if detect_faces:
+            if progress_callback:
+                progress_callback("detect_faces")
             self.detect_faces()
             # self.face_processor.change_group_name('Person_62', 'Hippie Maya')
             # self.face_processor.change_group_name('Person_55', 'Hope')
@@ -415,15 +358,18 @@ class ProcessMemoryContent():
             self.add_face_tags()
             print("Face tags added to memory content.")
             
+        if progress_callback:
+            progress_callback("process_memory_content")
         try:
-            self.process_identical_memory_content()
+            self.process_identical_memory_content(progress_callback)
         except Exception as e:
             print(f"Error: {e}")
         except KeyboardInterrupt:
             print("Process interrupted.")
-            
-        save_path = os.path.join(self.processed_folder, 'memory_content_processed.json')
-        self._save(self.memory_content_processed, save_path)
+        finally:
+            # keep what was captioned so far, also when the callback stopped the processing
+            save_path = os.path.join(self.processed_folder, 'memory_content_processed.json')
+            self._save(self.memory_content_processed, save_path)
 
     def detect_faces(self, confidence_threshold=0.9):
         """Detect faces in the images and save them."""
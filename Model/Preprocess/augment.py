@@ -1,4 +1,3 @@
-import numpy as np
 import json
 import os
 
@@ -6,10 +5,30 @@ from datetime import datetime
 from tqdm import tqdm
 
 from LLM.llm import OpenAIWrapper
+from VectorDB.bm25 import BM25_FILE, BM25Index
+from VectorDB.embedding_matrix import EmbeddingMatrix
+from VectorDB.folder_lock import folder_lock
+from VectorDB.vector_index import VectorIndex, VectorStore
 
-from utils import parse_memory_to_string, parse_memory_to_string_lite, parse_memory_to_string_update
+from .prompt_fragments import PromptFragments
 
 class AugmentContext():
+    # stages reported to the progress callback of augment()
+    STAGES = ["atomic_context", "location", "text_and_speech", "caption", "lexical", "composite_context", "faces", "rag"]
+
+    # vector store namespace -> (matrix attribute, list attribute) set when the namespace is loaded or built
+    NAMESPACE_ATTRIBUTES = {
+        "objects": ("objects_vector", "objects_list"),
+        "people": ("people_vector", "people_list"),
+        "activities": ("activities_vector", "activities_list"),
+        "location": ("location_vector_db", "location_list"),
+        "text": ("text_vector_db", "text_list"),
+        "caption": ("caption_vector_db", "caption_list"),
+        "composite": ("composite_context_embeddings", "composite_context"),
+        "knowledge": ("knowledge_embeddings", "knowledge"),
+        "rag": ("vector_db_rag", "vector_db_list"),
+    }
+
     def __init__(
             self,
             memory_content_processed: list,
@@ -17,19 +36,32 @@ class AugmentContext():
             vector_db_folder=r"data\\vector_db", 
             detect_faces: bool = False,
             debug = False,
+            prompt_fragments: PromptFragments = None,
     ) -> None:
         self.memory_content_processed = memory_content_processed
         self.processed_folder = processed_folder
         self.vector_db_folder = vector_db_folder
 
         self.detect_faces = detect_faces
+        # rendered prompt text of every memory, usually shared with the owning Memory
+        self.prompt_fragments = prompt_fragments if prompt_fragments is not None else PromptFragments()
 
-        self.composite_context = []
+        # composite events / knowledge are merged while the windows are processed
+        self.composite_store = EmbeddingMatrix()
+        self.composite_context = self.composite_store.items
         self.composite_context_embeddings = None
 
-        self.knowledge = []
+        self.knowledge_store = EmbeddingMatrix()
+        self.knowledge = self.knowledge_store.items
         self.knowledge_embeddings = None
 
+        self.atomic_stores = {}
+
+        self.vector_store = None
+        self.indexes = {}
+        # BM25 over captions, OCR text, objects and locations, searched next to the vectors
+        self.lexical_index = None
+
         self.llm = OpenAIWrapper()
         self.cost = 0
         
@@ -40,109 +72,96 @@ class AugmentContext():
 
         self.debug = debug
 
-    def update_vector_db_and_list(self, category, new_element, memory_id):
-        new_emb = self.llm.calculate_embeddings(new_element)
+    def embed_texts(self, texts):
+        """Embed all texts with batched requests. Returns {text: embedding} for the texts that could be embedded."""
+        unique_texts = list(dict.fromkeys(text for text in texts if text))
+        embeddings = self.llm.calculate_embeddings_batch(unique_texts)
+        return {text: emb for text, emb in zip(unique_texts, embeddings) if emb is not None}
+
+    def _vector_store(self):
+        if self.vector_store is None:
+            self.vector_store = VectorStore(self.vector_db_folder)
+        return self.vector_store
+
+    def _set_index(self, name, index):
+        self.indexes[name] = index
+        vector_attribute, list_attribute = self.NAMESPACE_ATTRIBUTES[name]
+        setattr(self, vector_attribute, index.vectors)
+        setattr(self, list_attribute, index.items)
+
+    def _load_indexes(self, *names):
+        """Use the saved namespaces of a stage that already ran. Returns False if any of them is missing."""
+        store = self._vector_store()
+        if not all(name in store for name in names):
+            return False
+        for name in names:
+            self._set_index(name, store.get(name))
+        return True
+
+    def _save_indexes(self, **matrices):
+        """Turn the EmbeddingMatrix built for each namespace into a VectorIndex and save the vector store."""
+        store = self._vector_store()
+        for name, matrix in matrices.items():
+            matrix.shrink_to_fit()
+            index = VectorIndex(matrix.matrix, matrix.items)
+            store.put(name, index)
+            self._set_index(name, index)
+        store.save()
+
+    def load_indexes(self):
+        """Load every saved namespace of the vector store and the lexical index."""
+        store = self._vector_store()
+        for name in store.names():
+            if name in self.NAMESPACE_ATTRIBUTES:
+                self._set_index(name, store.get(name))
+
+        # built by the lexical stage of augment(); folders augmented before it existed
+        # have none until the next ingestion and queries use dense retrieval only
+        self.lexical_index = BM25Index.load(self.vector_db_folder)
+
+    def update_vector_db_and_list(self, category, new_element, memory_id, new_emb=None):
+        if new_emb is None:
+            new_emb = self.llm.calculate_embeddings(new_element)
         if new_emb is None:
             return
         
-        if category == 'objects':
-            vector_db = self.objects_vector
-            element_list = self.objects_list
-        elif category == 'people':
-            vector_db = self.people_vector
-            element_list = self.people_list
-        elif category == 'activities':
-            vector_db = self.activities_vector
-            element_list = self.activities_list
-        else:
+        store = self.atomic_stores.get(category)
+        if store is None:
             return
-        
-        if vector_db is None or len(vector_db) == 0:
-            vector_db = np.array(new_emb).reshape(1, -1)
-            element_dict = {f'{category}': new_element, 'memory_ids': [memory_id]}
-            element_list.append(element_dict)
-            print(f"Element List : \n {element_list}")
-            if category == 'objects':
-                self.objects_vector = vector_db
-                self.objects_list = element_list
-            elif category == 'people':
-                self.people_vector = vector_db
-                self.people_list = element_list
-            elif category == 'activities':
-                self.activities_vector = vector_db
-                self.activities_list = element_list
-            return vector_db, element_list
-        
-        emb_vertical = np.array(new_emb).reshape(-1, 1)
-        similarities = np.matmul(vector_db, emb_vertical)  ## Cosine similarity
-        similarities = similarities.flatten()
+
+        index, max_similarity = store.best_match(new_emb)
 
         if self.debug : 
-            for element in element_list:
+            for element in store.items:
                 print(element[category], end=" , ")
             print()
             print("************")
-            print(similarities)
-            print(element_list)
+            print(max_similarity)
 
-
-        max_similarity = max(similarities)
-        if max_similarity > 0.8:
-            index = np.argmax(similarities)
+        if index is not None and max_similarity > 0.8:
+            element_list = store.items
             combined_memory_ids = list(set(element_list[index]['memory_ids'] + [memory_id]))
             element_list[index]['memory_ids'] = combined_memory_ids
         else:
             element_dict = {f'{category}': new_element, 'memory_ids': [memory_id]}
-            element_list.append(element_dict)
-            vector_db = np.vstack([vector_db, new_emb])
-
-        if category == 'objects':
-            self.objects_vector = vector_db
-            self.objects_list = element_list
-        elif category == 'people':
-            self.people_vector = vector_db
-            self.people_list = element_list
-        elif category == 'activities':
-            self.activities_vector = vector_db
-            self.activities_list = element_list
+            store.append(new_emb, element_dict)
 
     def augment_atomic_context(self):
         # TODO 
         # merge similar object / people / activities and save them in a vector database
 
-        if not os.path.exists(self.vector_db_folder):
-            os.makedirs(self.vector_db_folder)
-
-        objects_vector_db_path = os.path.join(self.vector_db_folder,'objects_vector_db.npy')
-        people_vector_db_path = os.path.join(self.vector_db_folder,'people_vector_db.npy')
-        activities_vector_db_path = os.path.join(self.vector_db_folder,'activities_vector_db.npy')
-
-        objects_list_path = os.path.join(self.vector_db_folder,'objects_list.json')
-        people_list_path = os.path.join(self.vector_db_folder,'people_list.json')
-        activities_list_path = os.path.join(self.vector_db_folder,'activities_list.json')
-
-        if os.path.exists(objects_vector_db_path):
-            self.objects_vector = np.load(objects_vector_db_path, allow_pickle=True)
-            self.people_vector = np.load(people_vector_db_path, allow_pickle=True)
-            self.activities_vector = np.load(activities_vector_db_path, allow_pickle=True)
-
-            with open(objects_list_path, 'r') as f:
-                self.objects_list = json.load(f)
-            with open(people_list_path, 'r') as f:
-                self.people_list = json.load(f)
-            with open(activities_list_path, 'r') as f:
-                self.activities_list = json.load(f)
+        if self._load_indexes('objects', 'people', 'activities'):
             return
 
-        self.objects_vector = None
-        self.people_vector = None
-        self.activities_vector = None
+        self.atomic_stores = {
+            'objects': EmbeddingMatrix(),
+            'people': EmbeddingMatrix(),
+            'activities': EmbeddingMatrix(),
+        }
 
-        self.objects_list = []
-        self.people_list = []
-        self.activities_list = []
-
-        for memory in tqdm(self.memory_content_processed[:]):
+        # collect every element first so they can be embedded in bulk
+        elements = []
+        for memory in self.memory_content_processed:
             memory_id = memory['filename']
             objects = memory['content']['objects']
             people = memory['content']['people']
@@ -150,48 +169,42 @@ class AugmentContext():
 
             if isinstance(objects, list):
                 for obj in objects:
-                    self.update_vector_db_and_list('objects', obj, memory_id)
+                    elements.append(('objects', obj, memory_id))
             elif isinstance(objects, str):
-                self.update_vector_db_and_list('objects', objects, memory_id)
+                elements.append(('objects', objects, memory_id))
 
             if isinstance(people, list):
                 for person in people:
                     if isinstance(person, dict):
                         person = person.get('description', '')
-                    self.update_vector_db_and_list('people', person, memory_id)
+                    elements.append(('people', person, memory_id))
             elif isinstance(people, str):
-                self.update_vector_db_and_list('people', people, memory_id)
+                elements.append(('people', people, memory_id))
 
             if isinstance(activities, list):
                 for activitiy in activities:
-                    self.update_vector_db_and_list('activities', activitiy, memory_id)
+                    elements.append(('activities', activitiy, memory_id))
             elif isinstance(activities, str):
-                self.update_vector_db_and_list('activities', activities, memory_id)
-        # save
+                elements.append(('activities', activities, memory_id))
+
+        embeddings = self.embed_texts([element for _, element, _ in elements])
 
-        np.save(objects_vector_db_path, self.objects_vector)
-        np.save(people_vector_db_path, self.people_vector)
-        np.save(activities_vector_db_path, self.activities_vector)
+        for category, element, memory_id in tqdm(elements):
+            emb = embeddings.get(element)
+            if emb is None:
+                continue
+            self.update_vector_db_and_list(category, element, memory_id, new_emb=emb)
 
-        with open(objects_list_path, 'w') as f:
-            json.dump(self.objects_list, f, indent=4)
-        with open(people_list_path, 'w') as f:
-            json.dump(self.people_list, f, indent=4)
-        with open(activities_list_path, 'w') as f:
-            json.dump(self.activities_list, f, indent=4)
+        self._save_indexes(**self.atomic_stores)
 
     def augment_location(self):
-        location_vector_db_path = os.path.join(self.vector_db_folder,'location_vector_db.npy')
-        location_list_path = os.path.join(self.vector_db_folder,'location_list.json')
-
-        if os.path.exists(location_vector_db_path):
-            self.location_vector_db = np.load(location_vector_db_path, allow_pickle=True)
-            with open(location_list_path, 'r') as f:
-                self.location_list = json.load(f)
+        if self._load_indexes('location'):
             return
         
-        self.location_vector_db = None
-        self.location_list = []
+        store = EmbeddingMatrix()
+
+        embeddings = self.embed_texts([memory['metadata']['location'].get('address', '')
+                                       for memory in self.memory_content_processed])
 
         for memory in tqdm(self.memory_content_processed[:]):
             memory_id = memory['filename']
@@ -200,152 +213,134 @@ class AugmentContext():
             if not location or location == '':
                 continue
 
-            emb = self.llm.calculate_embeddings(location)
+            emb = embeddings.get(location)
             if emb is None:
                 continue
 
-            if self.location_vector_db is None:
-                self.location_vector_db = np.array(emb).reshape(1, -1)
-                self.location_list = [{'location': location, 'memory_ids': [memory_id]}]
-
             # update location list
-            emb_vertical = np.array(emb).reshape(-1, 1)
-            similarities = np.matmul(self.location_vector_db, emb_vertical)
-            similarities = similarities.flatten()
-
-            max_similarity = max(similarities)
-            if max_similarity > 0.8:
-                index = np.argmax(similarities)
-                combined_memory_ids = list(set(self.location_list[index]['memory_ids'] + [memory_id]))
-                self.location_list[index]['memory_ids'] = combined_memory_ids
+            index, max_similarity = store.best_match(emb)
+            if index is not None and max_similarity > 0.8:
+                combined_memory_ids = list(set(store.items[index]['memory_ids'] + [memory_id]))
+                store.items[index]['memory_ids'] = combined_memory_ids
             else:
-                self.location_list.append({'location': location, 'memory_ids': [memory_id]})
-                self.location_vector_db = np.vstack([self.location_vector_db, emb])
-            
-        # save
-        np.save(location_vector_db_path, self.location_vector_db)
-        with open(location_list_path, 'w') as f:
-            json.dump(self.location_list, f, indent=4)
+                store.append(emb, {'location': location, 'memory_ids': [memory_id]})
+
+        self._save_indexes(location=store)
     
     def augment_text_and_speech(self):
-        if not os.path.exists(self.vector_db_folder):
-            os.makedirs(self.vector_db_folder)
-        
-        text_vector_db_path = os.path.join(self.vector_db_folder,'text_vector_db.npy')
-        text_list_path = os.path.join(self.vector_db_folder,'text_list.json')
-
-        if os.path.exists(text_vector_db_path):
-            self.text_vector_db = np.load(text_vector_db_path, allow_pickle=True)
-            with open(text_list_path, 'r') as f:
-                self.text_list = json.load(f)
+        if self._load_indexes('text'):
             return
         
-        self.text_vector_db = None
-        self.text_list = []
+        self.text_store = EmbeddingMatrix()
 
-        for memory in tqdm(self.memory_content_processed[:]):
+        entries = []
+        for memory in self.memory_content_processed:
             memory_id = memory['filename']
             memory_content = memory['content']
             text = memory_content.get('text', '')
             speech = memory_content.get('speech', '')
 
             if text and text != '':
-                try:
-                    emb = self.llm.calculate_embeddings(text)
-                    if emb is not None:
-                        if self.text_vector_db is None:
-                            self.text_vector_db = np.array(emb).reshape(1, -1)
-                            self.text_list.append({'text': text, 'memory_ids': [memory_id]})
-                        else:
-                            self.text_vector_db = np.vstack([self.text_vector_db, emb])
-                            self.text_list.append({'text': text, 'memory_ids': [memory_id]})
-                except:
-                    # the text might be too long, exceed the token limit
-                    # chunk the text first
-                    texts = self.llm.chunking_text(text)
-                    texts = texts.get('chunks', [])
-                    for t in texts:
-                        emb = self.llm.calculate_embeddings(t)
-                        if emb is not None:
-                            if self.text_vector_db is None:
-                                self.text_vector_db = np.array(emb).reshape(1, -1)
-                                self.text_list.append({'text': t, 'memory_ids': [memory_id]})
-                            else:
-                                self.text_vector_db = np.vstack([self.text_vector_db, emb])
-                                self.text_list.append({'text': t, 'memory_ids': [memory_id]})
-
+                entries.append((text, memory_id, True))
             if speech and speech != '':
-                emb = self.llm.calculate_embeddings(speech)
-                if emb is not None:
-                    if self.text_vector_db is None:
-                        self.text_vector_db = np.array(emb).reshape(1, -1)
-                        self.text_list.append({'text': speech, 'memory_ids': [memory_id]})
-                    else:
-                        self.text_vector_db = np.vstack([self.text_vector_db, emb])
-                        self.text_list.append({'text': speech, 'memory_ids': [memory_id]})
+                entries.append((speech, memory_id, False))
 
-        # save
-        np.save(text_vector_db_path, self.text_vector_db)
-        with open(text_list_path, 'w') as f:
-            json.dump(self.text_list, f, indent=4)
+        embeddings = self.embed_texts([entry for entry, _, _ in entries])
 
-    def generate_caption_vector_db(self):
+        for entry, memory_id, can_chunk in tqdm(entries):
+            emb = embeddings.get(entry)
+            if emb is not None:
+                self._append_text(entry, emb, memory_id)
+                continue
+            if not can_chunk:
+                continue
+
+            # the text might be too long, exceed the token limit
+            # chunk the text first
+            try:
+                result, cost = self.llm.chunking_text(entry)
+                self.cost += cost
+                chunks = json.loads(result).get('chunks', [])
+            except Exception as e:
+                print(f"Error: {e}")
+                continue
+
+            chunk_embeddings = self.embed_texts(chunks)
+            for chunk in chunks:
+                chunk_emb = chunk_embeddings.get(chunk)
+                if chunk_emb is not None:
+                    self._append_text(chunk, chunk_emb, memory_id)
 
-        save_path_vector_db = os.path.join(self.vector_db_folder,'caption_vector_db.npy')
-        save_path_list = os.path.join(self.vector_db_folder,'caption_list.json')
+        self._save_indexes(text=self.text_store)
 
-        if os.path.exists(save_path_vector_db):
-            self.caption_vector_db = np.load(save_path_vector_db, allow_pickle=True)
-            with open(save_path_list, 'r') as f:
-                self.caption_list = json.load(f)
+    def _append_text(self, text, emb, memory_id):
+        self.text_store.append(emb, {'text': text, 'memory_ids': [memory_id]})
+
+    def generate_caption_vector_db(self):
+        if self._load_indexes('caption'):
             return
 
-        self.caption_vector_db = None
+        store = EmbeddingMatrix()
+        embeddings = self.embed_texts([memory['content']['caption'] for memory in self.memory_content_processed])
+
         for memory in tqdm(self.memory_content_processed[:]):
             memory_id = memory['filename']
             caption = memory['content']['caption']
 
-            emb = self.llm.calculate_embeddings(caption)
+            emb = embeddings.get(caption)
             if emb is None:
                 continue
 
-            if self.caption_vector_db is None:
-                self.caption_vector_db = np.array(emb).reshape(1, -1)
-                self.caption_list = [{'caption': caption, 'memory_ids': [memory_id]}]
-                continue
-            self.caption_vector_db = np.vstack([self.caption_vector_db, emb])
-            self.caption_list.append({'caption': caption, 'memory_ids': [memory_id]})
+            store.append(emb, {'caption': caption, 'memory_ids': [memory_id]})
+
+        self._save_indexes(caption=store)
+
+    @staticmethod
+    def lexical_document(memory):
+        """Text of a memory searched by keywords: caption, OCR text, objects and location."""
+        content = memory.get('content', {})
+        objects = content.get('objects', '')
+        if isinstance(objects, list):
+            objects = ' '.join(obj for obj in objects if isinstance(obj, str))
+        elif not isinstance(objects, str):
+            objects = ''
+        location = memory.get('metadata', {}).get('location', {}).get('address', '')
+        return '\n'.join(part for part in (content.get('caption', ''), content.get('text', ''), objects, location)
+                         if part)
+
+    def build_lexical_index(self):
+        """Bring the saved BM25 index up to date: only new, changed and deleted memories are touched. Ingestion only."""
+        with folder_lock(self.vector_db_folder):
+            index = BM25Index.load(self.vector_db_folder) or BM25Index()
+
+            changed = 0
+            memory_ids = set()
+            for memory in self.memory_content_processed:
+                memory_id = memory['filename']
+                memory_ids.add(memory_id)
+                changed += index.add(memory_id, self.lexical_document(memory))
+            for memory_id in [memory_id for memory_id in index.documents if memory_id not in memory_ids]:
+                changed += index.remove(memory_id)
 
-        # save
-        np.save(save_path_vector_db, self.caption_vector_db)
-        with open(save_path_list, 'w') as f:
-            json.dump(self.caption_list, f, indent=4)
+            if changed or not os.path.exists(os.path.join(self.vector_db_folder, BM25_FILE)):
+                index.save(self.vector_db_folder)
+        self.lexical_index = index
 
-    def update_composite_list(self, event):
+    def update_composite_list(self, event, emb=None):
         
         if self.debug :
             print("*"*50)
             print("Updating Composite List with Event: ")
             print(event)
         event_name = event['event_name']
-        emb = self.llm.calculate_embeddings(event_name)
-        if self.composite_context_embeddings is None:
-            self.composite_context_embeddings = np.array(emb).reshape(1, -1)
-            self.composite_context.append(event)
+        if emb is None:
+            emb = self.llm.calculate_embeddings(event_name)
+        if emb is None:
             return
-        
-        # calculate the similarity
-        emb_vertical = np.array(emb).reshape(-1, 1)
-
-        similarities = np.matmul(self.composite_context_embeddings, emb_vertical)
-        similarities = similarities.flatten()
 
         # find max similarity, if it is above a threshold, merge the events
-        max_similarity = max(similarities)
-        if max_similarity > 0.8:
-            # print(max_similarity)
-            index = np.argmax(similarities)
-
+        index, max_similarity = self.composite_store.best_match(emb)
+        if index is not None and max_similarity > 0.8:
             # check if date can be merged
             prev_start_date = self.composite_context[index]['start_date']
             prev_end_date = self.composite_context[index]['end_date']
@@ -361,37 +356,26 @@ class AugmentContext():
                 combined_memory_ids = list(set(self.composite_context[index]['memory_ids'] + event['memory_ids']))
                 self.composite_context[index]['memory_ids'] = combined_memory_ids
             else:
-                self.composite_context.append(event)
-                self.composite_context_embeddings = np.vstack([self.composite_context_embeddings, emb])
-            # 
+                self.composite_store.append(emb, event)
         else:
-            self.composite_context.append(event)
-            self.composite_context_embeddings = np.vstack([self.composite_context_embeddings, emb])
+            self.composite_store.append(emb, event)
 
-    def update_knowledge_list(self, knowledge):
+    def update_knowledge_list(self, knowledge, emb=None):
         knowledge_name = knowledge['knowledge']
-        emb = self.llm.calculate_embeddings(knowledge_name)
-        if self.knowledge_embeddings is None:
-            self.knowledge_embeddings = np.array(emb).reshape(1, -1)
-            self.knowledge.append(knowledge)
+        if emb is None:
+            emb = self.llm.calculate_embeddings(knowledge_name)
+        if emb is None:
             return
-        
-        # calculate the similarity
-        emb_vertical = np.array(emb).reshape(-1, 1)
 
-        similarities = np.matmul(self.knowledge_embeddings, emb_vertical)
-        similarities = similarities.flatten()
-
-        max_similarity = max(similarities)
-        if max_similarity > 0.8:
-            index = np.argmax(similarities)
+        index, max_similarity = self.knowledge_store.best_match(emb)
+        if index is not None and max_similarity > 0.8:
             combined_memory_ids = list(set(self.knowledge[index]['memory_ids'] + knowledge['memory_ids']))
             self.knowledge[index]['memory_ids'] = combined_memory_ids
         else:
-            self.knowledge.append(knowledge)
-            self.knowledge_embeddings = np.vstack([self.knowledge_embeddings, emb])
+            self.knowledge_store.append(emb, knowledge)
 
     def detect_composite(self, memory_in_window):
+        """Infer the events and knowledge of one window. Returns (events, knowledge)."""
         # '''
         # memory_id: <filename>
         # temporal info: <date>
@@ -403,11 +387,7 @@ class AugmentContext():
 
         batch_memory = ''
         for memory in memory_in_window:
-            if self.detect_faces:
-                memory_string = parse_memory_to_string_update(memory)
-            else:
-                memory_string = parse_memory_to_string(memory)
-            batch_memory += memory_string
+            batch_memory += self.prompt_fragments.text(memory, "faces" if self.detect_faces else "full")
 
         try:
             result, cost = self.llm.generate_composite_context(batch_memory)
@@ -415,7 +395,7 @@ class AugmentContext():
             result_knowledge, cost = self.llm.generate_facts_and_knowledge(batch_memory)
         except Exception as e:
             print(e)
-            return
+            return [], []
 
         if self.debug:
             for event in result['events']:
@@ -423,13 +403,9 @@ class AugmentContext():
             for knowledge in result_knowledge['knowledge']:
                 print(knowledge)
 
-        for event in result['events']:
-            self.update_composite_list(event)
-
-        for knowledge in result_knowledge['knowledge']:
-            self.update_knowledge_list(knowledge)
+        return result['events'], result_knowledge['knowledge']
 
-    def augment_slide_window(self, step=3, window_size=5):
+    def augment_slide_window(self, step=3, window_size=5, progress_callback=None):
         memory = self.memory_content_processed
 
         start = 0
@@ -438,18 +414,7 @@ class AugmentContext():
 
         memory_batch = []
 
-        composite_vector_db_path = os.path.join(self.vector_db_folder,'composite_vector_db.npy')
-        composite_list_path = os.path.join(self.vector_db_folder,'composite_list.json')
-        knowledge_vector_db_path = os.path.join(self.vector_db_folder,'knowledge_vector_db.npy')
-        knowledge_list_path = os.path.join(self.vector_db_folder,'knowledge_list.json')
-
-        if os.path.exists(composite_vector_db_path):
-            self.composite_context_embeddings = np.load(composite_vector_db_path, allow_pickle=True)
-            with open(composite_list_path, 'r') as f:
-                self.composite_context = json.load(f)
-            self.knowledge_embeddings = np.load(knowledge_vector_db_path, allow_pickle=True)
-            with open(knowledge_list_path, 'r') as f:
-                self.knowledge = json.load(f)
+        if self._load_indexes('composite', 'knowledge'):
             return
         
         while start < len(memory) and end < len(memory):
@@ -474,61 +439,47 @@ class AugmentContext():
             memory_batch.append(memory_in_window)
             start = next_start
 
-        for memory_in_window in tqdm(memory_batch):
-            self.detect_composite(memory_in_window)
-
-        # save
-        np.save(composite_vector_db_path, self.composite_context_embeddings)
-        with open(composite_list_path, 'w') as f:
-            json.dump(self.composite_context, f, indent=4)
-
-        np.save(knowledge_vector_db_path, self.knowledge_embeddings)
-        with open(knowledge_list_path, 'w') as f:
-            json.dump(self.knowledge, f, indent=4)
+        events = []
+        knowledge_list = []
+        for i, memory_in_window in enumerate(tqdm(memory_batch)):
+            if progress_callback:
+                progress_callback("composite_context", i, len(memory_batch))
+            window_events, window_knowledge = self.detect_composite(memory_in_window)
+            events.extend(window_events)
+            knowledge_list.extend(window_knowledge)
+
+        # embed all event names and knowledge at once, then merge in window order
+        embeddings = self.embed_texts([event['event_name'] for event in events] +
+                                      [knowledge['knowledge'] for knowledge in knowledge_list])
+        for event in events:
+            self.update_composite_list(event, emb=embeddings.get(event['event_name']))
+        for knowledge in knowledge_list:
+            self.update_knowledge_list(knowledge, emb=embeddings.get(knowledge['knowledge']))
+
+        self._save_indexes(composite=self.composite_store, knowledge=self.knowledge_store)
      
     def generate_vector_db_for_rag(self):
-
-        save_path_vector_db = os.path.join(self.vector_db_folder,'vector_db_rag.npy')
-        save_path_list = os.path.join(self.vector_db_folder,'vector_db_list.json')
-
-        if os.path.exists(save_path_vector_db):
-            self.vector_db_rag = np.load(save_path_vector_db, allow_pickle=True)
-            with open(save_path_list, 'r') as f:
-                self.vector_db_list = json.load(f)
+        if self._load_indexes('rag'):
             return
         
-        self.vector_db_rag = None
-        self.vector_db_list = []
+        store = EmbeddingMatrix()
 
-        for memory in tqdm(self.memory_content_processed[:]):
-            caption = memory['content']['caption']
-            metadata = memory['metadata']
-            temporal = f'{metadata["temporal_info"]["date_string"]}, {metadata["temporal_info"]["day_of_week"]}, {metadata["temporal_info"]["time_of_the_day"]}'
-            location = metadata['location'].get('address', '')
+        entries = []
+        for memory in self.memory_content_processed:
+            memory_entry = self.prompt_fragments.text(memory, "faces" if self.detect_faces else "lite")
 
-            if self.detect_faces:
-                memory_entry = parse_memory_to_string_update(memory)
-            else:
-                memory_entry = parse_memory_to_string_lite(memory)
-                
             memory_id = memory['filename']
-            entry = {'memory': memory_entry, 'memory_ids': [memory_id]}
+            entries.append({'memory': memory_entry, 'memory_ids': [memory_id]})
 
-            emb = self.llm.calculate_embeddings(memory_entry)
-            if emb is None:
-                continue
-            emb = np.array(emb).reshape(1, -1)
+        embeddings = self.embed_texts([entry['memory'] for entry in entries])
 
-            if self.vector_db_rag is None:
-                self.vector_db_rag = emb
+        for entry in tqdm(entries):
+            emb = embeddings.get(entry['memory'])
+            if emb is None:
                 continue
-            self.vector_db_rag = np.vstack([self.vector_db_rag, emb])
-            self.vector_db_list.append(entry)
+            store.append(emb, entry)
 
-        # save
-        np.save(save_path_vector_db, self.vector_db_rag)
-        with open(save_path_list, 'w') as f:
-            json.dump(self.vector_db_list, f, indent=4)
+        self._save_indexes(rag=store)
 
     def augment_face(self):
         if not os.path.exists(self.vector_db_folder):
@@ -571,25 +522,49 @@ class AugmentContext():
         with open(face_list_path, 'w') as f:
             json.dump(self.face_list, f, indent=4)
                         
-    def augment(self):
+    def augment(self, progress_callback=None):
+        '''
+        progress_callback(stage, done=None, total=None) is called when a stage of STAGES starts
+        and while long stages advance. It may raise to stop the augmentation.
+        '''
+        def report(stage):
+            if progress_callback:
+                progress_callback(stage)
+
+        # folders of older versions are written in the new format here, never on the query path
+        store = self._vector_store()
+        if store.migrated:
+            store.save()
+
         print("Indexing atomic context...")
+        report("atomic_context")
         self.augment_atomic_context()
+        report("location")
         self.augment_location()
 
         print("Indexing text and speech...")
+        report("text_and_speech")
         self.augment_text_and_speech()
         
         print("Indexing captions...")
+        report("caption")
         self.generate_caption_vector_db()
 
+        print("Indexing keywords...")
+        report("lexical")
+        self.build_lexical_index()
+
         print("Inferring composite context...")
-        self.augment_slide_window()
+        report("composite_context")
+        self.augment_slide_window(progress_callback=progress_callback)
 
         if self.detect_faces:
             print("Indexing faces...")
+            report("faces")
             self.augment_face()
 
         print("Indexing whole memory for RAG...")
+        report("rag")
         self.generate_vector_db_for_rag()
 
         # embeddings (vector db) will be saved in /vector_db folder
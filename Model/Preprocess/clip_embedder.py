@@ -0,0 +1,211 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from model_registry import get_model
+
+
+CLIP_BATCH_SIZE = int(os.getenv("CLIP_BATCH_SIZE", "32"))
+CLIP_DECODE_WORKERS = int(os.getenv("CLIP_DECODE_WORKERS", str(min(8, os.cpu_count() or 1))))
+
+
+def get_first_frame(video_path):
+    import cv2
+
+    # Check if the file exists
+    if not os.path.exists(video_path):
+        print(f"Error: File '{video_path}' not found.")
+        return None
+
+    cap = cv2.VideoCapture(video_path)
+
+    if not cap.isOpened():
+        print(f"Error: Cannot open video file {video_path}")
+        return None
+
+    ret, frame = cap.read()  # Read the first frame
+    cap.release()  # Release the video file
+
+    if not ret or frame is None:
+        print("Error: Could not read the first frame. File may be corrupted or unsupported format.")
+        return None
+
+    # Convert from BGR to RGB (if needed for display)
+    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    return frame  # Returns the first frame as a NumPy array
+
+
+def load_image(raw_memory):
+    """PIL image of an image memory or of the first frame of a video memory, None if it cannot be read."""
+    try:
+        if raw_memory['media_type'] == 'image':
+            return Image.open(raw_memory['filepath']).convert("RGB")
+        first_frame = get_first_frame(raw_memory['filepath'])
+        if first_frame is None:
+            return None
+        # opencv to PIL
+        return Image.fromarray(first_frame)
+    except Exception as e:
+        print(f"Error: {e}")
+        return None
+
+
+class ClipEmbedder():
+    """
+    CLIP image embeddings of many memories.
+
+    Worker threads decode and preprocess the images a few batches ahead while
+    the model runs batched forward passes in inference mode, so decoding and
+    inference overlap and only about two batches of pixels are held at once.
+    """
+    def __init__(self, batch_size: int = CLIP_BATCH_SIZE, workers: int = CLIP_DECODE_WORKERS) -> None:
+        self.batch_size = batch_size
+        self.workers = workers
+        self.stats = None
+
+    def _preprocess(self, raw_memory):
+        image = load_image(raw_memory)
+        if image is None:
+            return None
+        clip = get_model("clip")
+        return clip.processor(images=image, return_tensors="np")["pixel_values"][0]
+
+    def _batches(self, raw_memories):
+        """Yield (indices, pixel batch) in order; memories that cannot be read are left out."""
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="clip-decode") as pool:
+            pending = deque()
+            upcoming = iter(enumerate(raw_memories))
+
+            def submit(count):
+                for _ in range(count):
+                    item = next(upcoming, None)
+                    if item is None:
+                        return
+                    index, raw_memory = item
+                    pending.append((index, pool.submit(self._preprocess, raw_memory)))
+
+            submit(2 * self.batch_size)
+            indices, pixels = [], []
+            while pending:
+                index, future = pending.popleft()
+                submit(1)
+                pixel_values = future.result()
+                if pixel_values is None:
+                    continue
+                indices.append(index)
+                pixels.append(pixel_values)
+                if len(pixels) == self.batch_size:
+                    yield indices, np.stack(pixels)
+                    indices, pixels = [], []
+            if pixels:
+                yield indices, np.stack(pixels)
+
+    def embed(self, raw_memories, store=None, hashes=None):
+        """
+        Returns (embeddings, found): unit length float32 rows aligned with raw_memories
+        and a bool mask of the memories that could be embedded (their other rows are 0).
+
+        With a ClipEmbeddingStore, files whose content is already stored are not
+        decoded again and new embeddings are added to it (the caller saves it).
+        hashes are the content hashes of raw_memories if already known.
+        Every returned embedding then has float16 precision, so a rerun takes
+        the same decisions as the first run.
+        """
+        stored = {}
+        if store is None:
+            hashes = [None] * len(raw_memories)
+        else:
+            if hashes is None:
+                hashes = store.content_hashes([raw_memory['filepath'] for raw_memory in raw_memories], self.workers)
+            for i, content_hash in enumerate(hashes):
+                embedding = store.get(content_hash) if content_hash is not None else None
+                if embedding is not None:
+                    stored[i] = embedding
+        missing = [i for i in range(len(raw_memories)) if i not in stored]
+
+        embeddings = None
+        found = np.zeros(len(raw_memories), dtype=bool)
+        if stored:
+            embeddings = np.zeros((len(raw_memories), store.dim), dtype=np.float32)
+            embeddings[list(stored)] = np.stack(list(stored.values()))
+            found[list(stored)] = True
+
+        started = time.perf_counter()
+        computed = 0
+        if missing:
+            import torch
+
+            clip = get_model("clip")
+            for indices, pixels in self._batches([raw_memories[i] for i in missing]):
+                with torch.inference_mode():
+                    features = clip.model.get_image_features(pixel_values=torch.from_numpy(pixels).to(clip.device))
+                features = features.float().cpu().numpy()
+                norms = np.linalg.norm(features, axis=1, keepdims=True)
+                norms[norms == 0] = 1
+                features = features / norms
+                indices = [missing[i] for i in indices]
+                if store is not None:
+                    # only files that could be hashed are stored
+                    keep = [j for j, i in enumerate(indices) if hashes[i] is not None]
+                    store.put_many([hashes[indices[j]] for j in keep], features[keep])
+                    features = features.astype(np.float16).astype(np.float32)
+                if embeddings is None:
+                    embeddings = np.zeros((len(raw_memories), features.shape[1]), dtype=np.float32)
+                embeddings[indices] = features
+                found[indices] = True
+                computed += len(indices)
+        seconds = time.perf_counter() - started
+
+        if embeddings is None:
+            embeddings = np.zeros((len(raw_memories), 0), dtype=np.float32)
+        self.stats = {
+            "images": computed,
+            "reused": len(stored),
+            "seconds": round(seconds, 3),
+            "images_per_second": round(computed / seconds, 2) if computed and seconds > 0 else None,
+        }
+        print(f"Embedded {computed} images with CLIP in {seconds:.1f}s "
+              f"({self.stats['images_per_second']} images/sec, batch size {self.batch_size}, {self.workers} decode workers), "
+              f"reused {len(stored)} stored embeddings")
+        return embeddings, found
+
+
+def anchor_duplicates(embeddings, thresholds, found=None, window: int = 16):
+    """
+    Near duplicate detection over memories sorted by time: a memory is a
+    duplicate of the current anchor (the last kept memory) when their cosine
+    similarity is above its threshold, otherwise it becomes the new anchor.
+
+    Each anchor is compared with the following memories a window at a time in
+    one matrix-vector product (the window doubles while the run continues);
+    the first memory not similar enough ends its run. Memories outside found
+    are skipped. Returns anchor_of: -1 for kept memories, else the index of the
+    anchor they duplicate.
+    """
+    n = len(embeddings)
+    thresholds = np.asarray(thresholds, dtype=np.float32)
+    valid = np.flatnonzero(found) if found is not None else np.arange(n)
+    anchor_of = np.full(n, -1, dtype=np.int64)
+
+    position = 0
+    while position < len(valid):
+        anchor = valid[position]
+        start = position + 1
+        size = window
+        while start < len(valid):
+            rest = valid[start:start + size]
+            similarities = embeddings[rest] @ embeddings[anchor]
+            breaks = np.flatnonzero(similarities <= thresholds[rest])
+            run = breaks[0] if len(breaks) else len(rest)
+            anchor_of[rest[:run]] = anchor
+            start += run
+            if len(breaks):
+                break
+            size *= 2
+        position = start
+    return anchor_of
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from model_registry import CLIP_MODEL_ID
+from VectorDB.embedding_matrix import EmbeddingMatrix
+
+
+CLIP_STORE_FILE = "clip_embeddings.json"
+CLIP_VECTORS_FILE = "clip_embeddings.f16"
+
+
+def file_hash(filepath, chunk_size=1 << 20):
+    """sha256 of the content of a file."""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ClipEmbeddingStore():
+    """
+    CLIP image embeddings of a user's library, saved in the processed folder so
+    they are computed once per file.
+
+    Embeddings are keyed by the sha256 of the file content, so a renamed or
+    re-uploaded file keeps its embedding, and stored as unit length float16
+    rows in one flat file (clip_embeddings.f16) described by
+    clip_embeddings.json. The hash of each path is remembered with its size and
+    mtime so unchanged files are not read again. The store is discarded when
+    CLIP_MODEL_ID changes. The perceptual hashes (dHash) of the files are kept
+    in the same manifest.
+    """
+    def __init__(self, folder: str, model: str = CLIP_MODEL_ID) -> None:
+        self.folder = folder
+        self.model = model
+        # content hash -> row of matrix, whose items are the content hashes
+        self.rows = {}
+        self.matrix = EmbeddingMatrix(dtype=np.float16)
+        # filepath -> {"hash", "size", "mtime"}
+        self.files = {}
+        # content hash -> dHash
+        self.dhashes = {}
+        self.load()
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def dim(self):
+        return self.matrix.dim
+
+    def __contains__(self, content_hash):
+        return content_hash in self.rows
+
+    def load(self):
+        path = os.path.join(self.folder, CLIP_STORE_FILE)
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.files = manifest.get("files", {})
+        self.dhashes = manifest.get("dhashes", {})
+        if manifest["model"] != self.model:
+            print(f"CLIP embeddings in {self.folder} were computed with {manifest['model']}, recomputing them with {self.model}")
+            return
+
+        hashes = manifest["hashes"]
+        vectors_path = os.path.join(self.folder, CLIP_VECTORS_FILE)
+        vectors = np.fromfile(vectors_path, dtype=np.float16) if os.path.exists(vectors_path) else np.zeros(0, dtype=np.float16)
+        if not hashes or len(vectors) != len(hashes) * manifest["dim"]:
+            if hashes:
+                print(f"Warning: {CLIP_VECTORS_FILE} does not match {CLIP_STORE_FILE}, recomputing the CLIP embeddings")
+            return
+
+        self.matrix = EmbeddingMatrix.from_array(vectors.reshape(len(hashes), manifest["dim"]), hashes, dtype=np.float16)
+        self.rows = {content_hash: row for row, content_hash in enumerate(hashes)}
+
+    def content_hash(self, filepath):
+        """Content hash of filepath, read again only if its size or mtime changed. None if it cannot be read."""
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+        known = self.files.get(filepath)
+        if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+            return known["hash"]
+        try:
+            content_hash = file_hash(filepath)
+        except OSError as e:
+            print(f"Error: {e}")
+            return None
+        self.files[filepath] = {"hash": content_hash, "size": stat.st_size, "mtime": stat.st_mtime}
+        return content_hash
+
+    def content_hashes(self, filepaths, workers: int = 1):
+        """content_hash() of many files, files that changed are hashed in workers threads."""
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            return list(pool.map(self.content_hash, filepaths))
+
+    def get(self, content_hash):
+        """Stored embedding as float32, None if the content has not been embedded."""
+        row = self.rows.get(content_hash)
+        if row is None:
+            return None
+        return self.matrix.matrix[row].astype(np.float32)
+
+    def put_many(self, content_hashes, embeddings):
+        """Store unit length embeddings (rows) of content_hashes, replacing earlier ones."""
+        for content_hash, embedding in zip(content_hashes, np.asarray(embeddings, dtype=np.float16)):
+            row = self.rows.get(content_hash)
+            if row is not None:
+                self.matrix.matrix[row] = embedding
+            else:
+                self.rows[content_hash] = self.matrix.append(embedding, content_hash)
+
+    def save(self):
+        os.makedirs(self.folder, exist_ok=True)
+        vectors_path = os.path.join(self.folder, CLIP_VECTORS_FILE)
+        tmp_path = f"{vectors_path}.tmp"
+        self.matrix.matrix.tofile(tmp_path)
+        os.replace(tmp_path, vectors_path)
+
+        manifest = {"model": self.model, "dim": self.dim, "hashes": self.matrix.items, "files": self.files, "dhashes": self.dhashes}
+        path = os.path.join(self.folder, CLIP_STORE_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
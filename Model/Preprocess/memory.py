@@ -1,8 +1,8 @@
 from .ProcessMemoryContent import ProcessMemoryContent
 from .augment import AugmentContext
+from .prompt_fragments import PromptFragments
 import os
 import json
-import numpy as np
 from Face_Processing.face_extraction import FaceProcessor
 
 
@@ -19,6 +19,11 @@ class Memory():
         self.vector_db_folder = vector_db_folder
 
         self.detect_faces = detect_faces
+
+        self._memory_content_processed = None
+        self.memory_index = {}
+        # rendered prompt text of every memory, shared with AugmentContext and QueryHandler
+        self.prompt_fragments = PromptFragments()
         
         self.preprocess_memory = ProcessMemoryContent(
             raw_data_folder=raw_folder,
@@ -27,20 +32,55 @@ class Memory():
             json_data_file_path=json_data_file_path
             )
                 
-    def preprocess(self):
-        self.preprocess_memory.process(self.detect_faces)
+    @property
+    def memory_content_processed(self):
+        return self._memory_content_processed
+
+    @memory_content_processed.setter
+    def memory_content_processed(self, memory_content_processed):
+        self._memory_content_processed = memory_content_processed
+        self.build_memory_index()
+        self.prompt_fragments.invalidate()
+
+    def build_memory_index(self):
+        """
+        Map every filename to (record, filename): the memory itself, the near duplicates
+        merged into it as 'children', and both again without their extension.
+        """
+        self.memory_index = {}
+        for memory in self._memory_content_processed or []:
+            filenames = [memory['filename']] + [child['filename'] for child in memory.get('children', [])]
+            for filename in filenames:
+                self.memory_index.setdefault(filename, (memory, filename))
+        # names without extension last, so they never shadow a full filename
+        for filename, entry in list(self.memory_index.items()):
+            self.memory_index.setdefault(os.path.splitext(filename)[0], entry)
+
+    def find_memory(self, memory_id):
+        """Return the memory record of a filename, child filename or filename without extension, None if unknown."""
+        entry = self.memory_index.get(memory_id)
+        return entry[0] if entry else None
+
+    def find_memory_file(self, memory_id):
+        """Return the filename memory_id refers to, None if unknown."""
+        entry = self.memory_index.get(memory_id)
+        return entry[1] if entry else None
+
+    def preprocess(self, progress_callback=None):
+        self.preprocess_memory.process(self.detect_faces, progress_callback=progress_callback)
         self.memory_content_processed = self.preprocess_memory.memory_content_processed
 
-    def augment(self):
+    def augment(self, progress_callback=None):
         if self.memory_content_processed is None:
             raise ValueError("Memory content is not processed yet.")
         self.augment_context = AugmentContext(
             memory_content_processed=self.memory_content_processed,
             processed_folder=self.processed_folder,
             vector_db_folder=self.vector_db_folder,
-            detect_faces=self.detect_faces
+            detect_faces=self.detect_faces,
+            prompt_fragments=self.prompt_fragments
         )
-        self.augment_context.augment()
+        self.augment_context.augment(progress_callback=progress_callback)
 
     def change_face_tag(self, face_tag: str, new_face_tag: str):
         """Change the face tag in the memory content."""
@@ -102,9 +142,12 @@ class Memory():
                 json.dump(self.augment_context.face_list, f, ensure_ascii=False, indent=4)
 
         # Step 3: Remove tags from memory content
+        changed = []
         for item in self.memory_content_processed:
             if 'content' in item and 'face_tags' in item['content'] and face_tag in item['content']['face_tags']:
                 item['content']['face_tags'].remove(face_tag)
+                changed.append(item['filename'])
+        self.prompt_fragments.invalidate(changed)
         self.augment_context.memory_content_processed = self.memory_content_processed
         self.preprocess_memory.memory_content_processed = self.memory_content_processed
 
@@ -127,35 +170,13 @@ class Memory():
         with open(memory_file, "r", encoding="utf-8") as f:
             self.memory_content_processed = json.load(f)
 
-        # Load vector DB
-        self.augment_context = AugmentContext(memory_content_processed=self.memory_content_processed)
-        self.augment_context.caption_list = self._load_json("caption_list.json")
-        self.augment_context.caption_vector_db = self._load_npy("caption_vector_db.npy")
-
-        self.augment_context.text_list = self._load_json("text_list.json")
-        self.augment_context.text_vector_db = self._load_npy("text_vector_db.npy")
-
-        self.augment_context.objects_list = self._load_json("objects_list.json")
-        self.augment_context.objects_vector = self._load_npy("objects_vector_db.npy")
-
-        self.augment_context.people_list = self._load_json("people_list.json")
-        self.augment_context.people_vector = self._load_npy("people_vector_db.npy")
-
-        self.augment_context.activities_list = self._load_json("activities_list.json")
-        self.augment_context.activities_vector = self._load_npy("activities_vector_db.npy")
-
-        self.augment_context.composite_context = self._load_json("composite_list.json")
-        self.augment_context.composite_context_embeddings = self._load_npy("composite_vector_db.npy")
-
-        self.augment_context.knowledge = self._load_json("knowledge_list.json")
-        self.augment_context.knowledge_embeddings = self._load_npy("knowledge_vector_db.npy")
-
-        self.augment_context.vector_db_list = self._load_json("vector_db_list.json")
-        self.augment_context.vector_db_rag = self._load_npy("vector_db_rag.npy")
-
-        self.augment_context.location_list = self._load_json("location_list.json")
-        self.augment_context.location_vector_db = self._load_npy("location_vector_db.npy")
-
+        # Load vector DB: every namespace comes from the memory-mapped vector store
+        self.augment_context = AugmentContext(memory_content_processed=self.memory_content_processed,
+                                              processed_folder=self.processed_folder,
+                                              vector_db_folder=self.vector_db_folder,
+                                              detect_faces=self.detect_faces,
+                                              prompt_fragments=self.prompt_fragments)
+        self.augment_context.load_indexes()
         self.augment_context.face_list = self._load_json('face_list.json')
 
     def _load_json(self, filename):
@@ -165,10 +186,3 @@ class Memory():
             with open(file_path, "r", encoding="utf-8") as f:
                 return json.load(f)
         return None
-
-    def _load_npy(self, filename):
-        """Helper function to load NumPy vector files."""
-        file_path = os.path.join(self.vector_db_folder, filename)
-        if os.path.exists(file_path):
-            return np.load(file_path, allow_pickle=True)
-        return None
@@ -1,5 +1,11 @@
 import os
+import atexit
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from exiftool import ExifToolHelper
+from exiftool.exceptions import ExifToolExecuteError
 from PIL import ExifTags
 from pillow_heif import register_heif_opener
 from geopy.geocoders import Nominatim
@@ -7,6 +13,79 @@ from datetime import datetime
 
 register_heif_opener()
 
+# files sent to exiftool per call, and exiftool processes kept for parallel reads
+EXIFTOOL_BATCH_SIZE = int(os.getenv("EXIFTOOL_BATCH_SIZE", "64"))
+EXIFTOOL_SESSIONS = int(os.getenv("EXIFTOOL_SESSIONS", str(min(4, os.cpu_count() or 1))))
+
+
+class ExifToolPool():
+    """
+    Long lived exiftool processes shared by the whole process. Starting exiftool
+    (Perl) costs much more than reading a file, so up to size sessions are
+    started on first use, kept for later jobs and lent to one thread at a time.
+    """
+    def __init__(self, size: int = EXIFTOOL_SESSIONS) -> None:
+        self.size = max(1, size)
+        self.idle = queue.LifoQueue()
+        self.sessions = []
+        self.lock = threading.Lock()
+
+    def _acquire(self):
+        while True:
+            try:
+                return self.idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self.lock:
+                if len(self.sessions) < self.size:
+                    et = ExifToolHelper()
+                    et.run()
+                    self.sessions.append(et)
+                    return et
+            # every session is lent out, wait for one (or for a discarded one to be replaced)
+            try:
+                return self.idle.get(timeout=1)
+            except queue.Empty:
+                pass
+
+    @contextmanager
+    def session(self):
+        et = self._acquire()
+        try:
+            yield et
+        except ExifToolExecuteError:
+            # exiftool ran and reported an error (unreadable file), the session is fine
+            self.idle.put(et)
+            raise
+        except Exception:
+            # the process may be dead or out of sync, start a new one next time
+            self._discard(et)
+            raise
+        self.idle.put(et)
+
+    def _discard(self, et):
+        with self.lock:
+            if et in self.sessions:
+                self.sessions.remove(et)
+        try:
+            et.terminate()
+        except Exception:
+            pass
+
+    def close(self):
+        with self.lock:
+            sessions, self.sessions = self.sessions, []
+        self.idle = queue.LifoQueue()
+        for et in sessions:
+            try:
+                et.terminate()
+            except Exception:
+                pass
+
+
+exiftool_pool = ExifToolPool()
+atexit.register(exiftool_pool.close)
+
 
 class MetadataExtractor:
     def __init__(self):
@@ -222,58 +301,99 @@ class MetadataExtractor:
               return 'video'
 
 
-    def read_metadata_from_image_exiftool(self, image_path, latitude=None, longitude=None):
-          with ExifToolHelper() as et:
-              metadata = et.get_metadata(image_path)
-              date = metadata[0].get('EXIF:DateTimeOriginal', None)
-              if date is None:
-                  date = metadata[0].get('EXIF:DateTime', None)
-              if date is None:
-                  date = metadata[0].get('File:FileModifyDate', None)
-
-              date_info = self.parse_date_time_exiftool(date)
-
-              try:
-                  location_info = self.read_gps_from_metadata_exiftool(metadata)
-                  #################################################
-                  if location_info == {} and longitude and latitude:
-                      location_info = self.__read_location_given_lat_long(latitude, longitude)
-                      
-              except Exception as e:
-                  print(e)
-                  location_info = {}
-              capture_method = self.read_capture_method_from_metadata_exiftool(metadata)
-
-              metadata_result = {
-                  'temporal_info': date_info,
-                  'location': location_info,
-                  'capture_method': capture_method
-              }
-              return metadata_result
+    def read_exiftool_metadata(self, paths, batch_size: int = EXIFTOOL_BATCH_SIZE, sessions: int = EXIFTOOL_SESSIONS):
+        """
+        exiftool metadata (dict) of every path, None where it could not be read. Paths are
+        sent batch_size at a time to the shared exiftool sessions, up to sessions batches at once.
+        """
+        batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+        metadata = []
+        if sessions > 1 and len(batches) > 1:
+            with ThreadPoolExecutor(max_workers=sessions) as pool:
+                for batch_metadata in pool.map(self._read_exiftool_batch, batches):
+                    metadata.extend(batch_metadata)
+        else:
+            for batch in batches:
+                metadata.extend(self._read_exiftool_batch(batch))
+        return metadata
 
-    def read_metadata_from_video(self, video_path):
-          with ExifToolHelper() as et:
-              metadata = et.get_metadata(video_path)
-              date = metadata[0].get('QuickTime:CreationDate', None)
+    def _read_exiftool_batch(self, paths):
+        try:
+            with exiftool_pool.session() as et:
+                metadata = et.get_metadata(paths)
+            if len(metadata) == len(paths):
+                return metadata
+            error = f"exiftool returned {len(metadata)} results for {len(paths)} files"
+        except Exception as e:
+            error = e
+        if len(paths) == 1:
+            print(f"Error: {paths[0]}: {error}")
+            return [None]
+        # an unreadable file fails the whole batch, read its files one by one
+        return [self._read_exiftool_batch([path])[0] for path in paths]
+
+    def _read_one_exiftool(self, path):
+        metadata = self.read_exiftool_metadata([path])[0]
+        if metadata is None:
+            raise ValueError(f"Cannot read the metadata of {path}")
+        return [metadata]
+
+    def metadata_from_image_exiftool(self, metadata, latitude=None, longitude=None):
+          """metadata is the exiftool result of one image ([dict], as returned by get_metadata)"""
+          date = metadata[0].get('EXIF:DateTimeOriginal', None)
+          if date is None:
+              date = metadata[0].get('EXIF:DateTime', None)
+          if date is None:
+              date = metadata[0].get('File:FileModifyDate', None)
+
+          date_info = self.parse_date_time_exiftool(date)
+
+          try:
+              location_info = self.read_gps_from_metadata_exiftool(metadata)
+              #################################################
+              if location_info == {} and longitude and latitude:
+                  location_info = self.__read_location_given_lat_long(latitude, longitude)
+                  
+          except Exception as e:
+              print(e)
+              location_info = {}
+          capture_method = self.read_capture_method_from_metadata_exiftool(metadata)
+
+          metadata_result = {
+              'temporal_info': date_info,
+              'location': location_info,
+              'capture_method': capture_method
+          }
+          return metadata_result
 
-              if date is None:
-                  date = metadata[0].get('File:FileModifyDate', None)
+    def metadata_from_video_exiftool(self, metadata):
+          """metadata is the exiftool result of one video ([dict], as returned by get_metadata)"""
+          date = metadata[0].get('QuickTime:CreationDate', None)
 
-              date_info = self.parse_date_time_exiftool(date)
-              location_info = self.read_gps_from_metadata_exiftool(metadata)
-              capture_method = self.read_capture_method_from_metadata_exiftool(metadata)
-
-              duration = metadata[0].get('QuickTime:Duration', None)
-              fps = metadata[0].get('QuickTime:VideoFrameRate', None)
-
-              metadata_result = {
-                  'temporal_info': date_info,
-                  'location': location_info,
-                  'capture_method': capture_method,
-                  'duration': duration,
-                  'fps': fps,
-              }
-              return metadata_result
+          if date is None:
+              date = metadata[0].get('File:FileModifyDate', None)
+
+          date_info = self.parse_date_time_exiftool(date)
+          location_info = self.read_gps_from_metadata_exiftool(metadata)
+          capture_method = self.read_capture_method_from_metadata_exiftool(metadata)
+
+          duration = metadata[0].get('QuickTime:Duration', None)
+          fps = metadata[0].get('QuickTime:VideoFrameRate', None)
+
+          metadata_result = {
+              'temporal_info': date_info,
+              'location': location_info,
+              'capture_method': capture_method,
+              'duration': duration,
+              'fps': fps,
+          }
+          return metadata_result
+
+    def read_metadata_from_image_exiftool(self, image_path, latitude=None, longitude=None):
+          return self.metadata_from_image_exiftool(self._read_one_exiftool(image_path), latitude, longitude)
+
+    def read_metadata_from_video(self, video_path):
+          return self.metadata_from_video_exiftool(self._read_one_exiftool(video_path))
           
     def __read_location_given_lat_long(self, latitude, longitude):
         gps = (latitude, longitude)
@@ -0,0 +1,120 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+from .clip_embedder import get_first_frame
+
+
+# photos whose 64 bit dHash differ in at most this many bits are duplicates without running CLIP
+DHASH_MAX_DISTANCE = int(os.getenv("DHASH_MAX_DISTANCE", "4"))
+DHASH_SIZE = 8
+# hashes with fewer set bits, unset bits or bit changes than this carry too little
+# of the picture (dark, flat or blank frames all hash close to 0) to be matched
+DHASH_MIN_BITS = int(os.getenv("DHASH_MIN_BITS", "8"))
+
+
+def dhash(image, size: int = DHASH_SIZE):
+    """
+    Difference hash of a PIL image: the image is shrunk to (size + 1) x size
+    grayscale pixels and each bit tells whether a pixel is brighter than its
+    right neighbour. Returns a size * size bit int.
+    """
+    pixels = np.asarray(image.convert("L").resize((size + 1, size), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def is_informative(hash_value, bits: int = DHASH_SIZE * DHASH_SIZE, min_bits: int = DHASH_MIN_BITS):
+    """False for hashes of images with almost no gradients, which match unrelated images."""
+    set_bits = bin(hash_value).count("1")
+    transitions = bin(hash_value ^ (hash_value >> 1)).count("1")
+    return min_bits <= set_bits <= bits - min_bits and transitions >= min_bits
+
+
+def memory_dhash(raw_memory, size: int = DHASH_SIZE):
+    """dHash of an image memory or of the first frame of a video memory, None if it cannot be read."""
+    try:
+        if raw_memory['media_type'] == 'image':
+            image = Image.open(raw_memory['filepath'])
+            # JPEGs are decoded at 1/2 to 1/8 scale, only a few pixels are needed
+            image.draft("L", (size * 8, size * 8))
+            return dhash(image, size)
+        first_frame = get_first_frame(raw_memory['filepath'])
+        if first_frame is None:
+            return None
+        return dhash(Image.fromarray(first_frame), size)
+    except Exception as e:
+        print(f"Error: {e}")
+        return None
+
+
+class HashIndex():
+    """
+    Hashes within max_distance bits of a query, found without comparing it to
+    every hash: the bits are split into max_distance + 1 bands, and two hashes
+    that close agree exactly on at least one band, so only hashes sharing a
+    band with the query are compared.
+    """
+    def __init__(self, max_distance: int = DHASH_MAX_DISTANCE, bits: int = DHASH_SIZE * DHASH_SIZE) -> None:
+        self.max_distance = max_distance
+        band_count = min(max_distance + 1, bits)
+        bounds = np.linspace(0, bits, band_count + 1).astype(int)
+        # (shift, mask) of every band
+        self.bands = [(int(start), (1 << int(end - start)) - 1) for start, end in zip(bounds[:-1], bounds[1:])]
+        self.tables = [{} for _ in self.bands]
+        self.hashes = {}
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def add(self, hash_value, item):
+        self.hashes[item] = hash_value
+        for table, (shift, mask) in zip(self.tables, self.bands):
+            table.setdefault((hash_value >> shift) & mask, []).append(item)
+
+    def nearest(self, hash_value):
+        """(item, distance) of the closest hash within max_distance bits, None if there is none."""
+        best = None
+        seen = set()
+        for table, (shift, mask) in zip(self.tables, self.bands):
+            for item in table.get((hash_value >> shift) & mask, []):
+                if item in seen:
+                    continue
+                seen.add(item)
+                distance = hamming_distance(hash_value, self.hashes[item])
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (item, distance)
+        return best
+
+
+def find_duplicates(content_hashes, dhashes, max_distance: int = DHASH_MAX_DISTANCE):
+    """
+    Duplicates found before CLIP, over memories in time order. A memory is a
+    duplicate of the first memory with the same content hash, or, when it has
+    an informative dHash, of the closest earlier memory anywhere in the library
+    whose dHash is within max_distance bits. None and uninformative hashes are
+    not compared (CLIP decides for those). Returns
+    parent_of: -1 for memories left to CLIP, else the index of the memory they
+    duplicate (itself never a duplicate).
+    """
+    parent_of = np.full(len(content_hashes), -1, dtype=np.int64)
+    first_of_content = {}
+    index = HashIndex(max_distance)
+    for i, (content_hash, hash_value) in enumerate(zip(content_hashes, dhashes)):
+        if content_hash is not None and content_hash in first_of_content:
+            parent_of[i] = first_of_content[content_hash]
+            continue
+        if hash_value is not None and is_informative(hash_value):
+            match = index.nearest(hash_value)
+            if match is not None:
+                parent_of[i] = match[0]
+                continue
+            index.add(hash_value, i)
+        if content_hash is not None:
+            first_of_content[content_hash] = i
+    return parent_of
@@ -0,0 +1,52 @@
+from LLM.llm import count_tokens
+from utils import count_words, parse_memory_to_string, parse_memory_to_string_lite, parse_memory_to_string_update
+
+
+# OCR text longer than this is left out of the cached fragment (trimmed per query instead)
+MAX_VISIBLE_TEXT_WORDS = 100
+
+FORMATS = {
+    "full": parse_memory_to_string,
+    "lite": parse_memory_to_string_lite,
+    "faces": parse_memory_to_string_update,
+}
+
+
+class PromptFragments():
+    """
+    Rendered prompt text of every memory and its token count, computed once per
+    memory and format ('full', 'lite' or 'faces') instead of on every query.
+
+    Memories are keyed by filename. invalidate() must be called when a memory
+    changes after processing (face tags).
+    """
+    def __init__(self) -> None:
+        # (filename, format) -> {"text", "tokens", "long_text"}
+        self.fragments = {}
+
+    def get(self, memory, format="full"):
+        """
+        {"text", "tokens", "long_text"} of memory. long_text is True when the memory
+        has OCR text over MAX_VISIBLE_TEXT_WORDS words, which the text leaves out.
+        """
+        key = (memory['filename'], format)
+        fragment = self.fragments.get(key)
+        if fragment is None:
+            text = FORMATS[format](memory)
+            fragment = self.fragments[key] = {
+                "text": text,
+                "tokens": count_tokens(text),
+                "long_text": count_words(memory['content'].get('text') or '') >= MAX_VISIBLE_TEXT_WORDS,
+            }
+        return fragment
+
+    def text(self, memory, format="full"):
+        return self.get(memory, format)["text"]
+
+    def invalidate(self, filenames=None):
+        """Drop the fragments of filenames, or of every memory."""
+        if filenames is None:
+            self.fragments = {}
+            return
+        filenames = set(filenames)
+        self.fragments = {key: fragment for key, fragment in self.fragments.items() if key[0] not in filenames}
@@ -0,0 +1,86 @@
+from Query.fusion import RRF_K
+
+
+class CandidateSet():
+    """
+    Candidate memories of one query: memory id -> the score each filter that proposed it gave it.
+
+    Scores of different filters come from different embedding spaces (or are
+    fused keyword scores) and cannot be compared, so candidates are ranked by
+    reciprocal rank fusion of the rank each filter gives them. Filters that
+    match exactly (faces, event dates) add their ids without a score and rank
+    all of them first.
+    """
+    def __init__(self, k: int = RRF_K) -> None:
+        # memory id -> {source: best score, None for exact matches}
+        self.candidates = {}
+        self.k = k
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def __contains__(self, memory_id):
+        return memory_id in self.candidates
+
+    def add(self, memory_ids, source, score=None):
+        for memory_id in memory_ids:
+            scores = self.candidates.setdefault(memory_id, {})
+            if source not in scores:
+                scores[source] = None if score is None else float(score)
+            elif score is not None and (scores[source] is None or score > scores[source]):
+                scores[source] = float(score)
+
+    def add_retrieved(self, scored_items, source):
+        """Add the memory_ids of every (item, similarity) pair retrieved from a vector index."""
+        for item, score in scored_items:
+            self.add(item['memory_ids'], source, score)
+
+    def intersect(self, memory_ids):
+        """Keep only the candidates in memory_ids."""
+        keep = set(memory_ids)
+        self.candidates = {memory_id: scores for memory_id, scores in self.candidates.items()
+                           if memory_id in keep}
+
+    def ids(self):
+        return list(self.candidates)
+
+    def source_ranks(self):
+        """
+        {source: {memory id: rank}}: rank 1 is the best score of the source, equal
+        scores share a rank and exact matches (no score) rank 1.
+        """
+        by_source = {}
+        for memory_id, scores in self.candidates.items():
+            for source, score in scores.items():
+                by_source.setdefault(source, []).append((float("inf") if score is None else score, memory_id))
+
+        ranks = {}
+        for source, scored in by_source.items():
+            scored.sort(key=lambda pair: pair[0], reverse=True)
+            source_ranks = ranks[source] = {}
+            rank = 0
+            previous = None
+            for position, (score, memory_id) in enumerate(scored, start=1):
+                if score != previous:
+                    rank, previous = position, score
+                source_ranks[memory_id] = rank
+        return ranks
+
+    def fused_scores(self):
+        """{memory id: sum(1 / (k + rank)) over the filters that proposed it}."""
+        fused = dict.fromkeys(self.candidates, 0.0)
+        for source_ranks in self.source_ranks().values():
+            for memory_id, rank in source_ranks.items():
+                fused[memory_id] += 1.0 / (self.k + rank)
+        return fused
+
+    def ranked(self):
+        """Ids by decreasing fused score."""
+        fused = self.fused_scores()
+        return sorted(self.candidates, key=lambda memory_id: fused[memory_id], reverse=True)
+
+    def provenance(self):
+        """{memory id: {"fused", "sources"}} for debugging which filter contributed what."""
+        fused = self.fused_scores()
+        return {memory_id: {"fused": fused[memory_id], "sources": dict(sorted(scores.items()))}
+                for memory_id, scores in self.candidates.items()}
@@ -0,0 +1,141 @@
+import os
+import re
+
+from LLM.llm import TOKENIZER, count_tokens
+from Preprocess.prompt_fragments import FORMATS, MAX_VISIBLE_TEXT_WORDS, PromptFragments
+from VectorDB.bm25 import tokenize
+from utils import count_words
+
+
+# tokens of memories, composite context and knowledge in the answer prompt, 0 for no limit
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "12000"))
+# share of the budget composite context and knowledge may each take before memories are packed
+CONTEXT_SECTION_SHARE = float(os.getenv("CONTEXT_SECTION_SHARE", "0.2"))
+
+
+def trim_text(text, query, max_words=MAX_VISIBLE_TEXT_WORDS):
+    """
+    Shorten text of max_words words or more (the texts the memory formatters
+    leave out) to fewer than max_words: the first line is kept for context, then the
+    lines sharing the most words with the query. Lines stay in their original
+    order and skipped parts are marked with '...'.
+    """
+    if not text or count_words(text) < max_words:
+        return text
+
+    segments = [segment.strip() for segment in re.split(r"\n+|(?<=[.!?])\s+", text) if segment.strip()]
+    query_terms = set(tokenize(query))
+    order = [0] + sorted(range(1, len(segments)),
+                         key=lambda i: len(query_terms.intersection(tokenize(segments[i]))), reverse=True)
+
+    kept = set()
+    words = 0
+    limit = max_words - 1
+    for i in order:
+        segment_words = count_words(segments[i])
+        if words + segment_words > limit:
+            if not kept:
+                # a single huge line: keep its beginning
+                kept_text = " ".join(segments[i].split()[:limit])
+                return f"{kept_text} ..."
+            continue
+        kept.add(i)
+        words += segment_words
+
+    trimmed = []
+    for i in range(len(segments)):
+        if i in kept:
+            trimmed.append(segments[i])
+        elif not trimmed or trimmed[-1] != "...":
+            trimmed.append("...")
+    return " ".join(trimmed)
+
+
+class ContextPacker():
+    """
+    Builds the answer prompt within a token budget.
+
+    Composite context and knowledge are packed first, each limited to
+    section_share of the budget, then memories in ranking order fill what is
+    left. Packed memories are written in date order. Memory text and token
+    counts come from the cached prompt fragments; only memories with long OCR
+    text are rendered again, with the text trimmed for the query. report holds
+    the tokens used by and the entries dropped from each section.
+    """
+    def __init__(self, query, fragments: PromptFragments, memory_format, format_composite, format_knowledge,
+                 budget: int = CONTEXT_TOKEN_BUDGET, section_share: float = CONTEXT_SECTION_SHARE) -> None:
+        self.query = query
+        self.fragments = fragments
+        self.memory_format = memory_format
+        self.format_composite = format_composite
+        self.format_knowledge = format_knowledge
+        self.budget = budget
+        self.section_share = section_share
+        self.report = None
+
+    def memory_entry(self, memory):
+        """(text, tokens) of a memory in the prompt."""
+        fragment = self.fragments.get(memory, self.memory_format)
+        if not fragment["long_text"]:
+            return fragment["text"], fragment["tokens"]
+        text = FORMATS[self.memory_format](memory, trim_text(memory['content']['text'], self.query))
+        return text, count_tokens(text)
+
+    @staticmethod
+    def _entry(text):
+        return text, count_tokens(text)
+
+    def _fill(self, header, entries, limit):
+        """Greedily take the (text, tokens) entries that fit in limit tokens, None for no limit. Returns (kept indices, tokens)."""
+        tokens = count_tokens(header)
+        kept = []
+        for i, (_, entry_tokens) in enumerate(entries):
+            if limit is not None and tokens + entry_tokens > limit:
+                continue
+            kept.append(i)
+            tokens += entry_tokens
+        return kept, tokens
+
+    def pack(self, ranked_memories, composite_context, knowledge):
+        """ranked_memories / composite_context / knowledge are ordered best first. Returns the prompt."""
+        memory_entries = [self.memory_entry(memory) for memory in ranked_memories]
+        composite_entries = [self._entry(self.format_composite(context)) for context in composite_context]
+        knowledge_entries = [self._entry(self.format_knowledge(item)) for item in knowledge]
+
+        section_limit = int(self.budget * self.section_share) if self.budget else None
+        kept_composite, composite_tokens = self._fill("Composite Context:\n", composite_entries, section_limit)
+        kept_knowledge, knowledge_tokens = self._fill("Knowledge:\n", knowledge_entries, section_limit)
+        memory_limit = self.budget - composite_tokens - knowledge_tokens if self.budget else None
+        kept_memories, memory_tokens = self._fill("Memories:\n", memory_entries, memory_limit)
+
+        # the answer reads the memories in time order
+        kept_memories.sort(key=lambda i: ranked_memories[i]['metadata']['temporal_info']['date_string'])
+
+        prompt = "Memories:\n"
+        prompt += "".join(memory_entries[i][0] for i in kept_memories)
+        prompt += "Composite Context:\n"
+        prompt += "".join(composite_entries[i][0] for i in kept_composite)
+        prompt += "Knowledge:\n"
+        prompt += "".join(knowledge_entries[i][0] for i in kept_knowledge)
+
+        self.report = {
+            "budget": self.budget,
+            "tokens": memory_tokens + composite_tokens + knowledge_tokens,
+            "tokenizer": TOKENIZER,
+            "sections": {
+                "memories": {"tokens": memory_tokens, "kept": len(kept_memories),
+                             "dropped": len(memory_entries) - len(kept_memories)},
+                "composite_context": {"tokens": composite_tokens, "kept": len(kept_composite),
+                                      "dropped": len(composite_entries) - len(kept_composite)},
+                "knowledge": {"tokens": knowledge_tokens, "kept": len(kept_knowledge),
+                              "dropped": len(knowledge_entries) - len(kept_knowledge)},
+            },
+        }
+        return prompt
+
+    @staticmethod
+    def print_report(report):
+        budget = report["budget"] or "unlimited"
+        print(f"Context tokens ({report['tokenizer']}): {report['tokens']} / {budget}")
+        for name, section in report["sections"].items():
+            print(f"  {name:<18} {section['tokens']:>6} tokens, {section['kept']} kept, {section['dropped']} dropped")
@@ -0,0 +1,25 @@
+RRF_K = 60
+
+
+def ranked_memory_ids(scored_items):
+    """Memory ids of retrieved (item, similarity) pairs in retrieval order, each id once."""
+    return list(dict.fromkeys(memory_id for item, _ in scored_items for memory_id in item['memory_ids']))
+
+
+def reciprocal_rank_scores(rankings, k: int = RRF_K):
+    """
+    Fuse ranked lists of ids: an id scores sum(1 / (k + rank)) over the lists it
+    appears in (rank starts at 1). Only ranks matter, so similarities and BM25
+    scores can be fused without calibrating them. Returns {id: fused score}.
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, start=1):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank)
+    return scores
+
+
+def reciprocal_rank_fusion(rankings, k: int = RRF_K):
+    """Ids of reciprocal_rank_scores() by decreasing fused score."""
+    scores = reciprocal_rank_scores(rankings, k)
+    return sorted(scores, key=lambda item_id: scores[item_id], reverse=True)
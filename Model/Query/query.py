@@ -1,17 +1,27 @@
-import numpy as np
 from Preprocess.memory import Memory
 from LLM.llm import OpenAIWrapper
-import time 
+import asyncio
+import threading
 from Query.query_augment import QueryAugmentation
-from datetime import datetime
-from utils import parse_memory_to_string, parse_composite_context_to_string, parse_knowledge_to_string, parse_memory_to_string_update
+from Query.candidates import CandidateSet
+from Query.context_packer import ContextPacker
+from Query.fusion import ranked_memory_ids, reciprocal_rank_scores
+from Query.query_executor import StageTimer
+from Query.reranker import COMPOSITE_RERANKER, create_reranker
+from Query.retrieval_planner import RetrievalPlanner
+from Query.temporal_index import TemporalIndex
+from utils import parse_composite_context_to_string, parse_knowledge_to_string
 
 
 class QueryHandler():
-    def __init__(self,memory: Memory, detect_faces=False, debug: bool = False):
+    def __init__(self,memory: Memory, detect_faces=False, debug: bool = False, min_score: float = None):
         self.memory = memory
+        # retrieved entries less similar than this are dropped, None keeps every top-k entry
+        self.min_score = min_score
         self.llm = OpenAIWrapper()
-        self.cost = 0
+        # one instance per reranker name, shared by the concurrent queries of the handler
+        self.rerankers = {}
+        self.rerankers_lock = threading.Lock()
         self.detect_faces = detect_faces
         self.debug = debug
         if debug: 
@@ -22,56 +32,28 @@ class QueryHandler():
 
     def _load_augmented_memory(self, memory: Memory):
         self.memory_to_query = memory.memory_content_processed.copy()
+        self.temporal_index = TemporalIndex(self.memory_to_query)
 
         augmented_context = memory.augment_context
 
-        self.caption = augmented_context.caption_list
-        self.caption_vector = augmented_context.caption_vector_db
-
-        self.text = augmented_context.text_list
-        self.text_vector = augmented_context.text_vector_db
-
-        self.objects = augmented_context.objects_list
-        self.objects_vector = augmented_context.objects_vector
-
-        self.people = augmented_context.people_list
-        self.people_vector = augmented_context.people_vector
-
-        self.activities = augmented_context.activities_list
-        self.activities_vector = augmented_context.activities_vector
-
-        self.composite_context = augmented_context.composite_context
-        self.composite_context_vector = augmented_context.composite_context_embeddings
-
-        self.knowledge = memory.augment_context.knowledge
-        self.knowledge_vector = memory.augment_context.knowledge_embeddings
-
-        self.rag = augmented_context.vector_db_list
-        self.rag_vector = augmented_context.vector_db_rag
-
-        self.location_list = augmented_context.location_list
-        self.location_vector = augmented_context.location_vector_db
+        # one VectorIndex per namespace: caption, text, objects, people, activities,
+        # location, composite, knowledge and rag
+        self.indexes = augmented_context.indexes
+        self.lexical_index = augmented_context.lexical_index
 
         self.faces = augmented_context.face_list
 
     ## baseline model
-    def query_rag(self, query, topk=25, llm='openai'):
-        query_emb = self.llm.calculate_embeddings(query)
-        query_emb = np.array(query_emb).reshape(-1, 1)
-        similarities = np.matmul(self.rag_vector, query_emb).flatten()
-        
-        top_k = np.argsort(similarities)[-topk:][::-1] if len(similarities) > topk else np.argsort(similarities)[::-1]
-        
-        retrieved_rag = []
-        for index in top_k:
-            if index < len(self.rag):
-                retrieved_rag.append(self.rag[index])
+    def query_rag(self, query, topk=25, llm='openai', query_embedding=None):
+        query_emb = query_embedding if query_embedding is not None else self.llm.calculate_embeddings(query)
+        rag_index = self.indexes.get('rag')
+        top_k, similarities = rag_index.search(query_emb, topk, min_score=self.min_score)
+        retrieved_rag = [rag_index.items[index] for index in top_k]
 
         if self.debug:
-            print(f"len(self.rag) = {len(self.rag)}")
+            print(f"len(rag) = {len(rag_index)}")
             print("Similarities:")
             print(similarities)
-            print(f"len Similarities: {len(similarities)}")
             print("Top K")
             print('-------')
             print(f"Top K indices : {top_k}")
@@ -91,16 +73,60 @@ class QueryHandler():
         print("RAG API cost: ", cost)
         return result
 
-    def query_memory(self, query: str, topk: int = 30, atomic_topk: int = 5, location_topk: int = 5, composite_topk: int = 10, knowledge_topk: int = 10, text_topk: int = 10, llm='openai'):
-        start_time_query = time.time()
-        start_time = time.time()
+    def query_memory(self, query: str, topk: int = 30, atomic_topk: int = 5, location_topk: int = 5, composite_topk: int = 10, knowledge_topk: int = 10, text_topk: int = 10, lexical_topk: int = 10, llm='openai', speculative_composite: bool = None, reranker: str = None, stats: dict = None, query_embedding=None):
+        """Blocking entry point, runs query_memory_async on its own event loop."""
+        return asyncio.run(self.query_memory_async(query, topk=topk, atomic_topk=atomic_topk, location_topk=location_topk,
+                                                   composite_topk=composite_topk, knowledge_topk=knowledge_topk,
+                                                   text_topk=text_topk, lexical_topk=lexical_topk, llm=llm, speculative_composite=speculative_composite,
+                                                   reranker=reranker, stats=stats, query_embedding=query_embedding))
+
+    async def query_memory_async(self, query: str, topk: int = 30, atomic_topk: int = 5, location_topk: int = 5, composite_topk: int = 10, knowledge_topk: int = 10, text_topk: int = 10, lexical_topk: int = 10, llm='openai', speculative_composite: bool = None, reranker: str = None, stats: dict = None, query_embedding=None):
+        """
+        Query augmentation and the query embedding start together. With speculative_composite the
+        composite context is retrieved with the query itself and reranked while the augmentation
+        runs; the rerank is redone only if the augmentation gives a different complex context, and
+        the speculative one is then cancelled. By default only local rerankers speculate, since a
+        wasted LLM rerank costs a request. reranker picks how composite events are filtered (llm, cross_encoder or threshold),
+        defaulting to COMPOSITE_RERANKER.
+        The handler is shared by concurrent queries, so nothing of this query is stored on it: the API
+        cost, the stage timings with the critical path and the context token report are written to
+        the stats dict passed by the caller ("cost", "timings", "context_report", "rerank_decisions").
+        query_embedding is the embedding of query when the caller already has it (the answer cache
+        key), so the query is not embedded again. The augmented probes depend on the augmentation and
+        are embedded together in one request once it returns.
+        """
+        stats = {} if stats is None else stats
+        stats["cost"] = 0
+        timer = StageTimer()
+        reranker = self.get_reranker(reranker)
 
         augment_query = QueryAugmentation(query, self.detect_faces)
-        augmented_query, cost = augment_query.augment(llm=llm)
-        
-        self.cost += cost
-        time_cost = time.time() - start_time
-        print("Query augmentation time cost: ", time_cost)
+        augmentation = asyncio.create_task(timer.run("augmentation", augment_query.augment, llm=llm))
+
+        query_planner = RetrievalPlanner(self.llm, self.indexes, min_score=self.min_score)
+        query_planner.add('composite', query, composite_topk)
+        if query_embedding is not None:
+            query_planner.embeddings[query] = query_embedding
+        try:
+            query_embeddings = await timer.run("query_embedding", query_planner.embed)
+        except BaseException:
+            augmentation.cancel()
+            raise
+        if query not in query_embeddings:
+            augmentation.cancel()
+            raise ValueError("Query embedding is empty or None. Please check the input query.")
+
+        if speculative_composite is None:
+            speculative_composite = reranker.local
+        speculative_rerank = None
+        if speculative_composite:
+            speculative_composite_context = query_planner.run()['composite']
+            speculative_rerank = asyncio.create_task(timer.run(
+                "composite_rerank", self.rerank_composite_context, speculative_composite_context, query, llm, reranker,
+                depends_on=("query_embedding",)))
+
+        augmented_query, cost = await augmentation
+        stats["cost"] += cost
 
         augmented_query = augmented_query['augmented_query']
         # print("Augmented Query : ")
@@ -118,121 +144,116 @@ class QueryHandler():
         if self.detect_faces:
             tags = augmented_query['tags']
 
-        start_time = time.time()
-
-        ####################### filter date strict 
-        ####################### if date = '' doesn't filter
-        strict_filtered_memory = []
-        if start_date != "" and end_date != "":
-            # Filter the memories
-            strict_filtered_memory = self.filter_date(start_date, end_date)
-        
-        ####################### filter composite context
-        filtered_memory_list = []
-        composite_memory_list, all_related_composite = self.filter_composite_context(complex_context, query, composite_topk, llm=llm)
-        filtered_memory_list = list(set(filtered_memory_list + composite_memory_list))
-
-        ####################### atomic
-        atomic_memory_list = self.filter_atomic_context(objects, people, activities, query, atomic_topk)
-        filtered_memory_list = list(set(filtered_memory_list + atomic_memory_list))
-
-        ####################### filter location
-        if location != "":
-            emb = self.llm.calculate_embeddings(location)
-            emb = np.array(emb).reshape(-1, 1)
-            if (self.location_vector is None or 
-                not isinstance(self.location_vector, np.ndarray) or 
-                self.location_vector.size == 0 or
-                len(self.location_list) == 0):
-                pass
-            else:
-                similarities = np.matmul(self.location_vector, emb).flatten()
-
-                top_k_location = np.argsort(similarities)[-location_topk:][::-1]
-                retrieved_location = [self.location_list[i] for i in top_k_location]
-
-                for location in retrieved_location:
-                    memory_id = location['memory_ids']
-                    filtered_memory_list = list(set(filtered_memory_list + memory_id))
-
-        ####################### filter faces
-        if self.detect_faces:
-            if tags is not None:
-                face_memory_list = []
-                for tag in tags:
-                    matching_faces = [face for face in self.faces if tag.lower() == face['face_tag'].lower()]
-
-                    for face in matching_faces:
-                        face_memory_list.extend(face['memory_ids'])
-
-                filtered_memory_list = list(set(filtered_memory_list + face_memory_list))
-
-        ####################### filter caption
-        query_emb = self.llm.calculate_embeddings(query)
-        if query_emb is None or len(query_emb) == 0:
-            raise ValueError("Query embedding is empty or None. Please check the input query.")
-        
-        query_emb = np.array(query_emb).reshape(-1, 1)
-
-        similarities = np.matmul(self.caption_vector, query_emb).flatten()
-
-        top_k_caption = np.argsort(similarities)[-topk:][::-1]
-        retrieved_caption = [self.caption[i] for i in top_k_caption]
-
-        for caption in retrieved_caption:
-            memory_id = caption['memory_ids']
-            filtered_memory_list = list(set(filtered_memory_list + memory_id))
-
-
-        ####################### filter text
-        if self.text_vector is not None and len(self.text_vector) != 0:
-            similarities = np.matmul(self.text_vector, query_emb).flatten()
-            top_k_text = np.argsort(similarities)[-text_topk:][::-1]
-            retrieved_text = [self.text[i] for i in top_k_text]
-
-            for text in retrieved_text:
-                memory_id = text['memory_ids']
-                filtered_memory_list = list(set(filtered_memory_list + memory_id))
-
-        if strict_filtered_memory:
-            # only keep the memories that are in both lists
-            filtered_memory_list = list(set(filtered_memory_list) & set(strict_filtered_memory))
-
-        ####################### identify related knowledge
-        filtered_knowledge = self.filter_knowledge(query, knowledge_topk)
+        ####################### similarity searches
+        ####################### every remaining probe is embedded in one request
+        composite_probe = complex_context if complex_context != "" else query
+        if speculative_rerank is not None and composite_probe != query:
+            # the speculation lost, its result is not used or billed
+            speculative_rerank.cancel()
+            speculative_rerank = None
+        planner = RetrievalPlanner(self.llm, self.indexes, min_score=self.min_score)
+        planner.embeddings = dict(query_embeddings)
+        planner.add('composite', composite_probe, composite_topk)
+        planner.add('objects', objects, atomic_topk)
+        planner.add('people', people, atomic_topk)
+        planner.add('activities', activities, atomic_topk)
+        planner.add('location', location, location_topk)
+        planner.add('caption', query, topk)
+        planner.add('text', query, text_topk)
+        planner.add('knowledge', query, knowledge_topk)
+
+        await timer.run("embeddings", planner.embed, depends_on=("augmentation", "query_embedding"))
+        retrieved = planner.run()
+
+        ####################### rerank composite context
+        if speculative_rerank is not None and composite_probe == query:
+            reranked_composite = speculative_composite_context
+            all_related_composite, cost = await speculative_rerank
+            rerank_stage = "composite_rerank"
+        else:
+            reranked_composite = retrieved['composite']
+            rerank = timer.run("composite_rerank_retry", self.rerank_composite_context, reranked_composite, query, llm, reranker,
+                               depends_on=("embeddings",))
+            all_related_composite, cost = await rerank
+            rerank_stage = "composite_rerank_retry"
+        stats["cost"] += cost
+        # (similarity, kept) of every reranked event, the examples ThresholdReranker.fit learns from
+        related_ids = {id(context) for context, _ in all_related_composite}
+        stats["rerank_decisions"] = [(float(score), id(context) in related_ids) for context, score in reranked_composite]
+
+        with timer.measure("filtering", depends_on=(rerank_stage, "embeddings")):
+            candidates = CandidateSet()
+            self.filter_composite_context(all_related_composite, candidates)
+
+            ####################### filter date strict 
+            ####################### if date = '' doesn't filter
+            strict_filtered_memory = []
+            if start_date != "" and end_date != "":
+                # Filter the memories
+                strict_filtered_memory = self.filter_date(start_date, end_date)
 
-        ##########################################################################
-        # send the filtered memory to the LLM for answer
-        memories_final = []
-        for memory_id in filtered_memory_list:
-            memory = self._search_memory_id(memory_id)
-            if not memory:
-                continue
-            memories_final.append(memory)
+            ####################### atomic
+            self.filter_atomic_context(retrieved, candidates)
 
-        # order the memories by the date
-        memories_final = sorted(memories_final, key=lambda x: x['metadata']['temporal_info']['date_string'])
+            ####################### filter location
+            candidates.add_retrieved(retrieved.get('location', []), 'location')
 
-        # generate prompt
-        final_prompt = self.generate_prompt(memories_final, all_related_composite, filtered_knowledge)
-        # print("Final Prompt : ")
-        # print(final_prompt)
+            ####################### filter faces
+            if self.detect_faces:
+                if tags is not None:
+                    for tag in tags:
+                        matching_faces = [face for face in self.faces if tag.lower() == face['face_tag'].lower()]
 
-        time_cost = time.time() - start_time
-        print("Memory filtering time cost: ", time_cost)
+                        for face in matching_faces:
+                            candidates.add(face['memory_ids'], 'faces')
 
-        start_time = time.time()
-        response, result, cost = self.llm.query_memory(query, final_prompt, self.detect_faces, llm=llm)
+            ####################### filter caption and text, fused with keyword matches
+            if self.lexical_index is not None:
+                self.filter_hybrid(query, retrieved, candidates, topk, lexical_topk)
+            else:
+                candidates.add_retrieved(retrieved['caption'], 'caption')
+                candidates.add_retrieved(retrieved['text'], 'text')
+
+            if strict_filtered_memory:
+                # only keep the memories that are in both lists
+                candidates.intersect(strict_filtered_memory)
+
+            if self.debug:
+                print("Candidates:")
+                print(candidates.provenance())
+
+            ####################### identify related knowledge
+            filtered_knowledge = [knowledge for knowledge, _ in retrieved['knowledge']]
+
+            ##########################################################################
+            # send the filtered memory to the LLM for answer
+            memories_final = []
+            seen = set()
+            for memory_id in candidates.ranked():
+                memory = self._search_memory_id(memory_id)
+                # a memory and one of its children may both be retrieved
+                if not memory or id(memory) in seen:
+                    continue
+                seen.add(id(memory))
+                memories_final.append(memory)
+
+            # generate prompt: the best ranked memories and events that fit the token budget, in date order
+            related_composite = [context for context, _ in sorted(all_related_composite, key=lambda pair: pair[1], reverse=True)]
+            final_prompt, stats["context_report"] = self.generate_prompt(memories_final, related_composite, filtered_knowledge,
+                                                                         query=query)
+            # print("Final Prompt : ")
+            # print(final_prompt)
+
+        response, result, cost = await timer.run("answer", self.llm.query_memory, query, final_prompt, self.detect_faces,
+                                                 llm=llm, depends_on=("filtering",))
         if llm == 'openai':
             tokens = response.usage.total_tokens
             print("Total tokens: ", tokens)
         
-        self.cost += cost
-        time_cost = time.time() - start_time
-        print("Answer generation time cost: ", time_cost)
+        stats["cost"] += cost
 
-        time_cost_query = time.time() - start_time_query
-        print("Total time cost: ", time_cost_query)
+        stats["timings"] = timer.report("answer")
+        StageTimer.print_report(stats["timings"])
 
         print("API cost: ", cost)
 
@@ -240,133 +261,66 @@ class QueryHandler():
 
 
     def filter_date(self, start_date, end_date):
-        if start_date == '' or end_date == '':
-            return []
-        start_date_obj = datetime.strptime(start_date, "%Y-%m-%d")
-        end_date_obj = datetime.strptime(end_date, "%Y-%m-%d")
-        
-        # Filter the memories
-        filtered_memory = [
-            memory for memory in self.memory_to_query
-            if 'metadata' in memory and 'temporal_info' in memory['metadata']
-            and 'date_string' in memory['metadata']['temporal_info']
-            and start_date_obj <= datetime.strptime(memory['metadata']['temporal_info']['date_string'], "%Y:%m:%d %H:%M:%S") <= end_date_obj
-        ]
-
-        memory_ids = [memory['filename'] for memory in filtered_memory]
-        return memory_ids
+        return self.temporal_index.between(start_date, end_date)
         
-    def filter_composite_context(self, composite_context, query, composite_topk, llm='openai'):
-        if composite_context == "":
-            composite_context = query
-
-        # similarity search
-        emb = self.llm.calculate_embeddings(composite_context)
-        emb = np.array(emb).reshape(-1, 1)
-        similarities = np.matmul(self.composite_context_vector, emb).flatten()
-
-        top_k_context = np.argsort(similarities)[-composite_topk:][::-1]
-        retrieved_composite_context = [self.composite_context[i] for i in top_k_context]
-        # print(retrieved_composite_context)
-        # rerank only the related memory using LLM
-        # for conposite_context in retrieved_composite_context:
-        result, cost = self.llm.filter_related_composite_context(query, retrieved_composite_context, llm=llm)
-        self.cost += cost
-
-        all_related_context = []
-        for related_context in result['composite_context']:
-            name = related_context['event_name']
-            related = [context for context in retrieved_composite_context if context['event_name'] == name]
-
-            all_related_context = all_related_context + related
-
-        filtered_memory_list = []
-        for related_context in all_related_context:
-            memory_id = related_context['memory_ids']
-            filtered_memory_list = list(set(filtered_memory_list + memory_id))
-
-            # also add the time info
-            start_date = related_context.get('start_date', "")
-            end_date = related_context.get('end_date', "")
-
-            if start_date != "" and end_date != "":
-                filtered_memory_ids = self.filter_date(start_date, end_date)
-                filtered_memory_list = list(set(filtered_memory_list + filtered_memory_ids))
-
-        return filtered_memory_list, all_related_context
-
-    def filter_atomic_context(self, objects, people, activities, query, atomic_topk):
-        filtered_memory_list = []
-        # filter objects, people, and activities
-        if objects != "":
-            emb = self.llm.calculate_embeddings(objects)
-            emb = np.array(emb).reshape(-1, 1)
-            similarities = np.matmul(self.objects_vector, emb).flatten()
-
-            top_k_objects = np.argsort(similarities)[-atomic_topk:][::-1]
-            retrieved_objects = [self.objects[i] for i in top_k_objects]
-
-            for object in retrieved_objects:
-                memory_id = object['memory_ids']
-                filtered_memory_list = list(set(filtered_memory_list + memory_id))
-
-        if people != "":
-            emb = self.llm.calculate_embeddings(people)
-            emb = np.array(emb).reshape(-1, 1)
-            similarities = np.matmul(self.people_vector, emb).flatten()
+    def get_reranker(self, name=None):
+        name = name or COMPOSITE_RERANKER
+        with self.rerankers_lock:
+            if name not in self.rerankers:
+                self.rerankers[name] = create_reranker(name, self.llm, folder=self.memory.vector_db_folder)
+            return self.rerankers[name]
+
+    def rerank_composite_context(self, retrieved_composite_context, query, llm='openai', reranker=None):
+        """
+        Keep the retrieved (event, similarity) pairs the reranker judges related to the query.
+        Returns (related pairs, cost). Does not touch shared state so it can run in a thread.
+        """
+        if reranker is None:
+            reranker = self.get_reranker()
+        return reranker.rerank(query, retrieved_composite_context, llm=llm)
+
+    def filter_composite_context(self, all_related_context, candidates: CandidateSet):
+        for related_context, score in all_related_context:
+            candidates.add(related_context['memory_ids'], 'composite', score)
+
+        # also add the memories within the time span of any related event
+        date_ranges = [(related_context.get('start_date', ""), related_context.get('end_date', ""))
+                       for related_context, _ in all_related_context]
+        candidates.add(self.temporal_index.between_any(date_ranges), 'composite_date')
+
+    def filter_atomic_context(self, retrieved, candidates: CandidateSet):
+        # objects, people, and activities similar to the ones of the query
+        for category in ('objects', 'people', 'activities'):
+            candidates.add_retrieved(retrieved.get(category, []), category)
+
+    def filter_hybrid(self, query, retrieved, candidates: CandidateSet, topk, lexical_topk):
+        """
+        Fuse the caption and text similarity rankings with the BM25 keyword ranking by
+        reciprocal rank and keep the topk best memories: exact names and numbers missed
+        by the embeddings get in without widening the similarity searches. The kept
+        memories are added with their fused score, so keyword-only matches keep their rank.
+        """
+        lexical = [memory_id for memory_id, _ in self.lexical_index.search(query, lexical_topk)]
+        fused = reciprocal_rank_scores([ranked_memory_ids(retrieved['caption']),
+                                        ranked_memory_ids(retrieved['text']),
+                                        lexical])
+
+        for memory_id in sorted(fused, key=lambda memory_id: fused[memory_id], reverse=True)[:topk]:
+            candidates.add([memory_id], 'hybrid', fused[memory_id])
 
-            top_k_people = np.argsort(similarities)[-atomic_topk:][::-1]
-            retrieved_people = [self.people[i] for i in top_k_people]
-
-            for person in retrieved_people:
-                memory_id = person['memory_ids']
-                filtered_memory_list = list(set(filtered_memory_list + memory_id))
-
-        if activities != "":
-            emb = self.llm.calculate_embeddings(activities)
-            emb = np.array(emb).reshape(-1, 1)
-            similarities = np.matmul(self.activities_vector, emb).flatten()
-
-            top_k_activities = np.argsort(similarities)[-atomic_topk:][::-1]
-            retrieved_activities = [self.activities[i] for i in top_k_activities]
-
-            for activity in retrieved_activities:
-                memory_id = activity['memory_ids']
-                filtered_memory_list = list(set(filtered_memory_list + memory_id))
-
-        return filtered_memory_list
-    
-    def filter_knowledge(self, query, knowledge_topk):
-        # filter knowledge
-        emb = self.llm.calculate_embeddings(query)
-        emb = np.array(emb).reshape(-1, 1)
-        similarities = np.matmul(self.knowledge_vector, emb).flatten()
-
-        top_k_knowledge = np.argsort(similarities)[-knowledge_topk:][::-1]
-        retrieved_knowledge = [self.knowledge[i] for i in top_k_knowledge]
-
-        return retrieved_knowledge
-    
     def _search_memory_id(self, memory_id):
-        for memory in self.memory_to_query:
-            if memory['filename'] == memory_id:
-                return memory
+        return self.memory.find_memory(memory_id)
     
-    def generate_prompt(self, memory_list, composite_context, filtered_knowledge):
-        memory_prompt = ""
-        memory_prompt += "Memories:\n"
-        for memory in memory_list:
-            if self.detect_faces:
-                memory_prompt += parse_memory_to_string_update(memory)
-            else:
-                memory_prompt += parse_memory_to_string(memory)
-
-        memory_prompt += "Composite Context:\n"
-        for context in composite_context:
-            memory_prompt += parse_composite_context_to_string(context)
-
-        memory_prompt += "Knowledge:\n"
-        for knowledge in filtered_knowledge:
-            memory_prompt += parse_knowledge_to_string(knowledge)
-
-        return memory_prompt
\ No newline at end of file
+    def generate_prompt(self, memory_list, composite_context, filtered_knowledge, query=""):
+        """
+        Pack the memories, composite context and knowledge (each ordered best first)
+        into the answer prompt within CONTEXT_TOKEN_BUDGET, joining the cached memory
+        fragments. Long OCR text is trimmed to the lines matching the query. Returns (prompt, token report).
+        """
+        memory_format = "faces" if self.detect_faces else "full"
+        packer = ContextPacker(query, self.memory.prompt_fragments, memory_format,
+                               parse_composite_context_to_string, parse_knowledge_to_string)
+        memory_prompt = packer.pack(memory_list, composite_context, filtered_knowledge)
+
+        ContextPacker.print_report(packer.report)
+        return memory_prompt, packer.report
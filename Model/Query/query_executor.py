@@ -0,0 +1,67 @@
+import asyncio
+import time
+from contextlib import contextmanager
+
+
+class StageTimer():
+    """
+    Runs the stages of one query and records when each started and ended.
+
+    Blocking stages run in threads so independent ones overlap. Each stage
+    names the stages it waited for, which gives the critical path: the chain
+    of stages that determined the total latency.
+    """
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def _record(self, name, started, depends_on):
+        now = time.perf_counter()
+        self.stages[name] = {
+            "start": started - self.started,
+            "end": now - self.started,
+            "duration": now - started,
+            "depends_on": list(depends_on),
+        }
+
+    async def run(self, name, fn, *args, depends_on=(), **kwargs):
+        """Run a blocking fn in a thread as stage name."""
+        started = time.perf_counter()
+        result = await asyncio.to_thread(fn, *args, **kwargs)
+        self._record(name, started, depends_on)
+        return result
+
+    @contextmanager
+    def measure(self, name, depends_on=()):
+        """Time a block that runs on the event loop."""
+        started = time.perf_counter()
+        yield
+        self._record(name, started, depends_on)
+
+    def critical_path(self, last_stage):
+        """Walk back from last_stage through the dependency that finished last."""
+        path = [last_stage]
+        while True:
+            depends_on = [stage for stage in self.stages[path[-1]]["depends_on"] if stage in self.stages]
+            if not depends_on:
+                break
+            path.append(max(depends_on, key=lambda stage: self.stages[stage]["end"]))
+        return path[::-1]
+
+    def report(self, last_stage):
+        path = self.critical_path(last_stage)
+        return {
+            "stages": {name: {key: stage[key] for key in ("start", "end", "duration")}
+                       for name, stage in self.stages.items()},
+            "critical_path": path,
+            "critical_path_latency": self.stages[last_stage]["end"],
+        }
+
+    @staticmethod
+    def print_report(report):
+        print("Query stages (start / duration in seconds):")
+        for name, stage in sorted(report["stages"].items(), key=lambda item: item[1]["start"]):
+            marker = "*" if name in report["critical_path"] else " "
+            print(f" {marker} {name:<24} {stage['start']:7.3f} / {stage['duration']:7.3f}")
+        print("Critical path: ", " -> ".join(report["critical_path"]))
+        print("Total time cost: ", report["critical_path_latency"])
@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+
+import numpy as np
+
+from VectorDB.folder_lock import folder_lock
+
+
+# reranker used when a query does not choose one: llm, cross_encoder or threshold
+COMPOSITE_RERANKER = os.getenv("COMPOSITE_RERANKER", "llm")
+CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+CROSS_ENCODER_THRESHOLD = float(os.getenv("CROSS_ENCODER_THRESHOLD", "0.5"))
+CROSS_ENCODER_BATCH_SIZE = int(os.getenv("CROSS_ENCODER_BATCH_SIZE", "32"))
+# auto: apply a sigmoid when the model's configured activation leaves logits; sigmoid / none force it
+CROSS_ENCODER_ACTIVATION = os.getenv("CROSS_ENCODER_ACTIVATION", "auto")
+# minimum query / event embedding similarity kept by the threshold reranker
+RERANK_SIMILARITY_THRESHOLD = float(os.getenv("RERANK_SIMILARITY_THRESHOLD", "0.4"))
+# threshold fitted on the LLM reranker's decisions for a user, saved in the user's vector_db folder
+RERANK_THRESHOLD_FILE = "rerank_threshold.json"
+
+
+class LLMReranker():
+    """Asks the LLM which retrieved events are related to the query (one request per query)."""
+    # every call is a billed remote request
+    local = False
+
+    def __init__(self, llm) -> None:
+        self.llm = llm
+
+    def rerank(self, query, retrieved, llm='openai'):
+        result, cost = self.llm.filter_related_composite_context(
+            query, [context for context, _ in retrieved], llm=llm)
+
+        related = []
+        for related_context in result['composite_context']:
+            name = related_context['event_name']
+            related += [(context, score) for context, score in retrieved if context['event_name'] == name]
+        return related, cost
+
+
+class ThresholdReranker():
+    """
+    Keeps the events whose retrieval similarity reaches a threshold, no model involved.
+    The threshold of a user is fitted on the LLM reranker's keep / drop decisions
+    (see tester.py) and saved next to their vector indexes.
+    """
+    local = True
+
+    def __init__(self, threshold: float = RERANK_SIMILARITY_THRESHOLD) -> None:
+        self.threshold = threshold
+
+    @classmethod
+    def from_folder(cls, folder):
+        """Reranker with the threshold saved in a vector_db folder, RERANK_SIMILARITY_THRESHOLD if none was fitted."""
+        path = os.path.join(folder, RERANK_THRESHOLD_FILE)
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return cls(float(json.load(f)["threshold"]))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Warning: could not read {path} ({e}), using RERANK_SIMILARITY_THRESHOLD")
+            return cls()
+
+    def rerank(self, query, retrieved, llm=None):
+        return [(context, score) for context, score in retrieved if score >= self.threshold], 0
+
+    @staticmethod
+    def fit(scores, labels):
+        """
+        Threshold with the best F1 on (similarity, related) examples, e.g. the
+        decisions of the LLM reranker collected over a benchmark run.
+        """
+        scores = np.asarray(scores, dtype=np.float64)
+        labels = np.asarray(labels, dtype=bool)
+        if not labels.any():
+            return float(scores.max()) + 1e-6 if len(scores) else RERANK_SIMILARITY_THRESHOLD
+
+        order = np.argsort(-scores, kind="stable")
+        scores, labels = scores[order], labels[order]
+        # keeping the first i + 1 examples
+        true_positives = np.cumsum(labels)
+        precision = true_positives / np.arange(1, len(scores) + 1)
+        recall = true_positives / labels.sum()
+        f1 = 2 * precision * recall / np.maximum(precision + recall, 1e-12)
+        # only cut between different scores
+        valid = np.append(scores[1:] < scores[:-1], True)
+        best = np.flatnonzero(valid)[np.argmax(f1[valid])]
+        return float(scores[best])
+
+    @staticmethod
+    def save(folder, threshold, examples):
+        """Save a fitted threshold and the number of examples it was fitted on in a vector_db folder."""
+        path = os.path.join(folder, RERANK_THRESHOLD_FILE)
+        with folder_lock(folder):
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"threshold": threshold, "examples": examples}, f)
+            os.replace(tmp_path, path)
+
+
+_cross_encoders = {}
+_cross_encoders_lock = threading.Lock()
+
+def load_cross_encoder(model_name):
+    """Cross-encoder models are loaded once per process and shared by every query."""
+    with _cross_encoders_lock:
+        if model_name not in _cross_encoders:
+            from sentence_transformers import CrossEncoder
+            print(f"Loading cross-encoder {model_name}")
+            _cross_encoders[model_name] = CrossEncoder(model_name, device="cpu")
+        return _cross_encoders[model_name]
+
+
+def outputs_logits(model):
+    """True when the configured activation of a CrossEncoder is the identity, so predict() returns logits."""
+    activation = getattr(model, "activation_fn", None) or getattr(model, "default_activation_function", None)
+    return activation is None or type(activation).__name__ == "Identity"
+
+
+class CrossEncoderReranker():
+    """
+    Scores every (query, event name) pair with a small local cross-encoder in
+    batches and keeps the events scoring at least threshold. Whether scores go
+    through a sigmoid is decided once per model (activation), so a pair always
+    gets the same score whatever the other candidates are.
+    """
+    local = True
+
+    def __init__(self, model_name: str = CROSS_ENCODER_MODEL, threshold: float = CROSS_ENCODER_THRESHOLD,
+                 batch_size: int = CROSS_ENCODER_BATCH_SIZE, activation: str = CROSS_ENCODER_ACTIVATION) -> None:
+        self.model_name = model_name
+        self.threshold = threshold
+        self.batch_size = batch_size
+        self.activation = activation
+        self.apply_sigmoid = {"sigmoid": True, "none": False}.get(activation)
+
+    def scores(self, query, retrieved):
+        model = load_cross_encoder(self.model_name)
+        scores = model.predict([(query, context['event_name']) for context, _ in retrieved],
+                               batch_size=self.batch_size, show_progress_bar=False)
+        scores = np.asarray(scores, dtype=np.float64).reshape(len(retrieved))
+        if self.apply_sigmoid is None:
+            self.apply_sigmoid = outputs_logits(model)
+        if self.apply_sigmoid:
+            scores = 1 / (1 + np.exp(-scores))
+        return scores
+
+    def rerank(self, query, retrieved, llm=None):
+        if not retrieved:
+            return [], 0
+        scores = self.scores(query, retrieved)
+        return [pair for pair, score in zip(retrieved, scores) if score >= self.threshold], 0
+
+
+RERANKERS = {
+    "llm": LLMReranker,
+    "cross_encoder": CrossEncoderReranker,
+    "threshold": ThresholdReranker,
+}
+
+def create_reranker(name, llm, folder=None):
+    """folder is the user's vector_db folder, where the threshold reranker finds its fitted threshold."""
+    if name not in RERANKERS:
+        raise ValueError(f"Unknown reranker '{name}', use one of {', '.join(RERANKERS)}")
+    if name == "llm":
+        return LLMReranker(llm)
+    if name == "threshold" and folder is not None:
+        return ThresholdReranker.from_folder(folder)
+    return RERANKERS[name]()
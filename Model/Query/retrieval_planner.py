@@ -0,0 +1,57 @@
+import numpy as np
+
+from VectorDB.vector_index import normalize_rows
+
+
+class RetrievalPlanner():
+    """
+    Collects the similarity searches of one query before running any of them.
+
+    Every distinct probe string is embedded in a single batched request (the
+    query itself is usually the probe of several namespaces), the embeddings are
+    stacked into one query matrix and each namespace is searched with its rows.
+    """
+    def __init__(self, llm, indexes: dict, min_score: float = None) -> None:
+        self.llm = llm
+        self.indexes = indexes
+        self.min_score = min_score
+        self.searches = {}
+        self.embeddings = {}
+
+    def add(self, namespace, probe, topk):
+        """Plan a search of namespace for probe. Empty probes are skipped."""
+        if probe is None or probe == "":
+            return
+        self.searches[namespace] = (probe, topk)
+
+    def embed(self):
+        """
+        Embed every distinct probe that has no embedding yet with one request. Returns {probe: embedding}.
+        self.embeddings can be seeded with embeddings computed earlier.
+        """
+        probes = [probe for probe in dict.fromkeys(probe for probe, _ in self.searches.values())
+                  if probe not in self.embeddings]
+        if probes:
+            embeddings = self.llm.calculate_embeddings_batch(probes)
+            self.embeddings.update({probe: emb for probe, emb in zip(probes, embeddings) if emb is not None})
+        return self.embeddings
+
+    def run(self):
+        """Embed the probes and run every planned search. Returns {namespace: [(item, similarity), ...]}."""
+        self.embed()
+
+        probes = list(self.embeddings)
+        retrieved = {namespace: [] for namespace in self.searches}
+        if not probes:
+            return retrieved
+
+        query_matrix = normalize_rows(np.stack([np.asarray(self.embeddings[probe], dtype=np.float32) for probe in probes]))
+        probe_rows = {probe: row for row, probe in enumerate(probes)}
+
+        for namespace, (probe, topk) in self.searches.items():
+            index = self.indexes.get(namespace)
+            if index is None or probe not in probe_rows:
+                continue
+            indices, scores = index.search(query_matrix[probe_rows[probe]], topk, min_score=self.min_score)
+            retrieved[namespace] = [(index.items[i], float(score)) for i, score in zip(indices, scores)]
+        return retrieved
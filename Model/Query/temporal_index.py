@@ -0,0 +1,71 @@
+from datetime import datetime
+
+import numpy as np
+
+
+EPOCH = datetime(1970, 1, 1)
+MEMORY_DATE_FORMAT = "%Y:%m:%d %H:%M:%S"
+QUERY_DATE_FORMAT = "%Y-%m-%d"
+
+
+def to_seconds(date):
+    """Seconds since 1970-01-01 of a naive datetime, without any timezone conversion."""
+    return (date - EPOCH).total_seconds()
+
+
+class TemporalIndex():
+    """
+    Capture times of every memory, parsed once and sorted, so date ranges are
+    answered with binary search instead of parsing every date per query.
+
+    A range covers start_date 00:00:00 to end_date 00:00:00, both included,
+    like the original filter.
+    """
+    def __init__(self, memories: list) -> None:
+        timestamps = []
+        memory_ids = []
+        for memory in memories:
+            date_string = memory.get('metadata', {}).get('temporal_info', {}).get('date_string')
+            if date_string is None:
+                continue
+            timestamps.append(to_seconds(datetime.strptime(date_string, MEMORY_DATE_FORMAT)))
+            memory_ids.append(memory['filename'])
+
+        order = np.argsort(timestamps, kind="stable")
+        self.timestamps = np.asarray(timestamps, dtype=np.float64)[order]
+        self.memory_ids = [memory_ids[i] for i in order]
+
+    def __len__(self):
+        return len(self.memory_ids)
+
+    @staticmethod
+    def parse_range(start_date, end_date):
+        return (to_seconds(datetime.strptime(start_date, QUERY_DATE_FORMAT)),
+                to_seconds(datetime.strptime(end_date, QUERY_DATE_FORMAT)))
+
+    def between(self, start_date, end_date):
+        """Memory ids captured from start_date to end_date ('%Y-%m-%d'), in time order."""
+        if start_date == '' or end_date == '':
+            return []
+        start, end = self.parse_range(start_date, end_date)
+        lo = np.searchsorted(self.timestamps, start, side="left")
+        hi = np.searchsorted(self.timestamps, end, side="right")
+        return self.memory_ids[lo:hi]
+
+    def between_any(self, date_ranges):
+        """Memory ids captured within any of the (start_date, end_date) ranges, in time order."""
+        ranges = [self.parse_range(start, end) for start, end in date_ranges if start != '' and end != '']
+        if not ranges or len(self) == 0:
+            return []
+        starts, ends = np.asarray(ranges, dtype=np.float64).T
+        lo = np.searchsorted(self.timestamps, starts, side="left")
+        hi = np.searchsorted(self.timestamps, ends, side="right")
+        valid = hi > lo
+        lo, hi = lo[valid], hi[valid]
+
+        # +1 where a range opens, -1 where it closes: positions with a positive running sum are covered
+        coverage = np.zeros(len(self) + 1, dtype=np.int64)
+        np.add.at(coverage, lo, 1)
+        np.add.at(coverage, hi, -1)
+        covered = np.flatnonzero(np.cumsum(coverage[:-1]) > 0)
+        return [self.memory_ids[i] for i in covered]
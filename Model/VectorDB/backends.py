@@ -0,0 +1,168 @@
+"""
+Search backends used by VectorIndex.
+
+A backend is built from the normalized float32 rows of one index and answers
+search(query, k) -> (indices, scores). Approximate backends can save what they
+built next to the vector store so it is not rebuilt on every load.
+"""
+import numpy as np
+
+from VectorDB.top_k import top_k
+
+
+class ExactBackend():
+    """Brute force search: one matrix-vector product over every row."""
+    name = "exact"
+    BUILD_PARAMS = ()
+
+    def __init__(self, **params) -> None:
+        self.params = params
+        self.vectors = None
+
+    def build(self, vectors):
+        self.vectors = vectors
+
+    def search(self, query, k):
+        return top_k(self.vectors @ query, k)
+
+    def save(self, path):
+        return False
+
+    def load(self, path, vectors):
+        return False
+
+
+class IVFBackend():
+    """
+    Inverted file index built with spherical k-means, pure numpy.
+
+    Rows are grouped under their nearest of nlist centroids; a search scores the
+    centroids first and then only the rows of the nprobe closest lists.
+    nprobe is the recall / latency knob: higher probes more lists.
+    Rows are kept uncompressed since they are already memory-mapped.
+    """
+    name = "ivf"
+    BUILD_PARAMS = ("nlist", "iterations", "seed")
+
+    def __init__(self, nlist: int = None, nprobe: int = 8, iterations: int = 20,
+                 sample_size: int = 100000, seed: int = 0) -> None:
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.sample_size = sample_size
+        self.seed = seed
+
+        self.vectors = None
+        self.centroids = None
+        self.order = None
+        self.offsets = None
+
+    def _assign(self, vectors, chunk_size=65536):
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), chunk_size):
+            scores = vectors[start:start + chunk_size] @ self.centroids.T
+            assignments[start:start + chunk_size] = np.argmax(scores, axis=1)
+        return assignments
+
+    def build(self, vectors):
+        self.vectors = vectors
+        n = len(vectors)
+        nlist = self.nlist or max(1, int(4 * np.sqrt(n)))
+        nlist = min(nlist, n)
+
+        rng = np.random.default_rng(self.seed)
+        sample = vectors
+        if n > self.sample_size:
+            sample = vectors[np.sort(rng.choice(n, self.sample_size, replace=False))]
+        sample = np.asarray(sample, dtype=np.float32)
+
+        self.centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(self.iterations):
+            assignments = self._assign(sample)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignments, sample)
+            counts = np.bincount(assignments, minlength=nlist)
+            # an empty list keeps its old centroid
+            filled = counts > 0
+            norms = np.linalg.norm(sums[filled], axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            self.centroids[filled] = sums[filled] / norms
+
+        assignments = self._assign(vectors)
+        self.order = np.argsort(assignments, kind="stable").astype(np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=nlist))]).astype(np.int64)
+
+    def search(self, query, k):
+        centroid_scores = self.centroids @ query
+        list_order, _ = top_k(centroid_scores, self.nprobe)
+        if self.offsets[list_order + 1].sum() - self.offsets[list_order].sum() < k:
+            list_order, _ = top_k(centroid_scores, len(centroid_scores))
+
+        candidates = []
+        found = 0
+        for probed, list_id in enumerate(list_order):
+            # keep probing past nprobe until there are at least k candidates
+            if probed >= self.nprobe and found >= k:
+                break
+            rows = self.order[self.offsets[list_id]:self.offsets[list_id + 1]]
+            candidates.append(rows)
+            found += len(rows)
+
+        candidates = np.sort(np.concatenate(candidates))
+        order, scores = top_k(self.vectors[candidates] @ query, k)
+        return candidates[order], scores
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            np.savez(f, centroids=self.centroids, order=self.order, offsets=self.offsets)
+        return True
+
+    def load(self, path, vectors):
+        state = np.load(path)
+        self.vectors = vectors
+        self.centroids = state["centroids"]
+        self.order = state["order"]
+        self.offsets = state["offsets"]
+        return True
+
+
+class HNSWBackend():
+    """
+    Hierarchical navigable small world graph from the optional hnswlib package.
+
+    M and ef_construction set graph quality at build time, ef_search is the
+    recall / latency knob at query time.
+    """
+    name = "hnsw"
+    BUILD_PARAMS = ("M", "ef_construction", "seed")
+
+    def __init__(self, M: int = 16, ef_construction: int = 200, ef_search: int = 64, seed: int = 0) -> None:
+        import hnswlib
+
+        self.hnswlib = hnswlib
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.seed = seed
+        self.graph = None
+
+    def build(self, vectors):
+        self.graph = self.hnswlib.Index(space="ip", dim=vectors.shape[1])
+        self.graph.init_index(max_elements=len(vectors), ef_construction=self.ef_construction,
+                              M=self.M, random_seed=self.seed)
+        self.graph.add_items(np.asarray(vectors, dtype=np.float32), np.arange(len(vectors)))
+
+    def search(self, query, k):
+        self.graph.set_ef(max(self.ef_search, k))
+        labels, distances = self.graph.knn_query(query.reshape(1, -1), k=k)
+        # the "ip" space returns 1 - dot product
+        return labels[0].astype(np.int64), 1 - distances[0]
+
+    def save(self, path):
+        self.graph.save_index(path)
+        return True
+
+    def load(self, path, vectors):
+        self.graph = self.hnswlib.Index(space="ip", dim=vectors.shape[1])
+        self.graph.load_index(path, max_elements=len(vectors))
+        return True
@@ -0,0 +1,137 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+
+BM25_FILE = "bm25.json"
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "did", "do", "does", "for", "from", "had", "has",
+    "have", "how", "i", "in", "is", "it", "its", "me", "my", "of", "on", "or", "that", "the", "this",
+    "to", "was", "we", "were", "what", "when", "where", "which", "who", "why", "with", "you", "your",
+}
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    """Lowercased word tokens without stopwords. Numbers are kept, so receipt and phone numbers match."""
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def text_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class BM25Index():
+    """
+    Okapi BM25 inverted index over one document per memory id.
+
+    Documents can be added, replaced and removed one at a time, so the index
+    is updated incrementally when memories change instead of being rebuilt.
+    Each document keeps the hash of its text to tell whether it changed.
+    """
+    def __init__(self, k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        # doc id -> {"hash", "length", "terms": {term: frequency}}
+        self.documents = {}
+        # term -> {doc id: frequency}
+        self.postings = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.documents)
+
+    def __contains__(self, doc_id):
+        return doc_id in self.documents
+
+    def add(self, doc_id, text):
+        """Index text as doc_id, replacing its previous text. Returns False if the text did not change."""
+        digest = text_hash(text)
+        document = self.documents.get(doc_id)
+        if document is not None:
+            if document["hash"] == digest:
+                return False
+            self.remove(doc_id)
+
+        terms = Counter(tokenize(text))
+        length = sum(terms.values())
+        self.documents[doc_id] = {"hash": digest, "length": length, "terms": dict(terms)}
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = frequency
+        self.total_length += length
+        return True
+
+    def remove(self, doc_id):
+        document = self.documents.pop(doc_id, None)
+        if document is None:
+            return False
+        for term in document["terms"]:
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(doc_id, None)
+            if not postings:
+                del self.postings[term]
+        self.total_length -= document["length"]
+        return True
+
+    def search(self, query, k):
+        """Return up to k (doc id, score) pairs by decreasing BM25 score, documents sharing no term are skipped."""
+        if not self.documents or k <= 0:
+            return []
+        n = len(self.documents)
+        average_length = self.total_length / n if self.total_length else 1
+
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings.items():
+                length_norm = self.k1 * (1 - self.b + self.b * self.documents[doc_id]["length"] / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + length_norm)
+
+        # ties keep insertion order
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:k]
+
+    def to_dict(self):
+        return {
+            "k1": self.k1,
+            "b": self.b,
+            "documents": self.documents,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        index = cls(k1=data.get("k1", 1.5), b=data.get("b", 0.75))
+        index.documents = data.get("documents", {})
+        for doc_id, document in index.documents.items():
+            for term, frequency in document["terms"].items():
+                index.postings.setdefault(term, {})[doc_id] = frequency
+            index.total_length += document["length"]
+        return index
+
+    def save(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, BM25_FILE)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, folder):
+        """The saved index of folder, None if there is none."""
+        path = os.path.join(folder, BM25_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
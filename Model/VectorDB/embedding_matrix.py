@@ -0,0 +1,81 @@
+import numpy as np
+
+from VectorDB.top_k import top_k
+
+
+class EmbeddingMatrix():
+    """
+    Growable embedding matrix (float32 unless dtype says otherwise) with a
+    paired metadata list.
+
+    Rows live in one contiguous buffer whose capacity doubles when full, so
+    appending n rows costs O(n) amortized instead of the O(n^2) of np.vstack.
+    """
+    def __init__(self, dim: int = None, capacity: int = 16, dtype=np.float32) -> None:
+        self.dim = dim
+        self.capacity = capacity
+        self.dtype = dtype
+        self.size = 0
+        self.items = []
+        self._data = None if dim is None else np.empty((capacity, dim), dtype=dtype)
+
+    @classmethod
+    def from_array(cls, matrix, items, dtype=np.float32):
+        """Wrap an existing (n, dim) matrix and its n items."""
+        matrix = np.asarray(matrix, dtype=dtype)
+        store = cls(dim=matrix.shape[1], capacity=max(len(matrix), 1), dtype=dtype)
+        store._data[:len(matrix)] = matrix
+        store.size = len(matrix)
+        store.items = list(items)
+        return store
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def matrix(self):
+        """View of the filled rows, shape (len(self), dim)."""
+        if self._data is None:
+            return np.empty((0, 0), dtype=self.dtype)
+        return self._data[:self.size]
+
+    def _grow(self):
+        new_data = np.empty((self.capacity * 2, self.dim), dtype=self.dtype)
+        new_data[:self.size] = self._data[:self.size]
+        self._data = new_data
+        self.capacity *= 2
+
+    def append(self, embedding, item):
+        """Add one row and its item. Returns the row index."""
+        embedding = np.asarray(embedding, dtype=self.dtype).reshape(-1)
+        if self._data is None:
+            self.dim = embedding.shape[0]
+            self._data = np.empty((self.capacity, self.dim), dtype=self.dtype)
+        if self.size == self.capacity:
+            self._grow()
+
+        self._data[self.size] = embedding
+        self.items.append(item)
+        self.size += 1
+        return self.size - 1
+
+    def similarities(self, embedding):
+        """Dot product of every row with embedding (cosine similarity for normalized embeddings)."""
+        if self.size == 0:
+            return np.empty(0, dtype=np.float32)
+        return self.matrix @ np.asarray(embedding, dtype=np.float32).reshape(-1)
+
+    def best_match(self, embedding):
+        """Return (index, similarity) of the most similar row, (None, None) when empty."""
+        indices, scores = top_k(self.similarities(embedding), 1)
+        if len(indices) == 0:
+            return None, None
+        return int(indices[0]), float(scores[0])
+
+    def shrink_to_fit(self):
+        """Release the unused capacity once building is done."""
+        if self._data is not None and self.capacity > self.size:
+            self._data = self._data[:self.size].copy()
+            self.capacity = max(self.size, 1)
+            if self.size == 0:
+                self._data = np.empty((1, self.dim), dtype=self.dtype)
@@ -0,0 +1,37 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: writers are only serialized within the process
+    fcntl = None
+
+
+LOCK_FILE = ".write.lock"
+
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+@contextmanager
+def folder_lock(folder):
+    """
+    Held by everything that writes files of a user's vector_db folder, so two
+    writers never interleave their files or delete each other's. Serializes
+    threads of this process and, where fcntl exists, other processes too.
+    """
+    key = os.path.abspath(folder)
+    with _locks_lock:
+        lock = _locks.setdefault(key, threading.Lock())
+    with lock:
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, LOCK_FILE), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
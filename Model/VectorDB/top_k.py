@@ -0,0 +1,33 @@
+import numpy as np
+
+
+def top_k(scores, k, min_score=None):
+    """
+    Return (indices, scores) of the k highest scores, best first.
+
+    argpartition selects the k best in O(n), only those k are sorted. The sort
+    is stable, so equal scores keep their row order. Scores below min_score
+    are dropped, so fewer than k results may come back.
+    """
+    scores = np.asarray(scores).reshape(-1)
+    n = len(scores)
+    k = min(k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=scores.dtype)
+
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        # argpartition breaks ties at the k-th score arbitrarily, keep the lowest row ids like a full sort would
+        kth = scores[candidates].min()
+        above = np.flatnonzero(scores > kth)
+        tied = np.flatnonzero(scores == kth)[:k - len(above)]
+        candidates = np.concatenate([above, tied])
+    else:
+        candidates = np.arange(n)
+
+    order = candidates[np.argsort(-scores[candidates], kind="stable")]
+    selected = scores[order]
+    if min_score is not None:
+        keep = selected >= min_score
+        order, selected = order[keep], selected[keep]
+    return order.astype(np.int64), selected
@@ -0,0 +1,383 @@
+import json
+import os
+import uuid
+
+import numpy as np
+
+from VectorDB.backends import ExactBackend, HNSWBackend, IVFBackend
+from VectorDB.embedding_matrix import EmbeddingMatrix
+from VectorDB.folder_lock import folder_lock
+
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+
+# indexes with fewer rows always use exact search, whatever backend is configured
+EXACT_SEARCH_THRESHOLD = int(os.getenv("VECTOR_INDEX_EXACT_THRESHOLD", "5000"))
+
+# namespace -> (vector file, list file) written by older versions, one pair per namespace
+LEGACY_FILES = {
+    "caption": ("caption_vector_db.npy", "caption_list.json"),
+    "text": ("text_vector_db.npy", "text_list.json"),
+    "objects": ("objects_vector_db.npy", "objects_list.json"),
+    "people": ("people_vector_db.npy", "people_list.json"),
+    "activities": ("activities_vector_db.npy", "activities_list.json"),
+    "location": ("location_vector_db.npy", "location_list.json"),
+    "composite": ("composite_vector_db.npy", "composite_list.json"),
+    "knowledge": ("knowledge_vector_db.npy", "knowledge_list.json"),
+    "rag": ("vector_db_rag.npy", "vector_db_list.json"),
+}
+
+
+def normalize_rows(vectors):
+    """Return float32 rows scaled to unit length, so a dot product is the cosine similarity."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+BACKENDS = {
+    "exact": ExactBackend,
+    "ivf": IVFBackend,
+    "hnsw": HNSWBackend,
+}
+
+
+def register_backend(name, backend_class):
+    """Make a backend selectable by name. See VectorDB/backends.py for the interface."""
+    BACKENDS[name] = backend_class
+
+
+def _parse_pairs(pairs_string):
+    """Parse 'key=value,key=value' into a dict, numbers are converted."""
+    pairs = {}
+    for part in pairs_string.split(","):
+        if "=" not in part:
+            continue
+        key, value = part.split("=", 1)
+        value = value.strip()
+        try:
+            value = int(value)
+        except ValueError:
+            try:
+                value = float(value)
+            except ValueError:
+                pass
+        pairs[key.strip()] = value
+    return pairs
+
+
+def backend_config(namespace):
+    """
+    Backend name and params for a namespace, from the environment:
+
+    VECTOR_INDEX_BACKENDS="default=exact,rag=hnsw,caption=ivf"
+    VECTOR_INDEX_PARAMS="ivf.nprobe=16,hnsw.ef_search=128,rag.ef_search=256"
+
+    Params are scoped by backend name or by namespace; namespace scoped ones win.
+    """
+    backends = _parse_pairs(os.getenv("VECTOR_INDEX_BACKENDS", ""))
+    backend = backends.get(namespace, backends.get("default", "exact"))
+
+    params = {}
+    scoped = _parse_pairs(os.getenv("VECTOR_INDEX_PARAMS", ""))
+    for scope in (backend, namespace):
+        for key, value in scoped.items():
+            if key.startswith(f"{scope}."):
+                params[key[len(scope) + 1:]] = value
+    return backend, params
+
+
+class VectorIndex():
+    """
+    Normalized float32 vectors with one metadata item per row.
+
+    Search is delegated to a backend that is built lazily on the first search
+    and rebuilt after add(). Indexes smaller than EXACT_SEARCH_THRESHOLD always
+    search exactly. Vectors may be a read-only view of a memory-mapped
+    VectorStore file; they are copied into memory only when rows are added.
+    """
+    def __init__(self, vectors=None, items=None, backend: str = "exact", backend_params: dict = None) -> None:
+        if vectors is None or len(vectors) == 0:
+            self.vectors = np.empty((0, 0), dtype=np.float32)
+        else:
+            self.vectors = normalize_rows(vectors)
+        self.items = list(items) if items is not None else []
+        if len(self.items) != len(self.vectors):
+            raise ValueError(f"VectorIndex got {len(self.vectors)} vectors but {len(self.items)} items.")
+
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown vector index backend: {backend}")
+        self.backend_name = backend
+        self.backend_params = backend_params or {}
+        self._backend = None
+        self._backend_file = None
+        self._matrix = None
+
+    @classmethod
+    def from_normalized(cls, vectors, items, backend="exact", backend_params=None):
+        """Wrap rows that are already normalized (e.g. a memory map) without copying them."""
+        index = cls(items=None, backend=backend, backend_params=backend_params)
+        if len(vectors):
+            index.vectors = vectors
+        index.items = list(items)
+        return index
+
+    def __len__(self):
+        return len(self.items)
+
+    def configure(self, backend, backend_params=None):
+        """Switch backend, the next search builds it."""
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown vector index backend: {backend}")
+        backend_params = backend_params or {}
+        if backend != self.backend_name or backend_params != self.backend_params:
+            self.backend_name = backend
+            self.backend_params = backend_params
+            self._backend = None
+            self._backend_file = None
+
+    @property
+    def effective_backend(self):
+        """The backend used for searching, exact for small indexes."""
+        if len(self) < EXACT_SEARCH_THRESHOLD:
+            return "exact"
+        return self.backend_name
+
+    def build_signature(self):
+        """What a saved backend state depends on: backend name, build params and row count."""
+        backend_class = BACKENDS[self.effective_backend]
+        params = {key: self.backend_params[key] for key in backend_class.BUILD_PARAMS if key in self.backend_params}
+        return {"backend": self.effective_backend, "params": params, "rows": len(self)}
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1] if len(self.vectors) else 0
+
+    def add(self, embeddings, items):
+        """Append rows and their items."""
+        if self._matrix is None:
+            if len(self.vectors):
+                self._matrix = EmbeddingMatrix.from_array(self.vectors, self.items)
+            else:
+                self._matrix = EmbeddingMatrix()
+            self.items = self._matrix.items
+
+        for embedding, item in zip(normalize_rows(embeddings), items):
+            self._matrix.append(embedding, item)
+        self.vectors = self._matrix.matrix
+        self._backend = None
+        self._backend_file = None
+
+    def _get_backend(self):
+        if self._backend is not None:
+            return self._backend
+
+        name = self.effective_backend
+        params = self.backend_params if name == self.backend_name else {}
+        try:
+            backend = BACKENDS[name](**params)
+        except ImportError as e:
+            print(f"Vector index backend '{name}' is not available ({e}), using exact search")
+            backend = ExactBackend()
+
+        if not (self._backend_file and os.path.exists(self._backend_file)
+                and backend.load(self._backend_file, self.vectors)):
+            backend.build(self.vectors)
+        self._backend = backend
+        return backend
+
+    def save_backend(self, path):
+        """Build the backend now and save its state to path. Returns False if there is nothing to save."""
+        backend = self._get_backend()
+        if isinstance(backend, ExactBackend):
+            return False
+        return backend.save(path)
+
+    def search(self, query, k, min_score=None):
+        """Return (indices, scores) of the k rows most similar to query, best first, none below min_score."""
+        if len(self) == 0 or k <= 0 or query is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = normalize_rows(query)[0]
+        indices, scores = self._get_backend().search(query, min(k, len(self)))
+        indices, scores = np.asarray(indices, dtype=np.int64), np.asarray(scores, dtype=np.float32)
+        if min_score is not None:
+            keep = scores >= min_score
+            indices, scores = indices[keep], scores[keep]
+        return indices, scores
+
+    def search_items(self, query, k, min_score=None):
+        """Return the items of the k rows most similar to query, best first."""
+        indices, _ = self.search(query, k, min_score=min_score)
+        return [self.items[i] for i in indices]
+
+
+class VectorStore():
+    """
+    Every namespace of one user in two files: a float32 matrix file that is
+    memory-mapped on load, and manifest.json with the row offset, shape,
+    backend and items of each namespace.
+
+    save() writes a new matrix file under a fresh name and then replaces the
+    manifest, so a reader never sees a manifest pointing at a partial file.
+    Approximate backends are built here, offline, and their state is saved
+    next to the matrix file so loading does not rebuild them. The backend of
+    each namespace comes from backend_config() when the store is loaded.
+    Folders written by older versions (one .npy + .json pair per namespace)
+    are read in memory on load (migrated is then True) and only written in
+    the new format by save(), which ingestion calls; loading never writes.
+    save() holds the folder lock, so concurrent writers cannot delete each
+    other's files.
+    """
+    def __init__(self, folder: str) -> None:
+        self.folder = folder
+        self.indexes = {}
+        self.vectors_file = None
+        self.migrated = False
+        self.load()
+
+    def __contains__(self, name):
+        return name in self.indexes
+
+    def get(self, name):
+        return self.indexes.get(name)
+
+    def put(self, name, index: VectorIndex):
+        index.configure(*backend_config(name))
+        self.indexes[name] = index
+
+    def names(self):
+        return list(self.indexes)
+
+    def _manifest_path(self):
+        return os.path.join(self.folder, MANIFEST_FILE)
+
+    def load(self):
+        self.indexes = {}
+        self.migrated = False
+        manifest_path = self._manifest_path()
+        if not os.path.exists(manifest_path):
+            self.migrated = self.migrate_legacy()
+            return
+
+        # a writer may replace the manifest and delete its matrix file between the two reads
+        for attempt in range(3):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            self.vectors_file = manifest["vectors_file"]
+            data = np.empty(0, dtype=np.float32)
+            if manifest["total_floats"] == 0:
+                break
+            try:
+                data = np.memmap(os.path.join(self.folder, self.vectors_file), dtype=np.float32,
+                                 mode="r", shape=(manifest["total_floats"],))
+                break
+            except FileNotFoundError:
+                if attempt == 2:
+                    raise
+
+        for name, entry in manifest["namespaces"].items():
+            rows, dim, offset = entry["rows"], entry["dim"], entry["offset"]
+            vectors = data[offset:offset + rows * dim].reshape(rows, dim)
+            backend, backend_params = backend_config(name)
+            index = VectorIndex.from_normalized(vectors, entry["items"], backend=backend, backend_params=backend_params)
+
+            # reuse the saved backend only if it was built the way it is configured now
+            state = entry.get("backend_state")
+            if state and state["signature"] == index.build_signature():
+                index._backend_file = os.path.join(self.folder, state["file"])
+            self.indexes[name] = index
+
+    def migrate_legacy(self):
+        """Import the per-namespace .npy + .json files of older versions. Returns True if any was found."""
+        found = False
+        for name, (vector_file, list_file) in LEGACY_FILES.items():
+            vector_path = os.path.join(self.folder, vector_file)
+            list_path = os.path.join(self.folder, list_file)
+            if not (os.path.exists(vector_path) and os.path.exists(list_path)):
+                continue
+
+            vectors = np.load(vector_path, allow_pickle=True)
+            with open(list_path, "r", encoding="utf-8") as f:
+                items = json.load(f) or []
+            # empty databases were saved as None
+            if vectors.dtype == object or vectors.ndim != 2:
+                vectors, items = None, []
+            elif len(vectors) > len(items):
+                # older RAG builds stored the first row without its list entry
+                print(f"Warning: {vector_file} has {len(vectors)} rows but {list_file} has {len(items)} items, dropping the unmatched leading rows")
+                vectors = vectors[len(vectors) - len(items):]
+            elif len(vectors) < len(items):
+                print(f"Warning: {vector_file} has {len(vectors)} rows but {list_file} has {len(items)} items, dropping the unmatched items")
+                items = items[:len(vectors)]
+
+            self.put(name, VectorIndex(vectors, items))
+            found = True
+        if found:
+            print(f"Read {len(self.indexes)} legacy vector databases in {self.folder}, the next ingestion saves them in the new format")
+        return found
+
+    def save(self):
+        with folder_lock(self.folder):
+            self._save()
+        self.migrated = False
+
+    def _save(self):
+        version = uuid.uuid4().hex[:12]
+
+        namespaces = {}
+        offset = 0
+        for name, index in self.indexes.items():
+            rows, dim = len(index), index.dim
+            namespaces[name] = {
+                "offset": offset,
+                "rows": rows,
+                "dim": dim,
+                "backend": index.backend_name,
+                "backend_params": index.backend_params,
+                "items": index.items,
+            }
+            offset += rows * dim
+
+            if index.effective_backend != "exact":
+                state_file = f"index-{name}-{version}.{index.effective_backend}"
+                if index.save_backend(os.path.join(self.folder, state_file)):
+                    namespaces[name]["backend_state"] = {"file": state_file, "signature": index.build_signature()}
+
+        vectors_file = f"vectors-{version}.f32"
+        with open(os.path.join(self.folder, vectors_file), "wb") as f:
+            for index in self.indexes.values():
+                if len(index):
+                    f.write(np.ascontiguousarray(index.vectors, dtype=np.float32).tobytes())
+
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "dtype": "float32",
+            "vectors_file": vectors_file,
+            "total_floats": offset,
+            "namespaces": namespaces,
+        }
+        manifest_path = self._manifest_path()
+        tmp_path = f"{manifest_path}.{version}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp_path, manifest_path)
+
+        self.vectors_file = vectors_file
+        # only after the new manifest is in place
+        self.remove_stale_files(manifest)
+
+    def remove_stale_files(self, manifest):
+        """Delete matrix and backend files of previous saves. Files still mapped by a reader (Windows) are left for the next save."""
+        current = {manifest["vectors_file"]}
+        current.update(entry["backend_state"]["file"] for entry in manifest["namespaces"].values()
+                       if "backend_state" in entry)
+        for filename in os.listdir(self.folder):
+            if filename.startswith(("vectors-", "index-")) and filename not in current:
+                try:
+                    os.remove(os.path.join(self.folder, filename))
+                except OSError:
+                    pass
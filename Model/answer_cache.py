@@ -0,0 +1,152 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+
+from VectorDB.embedding_matrix import EmbeddingMatrix
+from VectorDB.top_k import top_k
+
+
+# minimum cosine similarity between two queries for the cached answer to be reused
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+# seconds an answer stays valid
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", str(6 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES_PER_USER = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES_PER_USER", "256"))
+ANSWER_CACHE_MAX_USERS = int(os.getenv("ANSWER_CACHE_MAX_USERS", "1000"))
+
+
+class UserAnswers():
+    """Cached answers of one user for one memory version and one day."""
+    def __init__(self, version, day) -> None:
+        self.version = version
+        self.day = day
+        self.queries = EmbeddingMatrix()
+        self.entries = self.queries.items
+
+    def keep(self, rows):
+        """Keep only the given rows, in order."""
+        rows = list(rows)
+        if rows:
+            self.queries = EmbeddingMatrix.from_array(self.queries.matrix[rows], [self.entries[i] for i in rows])
+        else:
+            self.queries = EmbeddingMatrix()
+        self.entries = self.queries.items
+
+
+class SemanticAnswerCache():
+    """
+    Per-user cache of query answers, looked up by query embedding.
+
+    A question whose embedding is at least `threshold` similar to a cached one
+    with the same parameters (method, topk, ...) gets the cached answer. A
+    user's answers are dropped when their memory version changes and at the
+    end of the day, since answers to "yesterday" or "last week" depend on the
+    date. Entries also expire after `ttl` seconds; each user keeps at most
+    `max_entries` answers and at most `max_users` users are cached.
+    """
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, ttl: int = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES_PER_USER,
+                 max_users: int = ANSWER_CACHE_MAX_USERS) -> None:
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_users = max_users
+        self.users = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidated = 0
+
+    def _user(self, user_id, version, create=False):
+        """The user's answers for this memory version and today, dropping stale ones."""
+        today = date.today().isoformat()
+        answers = self.users.get(user_id)
+        if answers is not None and (answers.version != version or answers.day != today):
+            self.invalidated += len(answers.entries)
+            del self.users[user_id]
+            answers = None
+        if answers is None and create:
+            answers = self.users[user_id] = UserAnswers(version, today)
+            while len(self.users) > self.max_users:
+                self.users.popitem(last=False)
+        if answers is not None:
+            self.users.move_to_end(user_id)
+        return answers
+
+    def get(self, user_id, version, query_embedding, params: dict):
+        """Return the cached result of a similar query with the same params, or None."""
+        if query_embedding is None:
+            return None
+        with self.lock:
+            answers = self._user(user_id, version)
+            if answers is None or len(answers.entries) == 0:
+                self.misses += 1
+                return None
+
+            now = time.time()
+            similarities = answers.queries.similarities(np.asarray(query_embedding, dtype=np.float32))
+            for index, similarity in zip(*top_k(similarities, len(similarities), min_score=self.threshold)):
+                entry = answers.entries[index]
+                if entry["params"] != params:
+                    continue
+                if now - entry["created_at"] > self.ttl:
+                    continue
+                entry["last_used"] = now
+                entry["hits"] += 1
+                self.hits += 1
+                return entry["result"]
+
+            self.misses += 1
+            return None
+
+    def put(self, user_id, version, query, query_embedding, params: dict, result):
+        if query_embedding is None or result is None:
+            return
+        with self.lock:
+            answers = self._user(user_id, version, create=True)
+            now = time.time()
+            answers.queries.append(query_embedding, {
+                "query": query,
+                "params": params,
+                "result": result,
+                "created_at": now,
+                "last_used": now,
+                "hits": 0,
+            })
+            self._evict(answers, now)
+
+    def _evict(self, answers, now):
+        rows = [i for i, entry in enumerate(answers.entries) if now - entry["created_at"] <= self.ttl]
+        self.expired += len(answers.entries) - len(rows)
+        if len(rows) > self.max_entries:
+            # least recently used first
+            rows = sorted(rows, key=lambda i: answers.entries[i]["last_used"])[len(rows) - self.max_entries:]
+            rows.sort()
+        if len(rows) != len(answers.entries):
+            answers.keep(rows)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            answers = self.users.pop(user_id, None)
+            if answers is not None:
+                self.invalidated += len(answers.entries)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "users": len(self.users),
+                "entries": sum(len(answers.entries) for answers in self.users.values()),
+                "threshold": self.threshold,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "invalidated": self.invalidated,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -2,10 +2,19 @@ from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Body
 from numpy import extract
 from Preprocess.memory import Memory
 from Query.query import QueryHandler
+from Query.reranker import RERANKERS
+from memory_cache import MemoryCache
+from answer_cache import SemanticAnswerCache
+from executor import create_executors
+from model_registry import registry as model_registry
+from pipeline_tasks import initialize_memory, read_extracted_faces, change_face_tag as change_face_tag_task, delete_face_tag as delete_face_tag_task
+from jobs import JobManager, COMPLETED
+from LLM.embedding_cache import get_embedding_cache
+from LLM.augment_cache import get_augment_cache
 import shutil
 import os
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import base64
@@ -17,6 +26,7 @@ DATA_FOLDER = "data"
 EXTRACTED_FACES = "extracted_faces"
 PROCESSED_FOLDER = os.path.join(DATA_FOLDER, "processed")
 VECTOR_DB_FOLDER = os.path.join(DATA_FOLDER, "vector_db")
+JOBS_FOLDER = os.path.join(DATA_FOLDER, "jobs")
 UPLOAD_FOLDER = "uploaded_images"
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
@@ -28,6 +38,28 @@ VIDEO_EXT_LIST = {"mp4", "mov", "avi"}
 
 app = FastAPI()
 
+# warm per-user Memory / QueryHandler pairs for /answer_query
+memory_cache = MemoryCache()
+
+# answers of repeated / near-duplicate questions, per user and memory version
+answer_cache = SemanticAnswerCache()
+
+# blocking work never runs on the event loop:
+# ingestion / face tags on ingest_executor, queries and file I/O on query_executor
+ingest_executor, query_executor = create_executors()
+
+# background initialize_user_memory jobs, bounded by the ingestion pool
+job_manager = JobManager(JOBS_FOLDER, ingest_executor)
+
+@app.on_event("startup")
+def resume_jobs():
+    job_manager.resume()
+
+@app.on_event("shutdown")
+def shutdown_executors():
+    ingest_executor.shutdown(wait=False)
+    query_executor.shutdown(wait=False)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -46,6 +78,8 @@ class AnswerQueryRequest(BaseModel):
     method: str = "memory"
     detect_faces: bool = False
     topk: int = 5
+    # composite context reranker of the memory method, None uses COMPOSITE_RERANKER
+    reranker: Optional[str] = None
 
 class ChangeFaceTagRequest(BaseModel):
     user_id: str
@@ -61,8 +95,6 @@ async def upload_images(user_id: str = Form(...), files: List[UploadFile] = File
     user_folder = os.path.join(UPLOAD_FOLDER, user_id)
     Path(user_folder).mkdir(parents=True, exist_ok=True)
 
-    uploaded_files = []
-
     for file in files:
         ext = file.filename.split(".")[-1].lower()
 
@@ -72,12 +104,7 @@ async def upload_images(user_id: str = Form(...), files: List[UploadFile] = File
                 detail=f"Invalid file type {file.filename}. Allowed: jpg, jpeg, png, heic, mp4, mov, avi."
             )
 
-        file_path = os.path.join(user_folder, file.filename)
-
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-
-        uploaded_files.append({"filename": file.filename, "filepath": file_path})
+    uploaded_files = await query_executor.run("upload_images", save_uploaded_files, files, user_folder)
 
     return {
         "message": f"Successfully uploaded {len(uploaded_files)} file(s)",
@@ -97,49 +124,99 @@ async def initialize_user_memory(payload: InitMemoryRequest):
     if not os.path.exists(uploaded_folder) or not os.listdir(uploaded_folder):
         raise HTTPException(status_code=400, detail="No images found for this user.")
 
-    Path(processed_folder).mkdir(parents=True, exist_ok=True)
-    Path(vector_db_folder).mkdir(parents=True, exist_ok=True)
+    # a background job of the same user would write the same folders
+    token = job_manager.claim(user_id)
+    if token is None:
+        raise HTTPException(status_code=409, detail="An initialization is already running for this user.")
+    try:
+        Path(processed_folder).mkdir(parents=True, exist_ok=True)
+        Path(vector_db_folder).mkdir(parents=True, exist_ok=True)
+
+        memory_content_processed, extracted_faces = await ingest_executor.run(
+            "initialize_user_memory", initialize_memory,
+            uploaded_folder, processed_folder, vector_db_folder, detect_faces)
+    finally:
+        job_manager.release(user_id, token)
+    memory_cache.invalidate(user_id)
+    answer_cache.invalidate(user_id)
+
+    return JSONResponse(content={
+        "message": "User memory initialized successfully.",
+        "processed_folder": processed_folder,
+        "vector_db_folder": vector_db_folder,
+        "memory": memory_content_processed,
+        "extracted_faces": extracted_faces
+    })
 
-    memory = Memory(raw_folder=uploaded_folder,
-                    processed_folder=processed_folder,
-                    vector_db_folder=vector_db_folder,
-                    detect_faces=detect_faces)
-    memory.preprocess()
-    memory.augment()
+@app.post("/jobs/initialize_user_memory")
+async def submit_initialize_job(payload: InitMemoryRequest):
+    user_id = payload.user_id
 
-    extracted_faces_folder = os.path.join(processed_folder, "extracted_faces")
-    grouped_faces_file = os.path.join(processed_folder, "grouped_faces", "grouped_faces.json") 
+    uploaded_folder = os.path.join(UPLOAD_FOLDER, user_id)
+    if not os.path.exists(uploaded_folder) or not os.listdir(uploaded_folder):
+        raise HTTPException(status_code=400, detail="No images found for this user.")
 
-    extracted_faces = []
-    if detect_faces and os.path.exists(extracted_faces_folder):
-        # read grouped faces from JSON file
-        if os.path.exists(grouped_faces_file):
-            extracted_faces = read_grouped_faces(grouped_faces_file, extracted_faces_folder)
+    job = job_manager.submit(user_id,
+                             raw_folder=uploaded_folder,
+                             processed_folder=os.path.join(PROCESSED_FOLDER, user_id),
+                             vector_db_folder=os.path.join(VECTOR_DB_FOLDER, user_id),
+                             detect_faces=payload.detect_faces)
+    if job is None:
+        raise HTTPException(status_code=409, detail="An initialization is already running for this user.")
+
+    return {"job_id": job["job_id"], "status": job["status"]}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    if job["status"] != COMPLETED:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}.")
+
+    processed_folder = job["params"]["processed_folder"]
+    memory_content_processed, extracted_faces = await query_executor.run(
+        "job_result", read_job_result, processed_folder, job["params"]["detect_faces"])
 
     return JSONResponse(content={
         "message": "User memory initialized successfully.",
         "processed_folder": processed_folder,
-        "vector_db_folder": vector_db_folder,
-        "memory": memory.memory_content_processed,
+        "vector_db_folder": job["params"]["vector_db_folder"],
+        "memory": memory_content_processed,
         "extracted_faces": extracted_faces
     })
 
-def read_grouped_faces(grouped_faces_file, extracted_faces_folder):
-    extracted_faces = []
-    with open(grouped_faces_file, "r") as f:
-        grouped_faces = json.load(f)
-    for face_tag, face_files in grouped_faces.items():
-        face_file = face_files[0]
-        face_path = os.path.join(extracted_faces_folder, face_file)
-        if os.path.exists(face_path):
-            with open(face_path, "rb") as f:
-                encoded_image = base64.b64encode(f.read()).decode("utf-8")
-                extracted_faces.append({
-                    "filename": face_file,
-                    "face_tag": face_tag,
-                    "base64_image": encoded_image
-                })
-    return extracted_faces
+def read_job_result(processed_folder, detect_faces):
+    with open(os.path.join(processed_folder, "memory_content_processed.json"), "r", encoding="utf-8") as f:
+        memory_content_processed = json.load(f)
+
+    extracted_faces = read_extracted_faces(processed_folder) if detect_faces else []
+    return memory_content_processed, extracted_faces
+
+def save_uploaded_files(files, user_folder):
+    uploaded_files = []
+    for file in files:
+        file_path = os.path.join(user_folder, file.filename)
+
+        with open(file_path, "wb") as buffer:
+            shutil.copyfileobj(file.file, buffer)
+
+        uploaded_files.append({"filename": file.filename, "filepath": file_path})
+    return uploaded_files
 
 @app.post("/answer_query")
 async def answer_query(payload: AnswerQueryRequest):
@@ -148,6 +225,7 @@ async def answer_query(payload: AnswerQueryRequest):
     method = payload.method
     detect_faces = payload.detect_faces
     topk = payload.topk
+    reranker = payload.reranker
 
     user_processed_folder = os.path.join(PROCESSED_FOLDER, user_id)
     user_vector_db_folder = os.path.join(VECTOR_DB_FOLDER, user_id)
@@ -155,53 +233,72 @@ async def answer_query(payload: AnswerQueryRequest):
     if not os.path.exists(user_processed_folder) or not os.path.exists(user_vector_db_folder):
         raise HTTPException(status_code=400, detail="User memory not found. Please initialize first.")
 
-    memory = Memory(raw_folder=os.path.join(UPLOAD_FOLDER, user_id),
-                    processed_folder=user_processed_folder,
-                    vector_db_folder=user_vector_db_folder,
-                    detect_faces=detect_faces)
+    if method not in ("memory", "rag"):
+        raise HTTPException(status_code=400, detail="Invalid query method. Use 'memory' or 'rag'.")
+
+    if reranker is not None and reranker not in RERANKERS:
+        raise HTTPException(status_code=400, detail=f"Invalid reranker. Use one of {', '.join(RERANKERS)}.")
+
     try:
-        memory.load_processed_memory()
+        result, memory_photos = await query_executor.run(
+            "answer_query", run_query,
+            user_id, query, method, detect_faces, topk, reranker, user_processed_folder, user_vector_db_folder)
     except FileNotFoundError as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    query_handler = QueryHandler(memory, detect_faces=detect_faces)
+    return {
+        "user_id": user_id,
+        "query": query,
+        "method": method,
+        "response": result,
+        "memory_photos": memory_photos
+    }
 
-    if method == "memory":
-        result = query_handler.query_memory(query, topk=topk, llm="gemini")
-    elif method == "rag":
-        result = query_handler.query_rag(query, topk=topk, llm="gemini")
+def run_query(user_id, query, method, detect_faces, topk, reranker, user_processed_folder, user_vector_db_folder):
+    uploaded_folder = os.path.join(UPLOAD_FOLDER, user_id)
+    cached = memory_cache.get(user_id,
+                              raw_folder=uploaded_folder,
+                              processed_folder=user_processed_folder,
+                              vector_db_folder=user_vector_db_folder,
+                              detect_faces=detect_faces)
+
+    memory = cached.memory
+    query_handler = cached.query_handler
+
+    # the answer cache is looked up before the query is augmented, so a hit costs one embedding and no LLM call;
+    # the embedding is passed on so the query is not embedded again on a miss
+    query_embedding = query_handler.llm.calculate_embeddings(query)
+    params = {"method": method, "topk": topk, "detect_faces": detect_faces, "reranker": reranker}
+    result = answer_cache.get(user_id, cached.fingerprint, query_embedding, params)
+    if result is not None:
+        print(f"Answer cache hit: {query}")
     else:
-        raise HTTPException(status_code=400, detail="Invalid query method. Use 'memory' or 'rag'.")
-    
+        if method == "memory":
+            result = query_handler.query_memory(query, topk=topk, llm="gemini", reranker=reranker,
+                                                query_embedding=query_embedding)
+        else:
+            result = query_handler.query_rag(query, topk=topk, llm="gemini", query_embedding=query_embedding)
+        answer_cache.put(user_id, cached.fingerprint, query, query_embedding, params, result)
+
     print(f"Query: {query}, Method: {method}, Result: {result}")
     # Extract memory photos if memory_ids are present
-    uploaded_folder = os.path.join(UPLOAD_FOLDER, user_id)
     memory_photos = []
     if result and "memory_ids" in result and result["memory_ids"]:
         memory_photos = get_memory_photos(result["memory_ids"], uploaded_folder, memory)
-        # print(f"Memory photos extracted: {len(memory_photos)}")
-        # print(f"Memory photos: {memory_photos[0]['memory_id'] if memory_photos else 'No photos found'}")
 
-    return {
-        "user_id": user_id,
-        "query": query,
-        "method": method,
-        "response": result,
-        "memory_photos": memory_photos
-    }
+    return result, memory_photos
 
 def get_memory_photos(memory_ids, user_folder, memory: Memory):
     memory_photos = []
     for memory_id in memory_ids:
-        ext = memory_id.split(".")[-1].lower()
-        # Check if the memory_id is a valid image file
-        if ext not in IMG_EXT_LIST or ext not in VIDEO_EXT_LIST:
-            for mem in memory.memory_content_processed:
-                if memory_id in mem.get("filename"):
-                    memory_file = os.path.join(user_folder, mem["filename"])
-                    break
-        else:
-            memory_file = os.path.join(user_folder, memory_id)
+        # the answer may name a memory with or without its extension
+        filename = memory.find_memory_file(memory_id)
+        if filename is None:
+            ext = memory_id.split(".")[-1].lower()
+            if ext not in IMG_EXT_LIST and ext not in VIDEO_EXT_LIST:
+                continue
+            filename = memory_id
+        memory_file = os.path.join(user_folder, filename)
 
         # if the memory file exists, read it and encode to base64
         if os.path.exists(memory_file):
@@ -225,22 +322,14 @@ async def change_face_tag(payload: ChangeFaceTagRequest):
     if not os.path.exists(user_processed_folder):
         raise HTTPException(status_code=400, detail="User memory not found. Please initialize first.")
 
-    memory = Memory(raw_folder=os.path.join(UPLOAD_FOLDER, user_id),
-                    processed_folder=user_processed_folder,
-                    vector_db_folder=user_vector_db_folder,
-                    detect_faces=True)
     try:
-        memory.load_processed_memory()
+        done, extracted_faces = await ingest_executor.run(
+            "change_face_tag", change_face_tag_task,
+            os.path.join(UPLOAD_FOLDER, user_id), user_processed_folder, user_vector_db_folder, face_tag, new_face_tag)
     except FileNotFoundError as e:
         raise HTTPException(status_code=500, detail=str(e))
-
-    done = memory.change_face_tag(face_tag, new_face_tag)
-
-    extracted_faces_folder = os.path.join(user_processed_folder, "extracted_faces")
-    grouped_faces_file = os.path.join(user_processed_folder, "grouped_faces", "grouped_faces.json")
-    extracted_faces = []
-    if done and os.path.exists(extracted_faces_folder) and os.path.exists(grouped_faces_file):
-        extracted_faces = read_grouped_faces(grouped_faces_file, extracted_faces_folder)
+    memory_cache.invalidate(user_id)
+    answer_cache.invalidate(user_id)
 
     if done:
         return {
@@ -261,21 +350,14 @@ async def delete_face_tag(payload: DeleteFaceTagRequest):
     if not os.path.exists(user_processed_folder):
         raise HTTPException(status_code=400, detail="User memory not found. Please initialize first.")
 
-    memory = Memory(raw_folder=os.path.join(UPLOAD_FOLDER, user_id),
-                    processed_folder=user_processed_folder,
-                    vector_db_folder=user_vector_db_folder,
-                    detect_faces=True)
     try:
-        memory.load_processed_memory()
+        done, extracted_faces = await ingest_executor.run(
+            "delete_face_tag", delete_face_tag_task,
+            os.path.join(UPLOAD_FOLDER, user_id), user_processed_folder, user_vector_db_folder, face_tag)
     except FileNotFoundError as e:
         raise HTTPException(status_code=500, detail=str(e))
-
-    done = memory.delete_face_tag(face_tag)
-    extracted_faces_folder = os.path.join(user_processed_folder, "extracted_faces")
-    grouped_faces_file = os.path.join(user_processed_folder, "grouped_faces", "grouped_faces.json")
-    extracted_faces = []
-    if done and os.path.exists(extracted_faces_folder) and os.path.exists(grouped_faces_file):
-        extracted_faces = read_grouped_faces(grouped_faces_file, extracted_faces_folder)
+    memory_cache.invalidate(user_id)
+    answer_cache.invalidate(user_id)
 
     if done:
         return {
@@ -285,6 +367,20 @@ async def delete_face_tag(payload: DeleteFaceTagRequest):
     else:
         return {"message": f"Failed to delete the face tag [{face_tag}]"}
 
+@app.get("/cache_stats")
+async def cache_stats():
+    return {
+        "memory_cache": memory_cache.stats(),
+        "embedding_cache": get_embedding_cache().stats(),
+        "augment_cache": get_augment_cache().stats(),
+        "answer_cache": answer_cache.stats(),
+    }
+
+@app.get("/model_stats")
+async def model_stats():
+    # models of this process only: process pool workers load their own
+    return model_registry.stats()
+
 
 if __name__ == "__main__":
     import uvicorn
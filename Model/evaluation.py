@@ -272,7 +272,10 @@ def compute_enhanced_accuracy(results, questions_with_choices=None, similarity_t
                 'memory_correct': memory_correct,
                 'memory_method': memory_method,
                 'memory_confidence': memory_confidence,
-                'choices_available': len(choices) > 0
+                'choices_available': len(choices) > 0,
+                'reranker': question.get('reranker', 'llm'),
+                'memory_latency': question.get('memory_latency'),
+                'rerank_latency': question.get('rerank_latency')
             })
             
             print(f"User ID: {user_id}")
@@ -312,6 +315,25 @@ def print_detailed_analysis(rag_results, memory_results, total_questions):
         percentage = (count / total_questions) * 100
         print(f"  {method}: {count} ({percentage:.1f}%)")
 
+def print_reranker_analysis(detailed_results):
+    """Memory accuracy and latency per composite context reranker."""
+    by_reranker = defaultdict(list)
+    for result in detailed_results:
+        by_reranker[result['reranker']].append(result)
+
+    print("\n" + "="*60)
+    print("RERANKER ANALYSIS")
+    print("="*60)
+    for reranker, results in sorted(by_reranker.items()):
+        correct = sum(1 for r in results if r['memory_correct'])
+        print(f"\n{reranker}: Memory Accuracy {correct / len(results):.2%} ({correct}/{len(results)})")
+        latencies = [r['memory_latency'] for r in results if r['memory_latency'] is not None]
+        rerank_latencies = [r['rerank_latency'] for r in results if r['rerank_latency'] is not None]
+        if latencies:
+            print(f"  Query latency: mean {np.mean(latencies):.3f}s, p95 {np.percentile(latencies, 95):.3f}s")
+        if rerank_latencies:
+            print(f"  Rerank latency: mean {np.mean(rerank_latencies):.3f}s, p95 {np.percentile(rerank_latencies, 95):.3f}s")
+
 def save_detailed_results(detailed_results, output_file):
     """Save detailed evaluation results to JSON file."""
     # Convert numpy float32 to regular Python float
@@ -365,6 +387,7 @@ def main():
     
     # Print detailed analysis
     print_detailed_analysis(rag_results, memory_results, total_questions)
+    print_reranker_analysis(detailed_results)
     
     # Save detailed results
     save_detailed_results(detailed_results, output_file)
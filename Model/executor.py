@@ -0,0 +1,81 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def parse_limits(limits_string):
+    """Parse 'endpoint=limit,endpoint=limit' into a dict."""
+    limits = {}
+    for part in limits_string.split(","):
+        if "=" not in part:
+            continue
+        endpoint, limit = part.split("=", 1)
+        limits[endpoint.strip()] = int(limit)
+    return limits
+
+
+class PipelineExecutor():
+    """
+    Runs blocking pipeline work (preprocessing, augmentation, querying) off the
+    asyncio event loop, on a thread or process pool, with an optional
+    concurrency limit per endpoint.
+
+    Process pools can only run picklable module level functions, see pipeline_tasks.py.
+    """
+    def __init__(self, kind: str = "thread", max_workers: int = None, limits: dict = None) -> None:
+        if kind not in ("thread", "process"):
+            raise ValueError("Invalid executor kind. Use 'thread' or 'process'.")
+        self.kind = kind
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        self.limits = limits if limits is not None else {}
+        self.semaphores = {}
+
+        if kind == "process":
+            # spawn: torch / paddle do not survive a fork of a running server
+            self.pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        else:
+            self.pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{kind}-pipeline")
+
+    def _semaphore(self, endpoint):
+        if endpoint not in self.limits:
+            return None
+        if endpoint not in self.semaphores:
+            self.semaphores[endpoint] = asyncio.Semaphore(self.limits[endpoint])
+        return self.semaphores[endpoint]
+
+    async def run(self, endpoint, fn, *args, **kwargs):
+        """Await fn(*args, **kwargs) on the pool, waiting for a free slot of the endpoint first."""
+        loop = asyncio.get_running_loop()
+        call = functools.partial(fn, *args, **kwargs)
+
+        semaphore = self._semaphore(endpoint)
+        if semaphore is None:
+            return await loop.run_in_executor(self.pool, call)
+        async with semaphore:
+            return await loop.run_in_executor(self.pool, call)
+
+    def shutdown(self, wait=True):
+        self.pool.shutdown(wait=wait)
+
+
+def create_executors():
+    """
+    Build the ingestion and query executors from the environment:
+      INGEST_EXECUTOR      thread | process (default thread)
+      INGEST_MAX_WORKERS   workers for preprocessing / augmentation / face tags (default 2)
+      QUERY_MAX_WORKERS    threads for queries and file I/O (default 8)
+      ENDPOINT_LIMITS      e.g. "initialize_user_memory=1,answer_query=8"
+    Queries always run on threads because they share the in-process memory cache.
+    """
+    limits = parse_limits(os.getenv("ENDPOINT_LIMITS", "initialize_user_memory=2,answer_query=8"))
+
+    ingest_executor = PipelineExecutor(kind=os.getenv("INGEST_EXECUTOR", "thread"),
+                                       max_workers=int(os.getenv("INGEST_MAX_WORKERS", "2")),
+                                       limits=limits)
+    query_executor = PipelineExecutor(kind="thread",
+                                      max_workers=int(os.getenv("QUERY_MAX_WORKERS", "8")),
+                                      limits=limits)
+    return ingest_executor, query_executor
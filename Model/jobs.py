@@ -0,0 +1,315 @@
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from Preprocess.ProcessMemoryContent import ProcessMemoryContent
+from Preprocess.augment import AugmentContext
+
+
+INGESTION_STAGES = ProcessMemoryContent.STAGES + AugmentContext.STAGES
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+# minimum seconds between two writes of the job file while a stage advances
+PROGRESS_WRITE_INTERVAL = 1.0
+
+# finished job files older than this are deleted, and how often that is checked
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", "7"))
+JOB_SWEEP_INTERVAL = 3600
+
+
+class JobCancelled(BaseException):
+    """
+    Raised by the progress callback when a job was cancelled.
+    BaseException so the broad `except Exception` handlers of the pipeline do not swallow it.
+    """
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+class JobStore():
+    """
+    One JSON file per job, replaced atomically so other processes never read a partial file.
+    Cancel requests are separate marker files so they cannot be lost to a concurrent progress write.
+    """
+    def __init__(self, jobs_folder: str) -> None:
+        self.jobs_folder = jobs_folder
+        os.makedirs(jobs_folder, exist_ok=True)
+
+    def _path(self, job_id):
+        return os.path.join(self.jobs_folder, f"{job_id}.json")
+
+    def _cancel_path(self, job_id):
+        return os.path.join(self.jobs_folder, f"{job_id}.cancel")
+
+    def load(self, job_id):
+        path = self._path(job_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            job = json.load(f)
+        job["cancel_requested"] = self.cancel_requested(job_id)
+        return job
+
+    def request_cancel(self, job_id):
+        with open(self._cancel_path(job_id), "w") as f:
+            f.write(_now())
+
+    def cancel_requested(self, job_id):
+        return os.path.exists(self._cancel_path(job_id))
+
+    def save(self, job):
+        job["updated_at"] = _now()
+        path = self._path(job["job_id"])
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def update(self, job_id, **fields):
+        job = self.load(job_id)
+        job.update(fields)
+        self.save(job)
+        return job
+
+    def delete(self, job_id):
+        for path in (self._path(job_id), self._cancel_path(job_id)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def sweep(self, max_age_seconds):
+        """Delete finished jobs (and cancel markers) not updated for max_age_seconds. Returns how many jobs were deleted."""
+        cutoff = time.time() - max_age_seconds
+        deleted = 0
+        for filename in os.listdir(self.jobs_folder):
+            path = os.path.join(self.jobs_folder, filename)
+            try:
+                if os.path.getmtime(path) > cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            job_id, ext = os.path.splitext(filename)
+            if ext == ".cancel" and not os.path.exists(self._path(job_id)):
+                self.delete(job_id)
+            elif ext == ".json":
+                job = self.load(job_id)
+                if job is not None and job["status"] not in ACTIVE_STATUSES:
+                    self.delete(job_id)
+                    deleted += 1
+        return deleted
+
+    def all(self):
+        jobs = []
+        for filename in os.listdir(self.jobs_folder):
+            if filename.endswith(".json"):
+                job = self.load(filename[:-len(".json")])
+                if job is not None:
+                    jobs.append(job)
+        return jobs
+
+
+class JobProgress():
+    """
+    Progress callback given to Memory.preprocess() / Memory.augment().
+    Records the current stage in the job file and raises JobCancelled once a cancel was requested.
+    """
+    def __init__(self, store: JobStore, job_id: str) -> None:
+        self.store = store
+        self.job_id = job_id
+        self.last_write = 0
+        self.stage = None
+
+    def __call__(self, stage, done=None, total=None):
+        now = time.time()
+        if stage == self.stage and now - self.last_write < PROGRESS_WRITE_INTERVAL:
+            return
+
+        if self.store.cancel_requested(self.job_id):
+            raise JobCancelled()
+
+        job = self.store.load(self.job_id)
+
+        stage_index = INGESTION_STAGES.index(stage)
+        stage_fraction = done / total if done is not None and total else 0
+        job["stage"] = stage
+        job["stage_index"] = stage_index
+        job["stage_done"] = done
+        job["stage_total"] = total
+        job["progress"] = round((stage_index + stage_fraction) / len(INGESTION_STAGES), 4)
+        self.store.save(job)
+
+        self.stage = stage
+        self.last_write = now
+
+
+def run_ingestion_job(jobs_folder, job_id):
+    """Run one initialize_user_memory job. Module level so it can run in a process pool."""
+    from Preprocess.memory import Memory
+
+    store = JobStore(jobs_folder)
+    job = store.load(job_id)
+    if job is None or job["status"] not in ACTIVE_STATUSES:
+        return
+    if job["cancel_requested"]:
+        store.update(job_id, status=CANCELLED, finished_at=_now())
+        return
+
+    store.update(job_id, status=RUNNING, started_at=_now())
+    params = job["params"]
+    progress = JobProgress(store, job_id)
+    try:
+        os.makedirs(params["processed_folder"], exist_ok=True)
+        os.makedirs(params["vector_db_folder"], exist_ok=True)
+
+        memory = Memory(raw_folder=params["raw_folder"],
+                        processed_folder=params["processed_folder"],
+                        vector_db_folder=params["vector_db_folder"],
+                        detect_faces=params["detect_faces"])
+        memory.preprocess(progress_callback=progress)
+        memory.augment(progress_callback=progress)
+    except JobCancelled:
+        store.update(job_id, status=CANCELLED, finished_at=_now())
+        print(f"Job {job_id} cancelled.")
+        return
+    except Exception as e:
+        store.update(job_id, status=FAILED, error=str(e), finished_at=_now())
+        print(f"Job {job_id} failed: {e}")
+        return
+
+    store.update(job_id, status=COMPLETED, progress=1.0, stage=None,
+                 memory_count=len(memory.memory_content_processed), finished_at=_now())
+
+
+class JobManager():
+    """
+    Submits ingestion jobs to the ingestion executor pool, which bounds how many run at once.
+
+    Jobs are files in jobs_folder, so they survive restarts: resume() re-queues every job that
+    was queued or running when the server stopped. The pipeline skips stages whose output
+    already exists on disk, so a resumed job continues where it stopped.
+
+    At most one ingestion writes a user's folders at a time: active maps each user to its
+    queued / running job, or to the synchronous ingestion holding claim(). Finished jobs are
+    deleted after JOB_RETENTION_DAYS.
+    """
+    def __init__(self, jobs_folder: str, executor) -> None:
+        self.jobs_folder = jobs_folder
+        self.store = JobStore(jobs_folder)
+        self.executor = executor
+        self.futures = {}
+        # reentrant: a future that is already done runs its callback inside _schedule
+        self.lock = threading.RLock()
+        # user_id -> job_id, or the token of a synchronous ingestion
+        self.active = {}
+        self.last_sweep = 0
+
+    def claim(self, user_id):
+        """Reserve the user's folders for a synchronous ingestion. Returns a token for release(), None if busy."""
+        with self.lock:
+            if user_id in self.active:
+                return None
+            token = f"sync-{uuid.uuid4().hex}"
+            self.active[user_id] = token
+            return token
+
+    def release(self, user_id, token):
+        with self.lock:
+            if self.active.get(user_id) == token:
+                del self.active[user_id]
+
+    def sweep(self, force=False):
+        if not force and time.time() - self.last_sweep < JOB_SWEEP_INTERVAL:
+            return 0
+        self.last_sweep = time.time()
+        return self.store.sweep(JOB_RETENTION_DAYS * 24 * 3600)
+
+    def submit(self, user_id, raw_folder, processed_folder, vector_db_folder, detect_faces=False):
+        """Create and queue a job. Returns None if the user already has an active job or ingestion."""
+        self.sweep()
+        with self.lock:
+            if user_id in self.active:
+                return None
+
+            job = {
+                "job_id": uuid.uuid4().hex,
+                "type": "initialize_user_memory",
+                "user_id": user_id,
+                "params": {
+                    "raw_folder": raw_folder,
+                    "processed_folder": processed_folder,
+                    "vector_db_folder": vector_db_folder,
+                    "detect_faces": detect_faces,
+                },
+                "status": QUEUED,
+                "stages": INGESTION_STAGES,
+                "stage": None,
+                "stage_index": None,
+                "progress": 0.0,
+                "error": None,
+                "created_at": _now(),
+            }
+            self.store.save(job)
+            self.active[user_id] = job["job_id"]
+            self._schedule(user_id, job["job_id"])
+        return job
+
+    def _schedule(self, user_id, job_id):
+        future = self.executor.pool.submit(run_ingestion_job, self.jobs_folder, job_id)
+        self.futures[job_id] = future
+        future.add_done_callback(lambda _: self._finished(user_id, job_id))
+
+    def _finished(self, user_id, job_id):
+        self.futures.pop(job_id, None)
+        self.release(user_id, job_id)
+
+    def get(self, job_id):
+        return self.store.load(job_id)
+
+    def active_job(self, user_id):
+        job_id = self.active.get(user_id)
+        if job_id is None or job_id.startswith("sync-"):
+            return None
+        return self.store.load(job_id)
+
+    def cancel(self, job_id):
+        """Request cancellation. Queued jobs stop immediately, running ones at their next progress report."""
+        job = self.store.load(job_id)
+        if job is None or job["status"] not in ACTIVE_STATUSES:
+            return job
+
+        self.store.request_cancel(job_id)
+        future = self.futures.get(job_id)
+        if future is not None and future.cancel():
+            return self.store.update(job_id, status=CANCELLED, finished_at=_now())
+        return self.store.load(job_id)
+
+    def resume(self):
+        """Re-queue jobs interrupted by a restart."""
+        resumed = 0
+        for job in self.store.all():
+            if job["status"] not in ACTIVE_STATUSES:
+                continue
+            if job["cancel_requested"]:
+                self.store.update(job["job_id"], status=CANCELLED, finished_at=_now())
+                continue
+            self.store.update(job["job_id"], status=QUEUED)
+            with self.lock:
+                self.active[job["user_id"]] = job["job_id"]
+                self._schedule(job["user_id"], job["job_id"])
+            resumed += 1
+        if resumed:
+            print(f"Resumed {resumed} ingestion job(s).")
+        self.sweep(force=True)
+        return resumed
@@ -0,0 +1,145 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from Preprocess.memory import Memory
+from Query.query import QueryHandler
+
+
+# Upper bound for the estimated footprint of all cached users (bytes).
+DEFAULT_MAX_BYTES = int(os.getenv("MEMORY_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+
+def folder_fingerprint(*folders):
+    """
+    Cheap signature of the files directly inside the given folders.
+    Any rewrite of memory_content_processed.json, face_list.json or a vector db
+    file changes the mtime/size of that file and therefore the fingerprint.
+    """
+    signature = []
+    for folder in folders:
+        if not os.path.isdir(folder):
+            signature.append((folder, None))
+            continue
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                signature.append((folder, entry.name, stat.st_mtime_ns, stat.st_size))
+    signature.sort(key=str)
+    return hash(tuple(signature))
+
+
+def estimate_footprint(obj):
+    """Approximate resident size of a loaded memory (numpy buffers + python containers)."""
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+
+        if isinstance(item, np.ndarray):
+            total += item.nbytes
+            continue
+
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+    return total
+
+
+class CachedMemory():
+    def __init__(self, memory: Memory, query_handler: QueryHandler, fingerprint, size) -> None:
+        self.memory = memory
+        self.query_handler = query_handler
+        self.fingerprint = fingerprint
+        self.size = size
+
+
+class MemoryCache():
+    """
+    Bounded LRU of warm per-user (Memory, QueryHandler) pairs.
+
+    Entries are keyed by (user_id, detect_faces), evicted by estimated memory
+    footprint, and dropped automatically when the user's processed or
+    vector_db folder changes on disk.
+    """
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, user_id, raw_folder, processed_folder, vector_db_folder, detect_faces=False):
+        """Return a warm CachedMemory, loading it from disk on a miss or after a change."""
+        key = (user_id, detect_faces)
+        fingerprint = folder_fingerprint(processed_folder, vector_db_folder)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.fingerprint == fingerprint:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+
+        # load outside the lock so other users are not blocked by this disk read
+        memory = Memory(raw_folder=raw_folder,
+                        processed_folder=processed_folder,
+                        vector_db_folder=vector_db_folder,
+                        detect_faces=detect_faces)
+        memory.load_processed_memory()
+        query_handler = QueryHandler(memory, detect_faces=detect_faces)
+
+        size = estimate_footprint([memory.memory_content_processed, vars(memory.augment_context)])
+        entry = CachedMemory(memory, query_handler, fingerprint, size)
+
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = entry
+            self.total_bytes += size
+            self._evict()
+        return entry
+
+    def invalidate(self, user_id):
+        """Drop every cached entry of a user."""
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == user_id]:
+                self._remove(key)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "total_bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry.size
+
+    def _evict(self):
+        # always keep the most recent entry even if it alone exceeds the budget
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
@@ -0,0 +1,125 @@
+import os
+import threading
+import time
+from collections import namedtuple
+
+
+CLIP_MODEL_ID = os.getenv("CLIP_MODEL_ID", "openai/clip-vit-base-patch32")
+
+ClipModel = namedtuple("ClipModel", ["model", "processor", "device"])
+
+
+def current_rss():
+    """Resident memory of this process in bytes, None if it cannot be read."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def torch_device():
+    import torch
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def load_clip():
+    from transformers import CLIPModel, CLIPProcessor
+    device = torch_device()
+    print(f"Device : {device}")
+    model = CLIPModel.from_pretrained(CLIP_MODEL_ID).to(device).eval()
+    processor = CLIPProcessor.from_pretrained(CLIP_MODEL_ID)
+    return ClipModel(model, processor, device)
+
+
+def load_paddleocr():
+    from paddleocr import PaddleOCR
+    return PaddleOCR(use_angle_cls=True, lang='en', show_log=False)
+
+
+def load_mtcnn():
+    from facenet_pytorch import MTCNN
+    return MTCNN(keep_all=True, device=torch_device())
+
+
+def load_inception_resnet():
+    from facenet_pytorch import InceptionResnetV1
+    return InceptionResnetV1(pretrained='vggface2').eval().to(torch_device())
+
+
+class ModelRegistry():
+    """
+    Loads each model the first time it is asked for and shares the instance
+    within the process, so workers that only answer queries never import
+    torch or load weights. Load time and resident memory growth are recorded
+    per model.
+    """
+    def __init__(self) -> None:
+        self.loaders = {}
+        self.models = {}
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.model_locks = {}
+        self.use_locks = {}
+
+    def register(self, name, loader):
+        with self.lock:
+            self.loaders[name] = loader
+            self.model_locks.setdefault(name, threading.Lock())
+            self.use_locks.setdefault(name, threading.Lock())
+
+    def get(self, name):
+        model = self.models.get(name)
+        if model is not None:
+            return model
+        if name not in self.loaders:
+            raise KeyError(f"Unknown model '{name}', use one of {', '.join(self.loaders)}")
+
+        # one lock per model: loading CLIP does not block a thread that needs OCR
+        with self.model_locks[name]:
+            model = self.models.get(name)
+            if model is None:
+                rss_before = current_rss()
+                started = time.perf_counter()
+                model = self.loaders[name]()
+                load_seconds = time.perf_counter() - started
+                rss_after = current_rss()
+                self.metrics[name] = {
+                    "load_seconds": round(load_seconds, 3),
+                    "rss_delta_bytes": rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+                }
+                print(f"Loaded {name} in {load_seconds:.2f}s")
+                self.models[name] = model
+        return model
+
+    def use_lock(self, name):
+        """Lock to hold while calling a shared model that is not thread safe (PaddleOCR)."""
+        return self.use_locks[name]
+
+    def loaded(self, name):
+        return name in self.models
+
+    def stats(self):
+        return {
+            "loaded": list(self.models),
+            "available": list(self.loaders),
+            "models": dict(self.metrics),
+            "rss_bytes": current_rss(),
+        }
+
+
+registry = ModelRegistry()
+registry.register("clip", load_clip)
+registry.register("paddleocr", load_paddleocr)
+registry.register("mtcnn", load_mtcnn)
+registry.register("inception_resnet", load_inception_resnet)
+
+
+def get_model(name):
+    """The shared instance of a registered model, loaded on first use."""
+    return registry.get(name)
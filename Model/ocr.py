@@ -1,4 +1,4 @@
-from paddleocr import PaddleOCR
+from model_registry import get_model, registry
 
 # print("Result : \n")
 # print(f"Result[0] : {result[0]}")
@@ -8,15 +8,19 @@ from paddleocr import PaddleOCR
 
 class OCR:
     def __init__(self, confidence_threshold=0.85, debug=False):
-        # Initialize the PaddleOCR model
-        self.model = PaddleOCR(use_angle_cls=True, lang='en', show_log=False)
         self.confidence_threshold = confidence_threshold
         self.debug = debug
 
+    @property
+    def model(self):
+        # PaddleOCR is loaded on the first detection and shared by every OCR instance
+        return get_model("paddleocr")
+
     def detect_text(self,image_path):
         # Perform OCR on an image
         # cls for Handling Rotated Text
-        model_result = self.model.ocr(image_path, cls=True)
+        with registry.use_lock("paddleocr"):
+            model_result = self.model.ocr(image_path, cls=True)
 
         result = []
 
@@ -0,0 +1,81 @@
+"""
+Blocking pipeline work run by the API executors.
+
+Everything here is a module level function taking plain arguments so it can be
+sent to a process pool as well as a thread pool.
+"""
+import base64
+import json
+import os
+
+from Preprocess.memory import Memory
+
+
+def read_grouped_faces(grouped_faces_file, extracted_faces_folder):
+    extracted_faces = []
+    with open(grouped_faces_file, "r") as f:
+        grouped_faces = json.load(f)
+    for face_tag, face_files in grouped_faces.items():
+        face_file = face_files[0]
+        face_path = os.path.join(extracted_faces_folder, face_file)
+        if os.path.exists(face_path):
+            with open(face_path, "rb") as f:
+                encoded_image = base64.b64encode(f.read()).decode("utf-8")
+                extracted_faces.append({
+                    "filename": face_file,
+                    "face_tag": face_tag,
+                    "base64_image": encoded_image
+                })
+    return extracted_faces
+
+
+def read_extracted_faces(processed_folder):
+    extracted_faces_folder = os.path.join(processed_folder, "extracted_faces")
+    grouped_faces_file = os.path.join(processed_folder, "grouped_faces", "grouped_faces.json")
+
+    if os.path.exists(extracted_faces_folder) and os.path.exists(grouped_faces_file):
+        return read_grouped_faces(grouped_faces_file, extracted_faces_folder)
+    return []
+
+
+def initialize_memory(raw_folder, processed_folder, vector_db_folder, detect_faces=False):
+    """Preprocess and augment a user's memory. Returns (memory_content_processed, extracted_faces)."""
+    memory = Memory(raw_folder=raw_folder,
+                    processed_folder=processed_folder,
+                    vector_db_folder=vector_db_folder,
+                    detect_faces=detect_faces)
+    memory.preprocess()
+    memory.augment()
+
+    extracted_faces = []
+    if detect_faces:
+        extracted_faces = read_extracted_faces(processed_folder)
+
+    return memory.memory_content_processed, extracted_faces
+
+
+def _load_memory_with_faces(raw_folder, processed_folder, vector_db_folder):
+    memory = Memory(raw_folder=raw_folder,
+                    processed_folder=processed_folder,
+                    vector_db_folder=vector_db_folder,
+                    detect_faces=True)
+    memory.load_processed_memory()
+    return memory
+
+
+def change_face_tag(raw_folder, processed_folder, vector_db_folder, face_tag, new_face_tag):
+    """Rename a face group. Returns (done, extracted_faces)."""
+    memory = _load_memory_with_faces(raw_folder, processed_folder, vector_db_folder)
+    done = memory.change_face_tag(face_tag, new_face_tag)
+
+    extracted_faces = read_extracted_faces(processed_folder) if done else []
+    return done, extracted_faces
+
+
+def delete_face_tag(raw_folder, processed_folder, vector_db_folder, face_tag):
+    """Delete a face group. Returns (done, extracted_faces)."""
+    memory = _load_memory_with_faces(raw_folder, processed_folder, vector_db_folder)
+    done = memory.delete_face_tag(face_tag)
+
+    extracted_faces = read_extracted_faces(processed_folder) if done else []
+    return done, extracted_faces
@@ -7,6 +7,8 @@ from Testing_Dataset.downloader import PhotoDownloader
 from Testing_Dataset.processor import FlickrDataProcessor
 from Preprocess.memory import Memory
 from Query.query import QueryHandler
+from Query.reranker import COMPOSITE_RERANKER, ThresholdReranker
+from VectorDB.vector_index import VectorStore
 
 def process_user_questions(user_id: str, memory_instance: Memory, output_file: str = None, batch_size: int = 15) -> None:
     """
@@ -105,6 +107,7 @@ def process_questions(user_id: str, questions: list[Dict], all_results: Dict,
             print(f"\nSaved progress after {processed_count} questions processed")
                 
     save_results(all_results, output_file)
+    fit_rerank_threshold(user_id, all_results[user_id], memory_instance.vector_db_folder)
     print_summary(user_id, processed_count, len(questions), output_file)
 
 def process_single_question(question_data: Dict, query_handler: QueryHandler) -> Dict:
@@ -115,7 +118,11 @@ def process_single_question(question_data: Dict, query_handler: QueryHandler) ->
         
         rag_result = query_handler.query_rag(question_data['question'], topk=15, llm='gemini')
         time.sleep(1)  # Avoid rate limit issues
-        memory_result = query_handler.query_memory(question_data['question'], topk=15, llm='gemini')
+        stats = {}
+        memory_result = query_handler.query_memory(question_data['question'], topk=15, llm='gemini', stats=stats)
+        timings = stats["timings"]
+        rerank_stages = [timings["stages"][stage]["duration"] for stage in ("composite_rerank", "composite_rerank_retry")
+                         if stage in timings["stages"]]
         
         return {
             "question_id": question_id,
@@ -124,12 +131,28 @@ def process_single_question(question_data: Dict, query_handler: QueryHandler) ->
             "rag_answer": rag_result,
             "memory_answer": memory_result,
             "album_ids": question_data['album_ids'],
-            "evidence_photo_ids": question_data['evidence_photo_ids']
+            "evidence_photo_ids": question_data['evidence_photo_ids'],
+            # set COMPOSITE_RERANKER to compare rerankers with evaluation.py
+            "reranker": COMPOSITE_RERANKER,
+            "memory_latency": timings["critical_path_latency"],
+            "rerank_latency": max(rerank_stages, default=0.0),
+            "rerank_decisions": stats.get("rerank_decisions", [])
         }
     except Exception as e:
         print(f"Error processing question {question_data.get('question_id', 'unknown')}: {str(e)}")
         return None
 
+def fit_rerank_threshold(user_id: str, results: list[Dict], vector_db_folder: str) -> None:
+    """Fit the threshold reranker of a user on the keep / drop decisions of the LLM reranker and save it"""
+    decisions = [decision for result in results if result.get('reranker') == 'llm'
+                 for decision in result.get('rerank_decisions', [])]
+    if not decisions:
+        return
+    scores, labels = zip(*decisions)
+    threshold = ThresholdReranker.fit(scores, labels)
+    ThresholdReranker.save(vector_db_folder, threshold, len(decisions))
+    print(f"Fitted rerank threshold {threshold:.3f} for user {user_id} on {len(decisions)} LLM reranker decisions")
+
 def save_results(results: Dict, output_file: str) -> None:
     """Save results to JSON file"""
     with open(output_file, 'w', encoding='utf-8') as f:
@@ -212,9 +235,9 @@ if __name__ == '__main__':
             
             # 3. Check and load processed memory
             processed_memory_file = os.path.join("data", "processed", safe_user_id, "memory_content_processed.json")
-            vector_db_exists = os.path.join("data", "vector_db", safe_user_id, "vector_db_list.json")
+            vector_db_complete = "rag" in VectorStore(os.path.join("data", "vector_db", safe_user_id))
             
-            if os.path.exists(processed_memory_file) and os.path.exists(vector_db_exists):
+            if os.path.exists(processed_memory_file) and vector_db_complete:
                 print("\n[2/3] Loading existing processed memory...")
                 memory.load_processed_memory()
                 print("[2/3] DONE")
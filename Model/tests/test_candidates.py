@@ -0,0 +1,44 @@
+from Query.candidates import CandidateSet
+from Query.context_packer import ContextPacker
+
+
+MEMORY_TOKENS = 100
+
+
+class FakeFragments():
+    """Prompt fragments of MEMORY_TOKENS tokens each."""
+    def get(self, memory, memory_format):
+        return {"text": f"{memory['filename']}\n", "tokens": MEMORY_TOKENS, "long_text": False}
+
+
+def make_memory(filename, date_string="2024-01-01"):
+    return {"filename": filename, "metadata": {"temporal_info": {"date_string": date_string}}}
+
+
+def test_exact_matches_rank_with_scored_hits():
+    candidates = CandidateSet()
+    for memory_id, score in (("m1", 0.9), ("m2", 0.8), ("m3", 0.7), ("m4", 0.6)):
+        candidates.add([memory_id], "caption", score)
+    candidates.add(["m1"], "text", 0.3)
+    # tagged face: no score, but an exact match
+    candidates.add(["face"], "faces")
+
+    ranked = candidates.ranked()
+    assert ranked[0] == "m1"
+    assert ranked.index("face") < ranked.index("m2")
+
+
+def test_unscored_face_hit_survives_tight_budget():
+    candidates = CandidateSet()
+    for i, score in enumerate((0.9, 0.8, 0.7, 0.6, 0.5), start=1):
+        candidates.add([f"m{i}"], "caption", score)
+    candidates.add(["m1"], "text", 0.4)
+    candidates.add(["face"], "faces")
+
+    memories = [make_memory(memory_id) for memory_id in candidates.ranked()]
+    packer = ContextPacker("who was at the party", FakeFragments(), "full", str, str, budget=2 * MEMORY_TOKENS + 50)
+    prompt = packer.pack(memories, [], [])
+
+    assert packer.report["sections"]["memories"]["kept"] == 2
+    assert "face\n" in prompt
+    assert "m1\n" in prompt
@@ -0,0 +1,34 @@
+from types import SimpleNamespace
+
+import pytest
+
+from Query.candidates import CandidateSet
+from Query.fusion import RRF_K
+from Query.query import QueryHandler
+
+
+class FakeLexicalIndex():
+    def __init__(self, ranking):
+        self.ranking = ranking
+
+    def search(self, query, topk):
+        return [(memory_id, 1.0) for memory_id in self.ranking[:topk]]
+
+
+def retrieved_items(*memory_ids):
+    return [({"memory_ids": [memory_id]}, 0.9 - 0.1 * i) for i, memory_id in enumerate(memory_ids)]
+
+
+def test_lexical_only_hit_keeps_its_fused_rank():
+    handler = SimpleNamespace(lexical_index=FakeLexicalIndex(["receipt", "a"]))
+    retrieved = {"caption": retrieved_items("a", "b"), "text": retrieved_items("b", "c")}
+    candidates = CandidateSet()
+
+    QueryHandler.filter_hybrid(handler, "receipt 4471", retrieved, candidates, topk=4, lexical_topk=10)
+
+    provenance = candidates.provenance()
+    assert provenance["receipt"]["sources"]["hybrid"] == pytest.approx(1.0 / (RRF_K + 1))
+    ranked = candidates.ranked()
+    # first in the keyword ranking only: above c, second in the text ranking only
+    assert ranked.index("receipt") < ranked.index("c")
+    assert set(ranked[:2]) == {"a", "b"}
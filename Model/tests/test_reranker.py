@@ -0,0 +1,21 @@
+from Query.reranker import RERANK_SIMILARITY_THRESHOLD, ThresholdReranker, create_reranker
+
+
+def test_fitted_threshold_is_saved_and_used_for_the_user(tmp_path):
+    # the LLM kept the events at least 0.6 similar to the query
+    scores = [0.9, 0.75, 0.6, 0.5, 0.3]
+    labels = [True, True, True, False, False]
+    threshold = ThresholdReranker.fit(scores, labels)
+    assert threshold == 0.6
+
+    ThresholdReranker.save(str(tmp_path), threshold, len(scores))
+    reranker = create_reranker("threshold", llm=None, folder=str(tmp_path))
+    assert reranker.threshold == 0.6
+
+    related, cost = reranker.rerank("query", [({"event_name": "a"}, 0.7), ({"event_name": "b"}, 0.5)])
+    assert [context["event_name"] for context, _ in related] == ["a"]
+    assert cost == 0
+
+
+def test_threshold_defaults_without_a_fitted_one(tmp_path):
+    assert ThresholdReranker.from_folder(str(tmp_path)).threshold == RERANK_SIMILARITY_THRESHOLD
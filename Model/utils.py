@@ -67,7 +67,8 @@ def count_words(text):
 
 ####################################################################################
 
-def parse_memory_to_string(memory: dict) -> str:
+def parse_memory_to_string(memory: dict, visible_text: str = None) -> str:
+    # visible_text replaces the OCR text, by default text of 100 words or more is left out
     filename = memory['filename']
 
     capture_method = memory['metadata']['capture_method']
@@ -90,8 +91,11 @@ def parse_memory_to_string(memory: dict) -> str:
     text = content.get('text', '')
     speech = content.get('speech', '')
 
-    word_count = count_words(text)
-    text_in_prompt = text if word_count < 100 else ""
+    if visible_text is not None:
+        text_in_prompt = visible_text
+    else:
+        word_count = count_words(text)
+        text_in_prompt = text if word_count < 100 else ""
 
     memory_string = f'''
 memory_id: {filename}
@@ -108,7 +112,8 @@ heard speech: {speech}
 inferred activities: {activities}\n\n'''
     return memory_string
 
-def parse_memory_to_string_lite(memory: dict) -> str:
+def parse_memory_to_string_lite(memory: dict, visible_text: str = None) -> str:
+    # visible_text replaces the OCR text, by default text of 100 words or more is left out
     filename = memory['filename']
 
     capture_method = memory['metadata']['capture_method']
@@ -131,8 +136,11 @@ def parse_memory_to_string_lite(memory: dict) -> str:
     text = content.get('text', '')
     speech = content.get('speech', '')
 
-    word_count = count_words(text)
-    text_in_prompt = text if word_count < 100 else ""
+    if visible_text is not None:
+        text_in_prompt = visible_text
+    else:
+        word_count = count_words(text)
+        text_in_prompt = text if word_count < 100 else ""
 
     memory_string = f'''
 memory_id: {filename}
@@ -173,7 +181,8 @@ def parse_knowledge_to_string(knowledge: dict) -> str:
 ####################################################################################
 ####################################################################################
 
-def parse_memory_to_string_update(memory: dict) -> str:
+def parse_memory_to_string_update(memory: dict, visible_text: str = None) -> str:
+    # visible_text replaces the OCR text, by default text of 100 words or more is left out
     filename = memory['filename']
 
     capture_method = memory['metadata']['capture_method']
@@ -197,8 +206,11 @@ def parse_memory_to_string_update(memory: dict) -> str:
     speech = content.get('speech', '')
     face_tags = content.get('face_tags', [])
 
-    word_count = count_words(text)
-    text_in_prompt = text if word_count < 100 else ""
+    if visible_text is not None:
+        text_in_prompt = visible_text
+    else:
+        word_count = count_words(text)
+        text_in_prompt = text if word_count < 100 else ""
 
     memory_string = f'''
 memory_id: {filename}